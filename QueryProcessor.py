@@ -2,83 +2,349 @@
 Code for QueryProcessor class and functions to assist.
 """
 
-from com.nb.dbms.utility_functions import check_for_string, error_exit, \
-format_string, read_table_data, generate_header, display_output, join_needed_data, check_error_in_where_clause, check_errors_in_clauses, check_errors_for_column, \
-check_errors_in_condition, check_errors_in_select
-
-
-
-AGGR_FUN = ['max', 'min', 'sum', 'avg','distinct']
+import json
+import os
+import re
+from contextlib import nullcontext
+from itertools import islice, zip_longest
+
+from com.nb.dbms.utility_functions import error_exit, \
+format_string, generate_header, table_file, row_formatter, OutputWriter, check_errors_in_clauses, check_errors_for_column, \
+check_errors_in_condition, column_types, is_typed, storage_format
+from com.nb.dbms.distinct import MEMORY_BUDGET, distinct_values
+from com.nb.dbms.grouping import aggregate_value, cached_stat, group_rows, \
+new_stat, update_row_stats
+from com.nb.dbms.indexes import SortedIndex, indexable_comparison
+from com.nb.dbms.materialized import AggregateView
+from com.nb.dbms.parallel_scan import parallel_rows, parallel_stats
+from com.nb.dbms.planner import TableStatistics, execute_plan, plan_joins
+from com.nb.dbms.plan_cache import PLAN_CACHE_SIZE, ParsedQuery, PlanCache, \
+PreparedStatement
+from com.nb.dbms.profiling import QueryProfile
+from com.nb.dbms.predicates import bind_parameters, coerce_literals, \
+columns_in, compile_predicate, conjuncts, parameter_count
+from com.nb.dbms.query_parser import parse_select
+from com.nb.dbms.result_cache import RESULT_CACHE_BYTES, RecordingWriter, \
+ResultCache
+from com.nb.dbms.sorting import external_sort, row_key, top_n
+from com.nb.dbms.table_storage import LoadedTable, TableScan, \
+file_identity, materialize, typed_rows
+from com.nb.dbms.zone_maps import ZoneMap
+from com.nb.dbms.vectorized import column_arrays, column_stats, \
+condition_mask, numpy_available
+
+
+
+CREATE_INDEX_RE = re.compile(r'^create index(?: \w+)? on (\w+) ?\( ?(\w+) ?\)$',
+                             re.IGNORECASE)
+EXPLAIN_ANALYZE_RE = re.compile(r'^explain analyze (.*)$', re.IGNORECASE)
 
 
 class QueryProcessor:
     """Class to deal with query processing"""
 
-    def __init__(self, tables_info):
+    def __init__(self, tables_info, use_cache=False, vectorized=False,
+                 memory_budget=MEMORY_BUDGET, keep_tables=False, workers=1,
+                 output_file=None, plan_cache_size=PLAN_CACHE_SIZE,
+                 zone_maps=True, profile_hook=None, materialized=True,
+                 result_cache_size=RESULT_CACHE_BYTES,
+                 result_cache_directory=None):
         """
         Default constructor
         :param tables_info: metadata about the tables present 
+        :param use_cache: answer aggregates and vectorized conditions from
+        the columnar cache of the tables, built the first time a query reads
+        a table's columns from it
+        :param vectorized: evaluate where conditions and aggregates over
+        NumPy arrays when NumPy is installed
+        :param memory_budget: number of values an operator keeps in memory
+        before spilling to temporary files
+        :param keep_tables: keep tables in memory between queries, reading
+        a table again only when its csv file changes
+        :param workers: number of processes scanning a single table's csv
+        file in parallel
+        :param output_file: file the results are written to instead of
+        stdout
+        :param plan_cache_size: number of parsed queries kept for queries
+        run again
+        :param zone_maps: skip the blocks of rows which the zone map of the
+        table shows cannot satisfy a where condition
+        :param profile_hook: function called after every query with the
+        profile of the query as a dictionary
+        :param materialized: answer aggregates without a where condition
+        from materialized aggregate views, which only read the rows
+        appended to the csv since they were last updated
+        :param result_cache_size: bytes of query results kept for queries
+        run again over unchanged files, 0 disables the result cache
+        :param result_cache_directory: directory keeping the cached results
+        between runs, None to keep them in memory only
         """
         self.tables_info = tables_info
+        self.use_cache = use_cache
+        self.vectorized = vectorized and numpy_available()
+        self.memory_budget = memory_budget
+        self.keep_tables = keep_tables
+        self.loaded_tables = {}
+        self.workers = workers
+        self.output = OutputWriter(output_file)
+        self.order_by = None
+        self.limit = None
+        self.group_by = None
+        self.typed = False
+        self.plan_cache = PlanCache(plan_cache_size)
+        self.zone_maps = zone_maps
+        self.profile_hook = profile_hook
+        self.materialized = materialized
+        self.result_cache = ResultCache(result_cache_size,
+                                        result_cache_directory)
+        self.profile = None
+        self.last_profile = None
+        # rows, filtered rows and aggregate stats read once by the shared
+        # scan of a batch of queries, see batch.QueryBatch
+        self.shared_tables = {}
+        self.shared_filters = {}
+        self.shared_stats = {}
 
 
     def populate_tables_data(self, tables):
-        """ Read the table and populate the tables_data dictionary"""
+        """ Populate the tables_data dictionary with a lazy scan of every
+        table"""
         tables_data = {}
         for i in range(0, len(tables)):
             tables[i] = format_string(tables[i])
             if tables[i] not in self.tables_info.keys():
                 error_exit('No Such Table \'' + tables[i] + '\' Exists')
-            tables_data[tables[i]] = read_table_data(tables[i])
+            tables_data[tables[i]] = self.open_table(tables[i])
         return tables_data
 
+    def open_table(self, table):
+        """ Returns the rows of the table, from memory if it is kept there
+        and still current"""
+        if table in self.shared_tables:
+            return self.shared_tables[table]
+        loaded = self.loaded_tables.get(table)
+        if loaded is not None and loaded.is_current(self.tables_info[table]):
+            return loaded
+        scan = TableScan(table, self.tables_info[table], self.use_cache)
+        if not self.keep_tables:
+            return scan
+        loaded = LoadedTable(scan, self.tables_info[table])
+        self.loaded_tables[table] = loaded
+        return loaded
+
+    def scan_in_parallel(self, table_data):
+        """ Whether the table should be scanned by the worker processes"""
+        return self.workers > 1 and isinstance(table_data, TableScan) and \
+            table_data.storage == 'csv' and \
+            self.order_by is None and self.limit is None
+
     def process_query(self, query):
-        """Processes the given query and prints the output"""
+        """Processes the given query and prints the output. A query given
+        as `explain analyze <query>` is run without printing its result and
+        its profile is printed as JSON instead"""
+        explain = EXPLAIN_ANALYZE_RE.match(format_string(query))
+        if explain is None and self.profile_hook is None:
+            try:
+                self.run_query(query)
+            finally:
+                self.output.flush()
+            return
+        output = self.output
+        if explain is not None:
+            query = explain.group(1)
+            self.output = OutputWriter(os.devnull)
+        self.profile = QueryProfile(format_string(query))
+        failed = True
+        try:
+            self.run_query(query)
+            failed = False
+        finally:
+            if explain is not None:
+                self.output.close()
+                self.output = output
+            self.last_profile = self.profile.report(failed)
+            self.profile = None
+            if explain is not None:
+                self.output.write_line(json.dumps(self.last_profile))
+            self.output.flush()
+            if self.profile_hook is not None:
+                self.profile_hook(self.last_profile)
+
+    def traced(self, stage, rows, measure=False):
+        """ Returns the rows, counted and timed as the output of the stage
+        when the query is profiled"""
+        if self.profile is None:
+            return rows
+        return self.profile.rows(stage, rows, measure=measure)
+
+    def timed(self, stage):
+        """ Returns a context manager timing its block as part of the
+        stage when the query is profiled"""
+        if self.profile is None:
+            return nullcontext()
+        return self.profile.timed(stage)
+
+    def run_query(self, query, parameters=()):
+        """Parses and executes the given query"""
         query = format_string(query)
 
-        if not check_for_string('from', query.split()):
-            error_exit("Syntax Error: No Table Selected")
-         
-        #check for errors in select part of the query
-        check_errors_in_select(query)
-        lis = query.split('from')  
-        project = format_string(str(lis[0])) # contains a list of columns to be selected in the result
-        remaining = format_string(str(lis[1])) # remaining part of the query, including 'where'
-        
-        clauses = remaining.split('where')
-        
-        tables = format_string(clauses[0]) 
-        tables = tables.split(',')
-        tables_data = self.populate_tables_data(tables)
-
-        required = project[len('select '):]
-        required = format_string(required)
-        required = required.split(',')
-
-        columns, process_function, process_distinct = self.process_select(required)
-        
-        check_errors_in_clauses(clauses, columns, process_function,process_distinct)
-        self.execute_query(clauses, tables, tables_data, columns,process_function, process_distinct)
-
-    def execute_query(self, clauses, tables, tables_data, columns,
+        if query.lower().startswith('create index'):
+            self.create_index(query)
+            return
+        plan = self.plan_for(query)
+        if self.result_cache.size <= 0 or self.profile is not None:
+            # a profiled query is executed to measure it, not answered from
+            # the cache
+            self.run_parsed(plan, parameters)
+            return
+        self.run_cached(query, plan, parameters)
+
+    def run_cached(self, query, plan, parameters=()):
+        """Writes the result of the parsed query from the result cache,
+        or executes it and caches its result if the files of its tables do
+        not change meanwhile"""
+        key = self.result_key(query, plan, parameters)
+        if key is None:
+            self.run_parsed(plan, parameters)
+            return
+        lines = self.result_cache.get(key)
+        if lines is not None:
+            self.output.write_lines(lines)
+            return
+        output = self.output
+        self.output = RecordingWriter(output, self.result_cache.size)
+        try:
+            self.run_parsed(plan, parameters)
+        finally:
+            recorder, self.output = self.output, output
+        if recorder.lines is not None and \
+                self.result_key(query, plan, parameters) == key:
+            self.result_cache.put(key, recorder.lines)
+
+    def result_key(self, query, plan, parameters):
+        """Returns the key of the query's result in the result cache: the
+        query, its parameters, and the columns, storage format and file
+        identity of every table it reads. None if a file is missing"""
+        versions = []
+        for table in plan.tables:
+            columns = self.tables_info[table]
+            storage = storage_format(columns)
+            try:
+                identity = file_identity(table_file(table, storage))
+            except OSError:
+                return None
+            versions.append((table, tuple(columns),
+                             tuple(column_types(columns)), storage, identity))
+        return query, tuple(parameters), tuple(versions)
+
+    def prepare(self, query):
+        """Parses and checks the query once and returns a statement which
+        runs it with values for the '?' in its where condition"""
+        return PreparedStatement(self, format_string(query))
+
+    def plan_for(self, query):
+        """Returns the parsed query from the plan cache, parsing it if it
+        is not cached"""
+        with self.timed('parse'):
+            plan = self.plan_cache.get(query, self.tables_info)
+            if plan is None:
+                plan = self.parse_query(query)
+                self.plan_cache.put(query, plan)
+        return plan
+
+    def parse_query(self, query):
+        """Parses the formatted select query and checks it for errors"""
+        statement = parse_select(query)
+        for table in statement.tables:
+            if table not in self.tables_info:
+                error_exit('No Such Table \'' + table + '\' Exists')
+
+        columns, process_function, process_distinct = \
+            self.process_select(statement.items)
+        check_errors_in_clauses(statement.condition, columns, process_function,
+                                process_distinct, statement.group_by)
+        if statement.group_by is None and \
+                (statement.order_by is not None or
+                 statement.limit is not None) and \
+                (process_function or process_distinct):
+            error_exit('ERR: Order by and limit can only be given to project '
+                       'columns')
+        return ParsedQuery(self.tables_info, statement.tables,
+                           statement.items, columns, process_function,
+                           process_distinct, statement.condition,
+                           statement.order_by, statement.limit,
+                           statement.group_by,
+                           parameter_count(statement.condition))
+
+    def run_parsed(self, plan, parameters=()):
+        """Executes the parsed query with the parameters in place of the
+        '?' in its where condition"""
+        tables = list(plan.tables)
+        condition = coerce_literals(bind_parameters(plan.condition,
+                                                    parameters),
+                                    self.column_type_resolver(tables))
+        self.order_by, self.limit = plan.order_by, plan.limit
+        self.group_by = plan.group_by
+        self.typed = any(is_typed(self.tables_info[table]) for table in tables)
+        if self.materialized and condition is None and \
+                self.group_by is None and plan.functions and \
+                self.materialized_aggregate(plan.functions, tables):
+            return
+        with self.timed('open'):
+            tables_data = self.populate_tables_data(tables)
+        if self.group_by is not None:
+            self.process_group_by(plan.required, condition, tables,
+                                  tables_data)
+            return
+        self.execute_query(condition, tables, tables_data, plan.columns,
+                           plan.functions, plan.distinct)
+
+    def create_index(self, query):
+        """Builds the index asked for by `create index [name] on table
+        (column)`"""
+        match = CREATE_INDEX_RE.match(query)
+        if match is None:
+            error_exit('Syntax Error: expected \'create index on <table> '
+                       '(<column>)\'')
+        table, column = match.group(1), match.group(2)
+        if table not in self.tables_info:
+            error_exit('No Such Table \'' + table + '\' Exists')
+        check_errors_for_column(column, self.tables_info[table], table)
+        if storage_format(self.tables_info[table]) != 'csv':
+            error_exit('ERR: Indexes can only be created on tables stored '
+                       'as csv')
+        TableScan(table)
+        SortedIndex(table, column,
+                    self.tables_info[table].index(column)).build()
+        self.output.write_line('Index created on ' + table + '.' + column)
+
+    def execute_query(self, condition, tables, tables_data, columns,
                       function_process, distinct_process):
         """ Decides the type of query and appropriately processes it"""
-        if len(clauses) > 1 and len(tables) == 1:
+        if condition is not None and len(tables) == 1:
             # Single table where condition
-            self.process_where(clauses[1], columns,
+            self.process_where(condition, columns,
                                tables[0], tables_data[tables[0]])
-        elif len(clauses) > 1 and len(tables) > 1:
-            self.process_where_join(clauses[1], columns,
-                                    tables, tables_data)
+        elif condition is not None and len(tables) > 1:
+            self.process_join(columns, tables, self.read_tables(tables_data),
+                              condition)
         elif len(function_process) != 0:
             self.process_aggregate(function_process, tables, tables_data)
         elif len(distinct_process) != 0:
             self.process_distinct(distinct_process, tables, tables_data)
         elif len(tables) > 1:
-            self.process_join(columns, tables, tables_data)
+            self.process_join(columns, tables, self.read_tables(tables_data))
         else:
             self.process_project(columns, tables[0], tables_data)
 
+    def read_tables(self, tables_data):
+        """ Reads every table into memory for a join"""
+        if self.profile is None:
+            return materialize(tables_data)
+        return materialize(dict(
+            (table, self.traced('scan', rows, measure=True))
+            for table, rows in tables_data.items()))
+
     def process_project(self, columns, table, tables_data):
         """ Deals with project operation without in a single table"""
         if len(columns) == 1 and columns[0] == '*':
@@ -87,178 +353,387 @@ class QueryProcessor:
             if column not in self.tables_info[table]:
                 error_exit('No Such column \'' + column +
                            '\' found i  n the given table \'' + table + '\' ')
-        print(generate_header(table, columns))
+        project = self.column_positions(table, columns)
 
-        for data in tables_data[table]:
-            ans = ''
-            for column in columns:
-                ans += data[self.tables_info[table].index(column)] + ','
-            print(ans.strip(','))
+        if self.scan_in_parallel(tables_data[table]):
+            self.output.write_line(generate_header(table, columns))
+            self.output.write_lines(self.traced('parallel scan', parallel_rows(
+                table_file(table), self.workers, project,
+                types=column_types(self.tables_info[table]))))
+            return
+        self.write_rows(generate_header(table, columns),
+                        self.traced('scan', tables_data[table], measure=True),
+                        project, self.column_resolver(table))
+
+    def write_rows(self, header, rows, project, resolve):
+        """ Writes the header and the projected rows, applying the order by
+        and limit clauses of the query. resolve maps a column name to its
+        position in the rows"""
+        if self.order_by is not None:
+            try:
+                key = row_key([resolve(name) for name, _ in self.order_by],
+                              [desc for _, desc in self.order_by])
+            except NameError as error:
+                error_exit('ERR: No Such Column \'' + str(error) +
+                           '\' found in order by')
+            with self.timed('sort'):
+                if self.limit is not None:
+                    rows = top_n(rows, self.limit, key)
+                else:
+                    rows = external_sort(rows, key, self.memory_budget)
+            rows = self.traced('sort', rows)
+        elif self.limit is not None:
+            rows = self.traced('limit', islice(rows, self.limit))
+        with self.timed('output'):
+            self.output.write_line(header)
+            self.output.write_lines(self.traced('project', map(
+                row_formatter(project, self.typed), rows)))
+
+    def column_positions(self, table, columns):
+        """ Returns the positions of the columns in a row of the table"""
+        for column in columns:
+            check_errors_for_column(column, self.tables_info[table], table)
+        return [self.tables_info[table].index(column) for column in columns]
 
     def process_distinct(self, distinct_process, tables, tables_data):
         """ Process the queries with distinct """
-        column_data = {}
-        max_len = 0
+        column_data = []
         header = ''
         for column in distinct_process:
             table, column = self.search_column(column, tables)
             header += table + '.' + column + ','
-            data = []
-            for row in tables_data[table]:
-                value = row[self.tables_info[table].index(column)]
-                if value not in data:
-                    data.append(value)
-            column_data[column] = data
-            max_len = max(max_len, len(tables_data[table]))
-        print(header.strip(','))
-        for i in range(max_len):
-            ans = ''
-            for column in column_data:
-                if i < len(column_data[column]):
-                    ans += column_data[column][i] + ','
-                else:
-                    ans += ','
-            print(ans.strip(','))
+            index = self.tables_info[table].index(column)
+            column_data.append(self.traced('distinct', distinct_values(
+                (row[index] for row in self.traced(
+                    'scan', tables_data[table], measure=True)),
+                self.memory_budget)))
+        with self.timed('output'):
+            self.output.write_line(header.strip(','))
+            for values in zip_longest(*column_data):
+                ans = ''
+                for value in values:
+                    if value is not None:
+                        ans += str(value) + ','
+                    else:
+                        ans += ','
+                self.output.write_line(ans.strip(','))
 
-    def process_join(self, columns, tables, tables_data):
-        """Deals with Join type queries"""
+    def process_join(self, columns, tables, tables_data, tree=None):
+        """Deals with queries over several tables, with or without a where
+        condition tree. Only the tables referenced by the query are joined"""
         columns_in_table, tables_needed = self.get_tables_columns(columns, tables)
-        join_data = []
-
-        if len(tables_needed) == 2:
-            table1 = tables_needed[0]
-            table2 = tables_needed[1]
-            for item1 in tables_data[table1]:
-                for item2 in tables_data[table2]:
-                    join_data.append(item1 + item2)
-            display_output(tables_needed, columns_in_table, self.tables_info,
-                           join_data, join=True)
-        else:
-            display_output(tables_needed, columns_in_table, self.tables_info,
-                           tables_data, join=False)
+        locate = self.column_locator(tables)
+        needed = set(tables_needed)
+        if tree is not None:
+            needed |= set(locate(name)[0] for name in columns_in(tree))
+        join_tables = [table for table in tables if table in needed]
+        statistics = dict((table, TableStatistics(tables_data[table]))
+                          for table in join_tables)
+        wrap = None
+        if self.profile is not None:
+            # the join reads the rows of the tables scanned before it
+            self.profile.stage('join', self.profile.last_rows_stage)
+            wrap = self.profile.counted
+        with self.timed('join'):
+            plan = plan_joins(join_tables, tree, locate, statistics)
+            widths = dict((table, len(self.tables_info[table]))
+                          for table in join_tables)
+            typed = dict((table, self.typed_positions(table))
+                         for table in join_tables)
+            join_data = execute_plan(plan, tables_data, locate, widths, typed,
+                                     wrap)
+        if self.profile is not None:
+            self.profile.plan = plan.describe()
+            join_data = self.traced('join', join_data)
+
+        header = []
+        project = []
+        for table in tables_needed:
+            offset = sum(widths[other] for other in
+                         join_tables[:join_tables.index(table)])
+            header.append(generate_header(table, columns_in_table[table]))
+            project += [offset + position for position in
+                        self.column_positions(table, columns_in_table[table])]
+        def resolve(name):
+            table, position = locate(name)
+            if table not in join_tables:
+                raise NameError(name)
+            return position + sum(widths[other] for other in
+                                  join_tables[:join_tables.index(table)])
+        self.write_rows(','.join(header), join_data, project, resolve)
+
+    def column_locator(self, tables):
+        """Returns a function mapping a column name in a query over the
+        tables to its table and its position in a row of that table"""
+        def locate(name):
+            table, column = self.search_column(name, tables)
+            check_errors_for_column(column, self.tables_info[table], table)
+            return table, self.tables_info[table].index(column)
+        return locate
 
     def process_where(self, condition, columns, table, table_data):
-        """ Process where clause on a single table"""
-        condition = format_string(condition)
+        """ Process where condition tree on a single table"""
         if len(columns) == 1 and columns[0] == '*':
             columns = self.tables_info[table]
-        print(generate_header(table, columns))
-        for row in table_data:
-            evaluator = self.generate_evaluator(condition, table,
-                                                row)
-            ans = ''
-            if eval(evaluator):
-                for column in columns:
-                    ans += row[self.tables_info[table].index(column)] + ','
-                print(ans.strip(','))
-
-    def process_where_join(self, condition, columns, tables, tables_data):
-        """ Deals with Join type queries with where """
-        condition = format_string(condition)
-        sentence = condition
-        operators = ['<', '>', '=']
-        oper = ''
-        if 'and' in condition:
-            condition = condition.split('and')
-            oper = 'and'
-        elif 'or' in condition:
-            condition = condition.split('or')
-            oper = 'or'
-        else:
-            condition = [condition]
-        if len(condition) > 2:
-            error_exit('Maximum one AND clause can be given')
-        condition1 = condition[0]
-        for operator in operators:
-            if operator in condition1:
-                condition1 = condition1.split(operator)
-        if len(condition1) == 2 and '.' in condition1[1]:
-            self.process_where_normal_join([condition, oper], columns,
-                                           tables, tables_data)
+        try:
+            predicate = self.compile_condition(condition, table)
+        except NameError as error:
+            error_exit('No Such column \'' + str(error) +
+                       '\' found in the given table \'' + table + '\'')
+        rows = self.shared_filters.get((table, condition))
+        if rows is None:
+            rows = self.indexed_where(condition, table, predicate)
+        if rows is None:
+            rows = self.zone_where(condition, table, table_data, predicate)
+        if rows is None and self.scan_in_parallel(table_data):
+            self.parallel_where(condition, columns, table)
             return
-        self.process_where_special_join(sentence, columns, tables,
-                                        tables_data)
-
-    def process_where_special_join(self, sentence, columns, tables,
-                                   tables_data):
-        """Process the special case of where"""
-        oper = ''
-        if 'and' in sentence.lower().split():
-            oper = 'and'
-            condition = sentence.split('and')
-        elif 'or' in sentence.lower():
-            oper = 'or'
-            condition = sentence.split('or')
-        else:
-            condition = [sentence]
-        needed_data = self.get_needed_data(condition, tables, tables_data)
-        columns_in_table, tables_needed = self.get_tables_columns(columns,
-                                                                  tables)
-        join_data = join_needed_data(oper, tables_needed, needed_data,
-                                     tables_data)
-        display_output(tables_needed, columns_in_table, self.tables_info,
-                       join_data, True)
-
-    def process_where_normal_join(self, clauses, columns, tables,
-                                  tables_data):
-        """ Processes the where clause with join condition"""
-        needed_data = {}
-        failed_data = {}
-        operators = ['<', '>', '=']
-        for condition in clauses[0]:
-            needed = []
-            oper = ''
-            condition = format_string(condition)
-            for operator in operators:
-                if operator in condition:
-                    needed = condition.split(operator)
-                    oper = operator
-                    if oper == '=':
-                        oper *= 2
-                    break
-            if len(needed) > 2:
-                error_exit('Error in where clause')
-            columns_condition, _ = self.get_tables_columns(
-                needed, tables)
-            table1 = tables[0]
-            table2 = tables[1]
-
-            check_errors_for_column(columns_condition[table1][0],
-                                    self.tables_info[table1], table1)
-            check_errors_for_column(columns_condition[table2][0],
-                                    self.tables_info[table2], table2)
-            column1 = self.tables_info[table1].index(
-                columns_condition[table1][0])
-            column2 = self.tables_info[table2].index(
-                columns_condition[table2][0])
-
-            failed_data[condition] = []
-            needed_data[condition] = []
-            for data in tables_data[table1]:
-                for row in tables_data[table2]:
-                    evaluator = data[column1] + oper + row[column2]
-                    if eval(evaluator):
-                        needed_data[condition].append(data + row)
-                    else:
-                        failed_data[condition].append(data + row)
-        if clauses[1] != '':
-            join_data = join_needed_data(clauses[1],
-                                         clauses[0], needed_data, failed_data)
+        if rows is None and self.vectorized:
+            with self.timed('vectorized filter'):
+                rows = self.vectorized_where(condition, table, table_data)
+        if rows is None:
+            rows = (row for row in self.traced('scan', table_data,
+                                               measure=True)
+                    if predicate(row))
+        rows = self.traced('filter', rows)
+        project = self.column_positions(table, columns)
+        self.write_rows(generate_header(table, columns), rows, project,
+                        self.column_resolver(table))
+
+    def parallel_where(self, condition, columns, table):
+        """ Filters and projects the table in the worker processes"""
+        resolve = self.column_resolver(table)
+        positions = dict((name, resolve(name)) for name in
+                         columns_in(condition))
+        project = self.column_positions(table, columns)
+        self.output.write_line(generate_header(table, columns))
+        self.output.write_lines(self.traced('parallel scan', parallel_rows(
+            table_file(table), self.workers, project, condition, positions,
+            column_types(self.tables_info[table]))))
+
+    def indexed_where(self, condition, table, predicate):
+        """ Finds the rows satisfying the condition through an index on a
+        column compared with a number in the condition. Returns None if no
+        such index exists"""
+        if storage_format(self.tables_info[table]) != 'csv':
+            return None
+        resolve = self.column_resolver(table)
+        for comparison in conjuncts(condition):
+            indexable = indexable_comparison(comparison)
+            if indexable is None:
+                continue
+            name, oper, value = indexable
+            position = resolve(name)
+            index = SortedIndex(table, self.tables_info[table][position],
+                                position)
+            if index.exists() and index.load():
+                rows = typed_rows(index.read_rows(index.lookup(oper, value)),
+                                  table, column_types(self.tables_info[table]))
+                return (row for row in self.traced('index scan', rows,
+                                                   measure=True)
+                        if predicate(row))
+        return None
+
+    def zone_where(self, condition, table, table_data, predicate):
+        """ Finds the rows satisfying the condition in the blocks of the
+        table which the zone map shows may hold some. Returns None if no
+        block can be skipped"""
+        if not self.zone_maps:
+            return None
+        zones = ZoneMap(table, self.tables_info[table])
+        if not zones.load():
+            return None
+        blocks = zones.candidate_blocks(condition, self.column_resolver(table))
+        if len(blocks) == len(zones.blocks):
+            return None
+        rows = zones.read_blocks(blocks, table_data)
+        return (row for row in self.traced('zone scan', rows, measure=True)
+                if predicate(row))
+
+    def vectorized_where(self, condition, table, table_data):
+        """ Filters the table with a boolean mask computed over NumPy
+        arrays of the columns in the condition. Returns None if the
+        condition cannot be vectorized"""
+        resolve = self.column_resolver(table)
+        indices = set(resolve(name) for name in columns_in(condition))
+        arrays = column_arrays(table_data, indices)
+        if arrays is None:
+            return None
+        mask = condition_mask(condition, resolve, arrays)
+        if mask is None:
+            return None
+        return (row for row, keep in zip(self.traced(
+            'scan', table_data, measure=True), mask) if keep)
+
+    def process_group_by(self, required, condition, tables, tables_data):
+        """ Deals with group by queries on a single table. The selected
+        columns must be grouping columns, every aggregate is computed for
+        every group in one pass over the rows"""
+        if len(tables) > 1:
+            error_exit('ERR: Group by can only be given to a single table')
+        table = tables[0]
+
+        def position_of(name):
+            table_here, column = self.search_column(name, tables)
+            return self.column_positions(table_here, [column])[0]
+
+        keys = [position_of(name) for name in self.group_by]
+        header, items, positions, labels = [], [], [], {}
+        for item in required:
+            if item[0] == 'distinct':
+                error_exit('ERR: Distinct cannot be given with group by')
+            if item[0] == 'column':
+                position = position_of(item[1])
+                if position not in keys:
+                    error_exit('ERR: Column \'' + item[1] +
+                               '\' must appear in group by')
+                column = self.tables_info[table][position]
+                items.append(('key', keys.index(position)))
+                header.append(table + '.' + column)
+                labels[column] = labels[table + '.' + column] = len(items) - 1
+                continue
+            function_name, column_name = item[1], item[2]
+            if column_name == '*':
+                if function_name != 'count':
+                    error_exit('ERR: \'*\' can only be given to count')
+                positions.append(None)
+                header.append(table + '.*')
+            else:
+                positions.append(position_of(column_name))
+                header.append(table + '.' +
+                              self.tables_info[table][positions[-1]])
+            items.append(('aggregate', function_name, len(positions) - 1))
+            labels[(function_name + '(' + column_name + ')').lower()] = \
+                len(items) - 1
+
+        if condition is None:
+            rows = self.traced('scan', tables_data[table], measure=True)
         else:
-            join_data = []
-            for key in needed_data.keys():
-                for data in needed_data[key]:
-                    join_data.append(data)
-        columns, tables = self.get_tables_columns(columns, tables)
-        display_output(tables, columns, self.tables_info, join_data, True)
+            try:
+                predicate = self.compile_condition(condition, table)
+            except NameError as error:
+                error_exit('No Such column \'' + str(error) +
+                           '\' found in the given table \'' + table + '\'')
+            rows = self.shared_filters.get((table, condition))
+            if rows is None:
+                rows = self.indexed_where(condition, table, predicate)
+            if rows is None:
+                rows = self.zone_where(condition, table, tables_data[table],
+                                       predicate)
+            if rows is None:
+                rows = (row for row in self.traced(
+                    'scan', tables_data[table], measure=True)
+                        if predicate(row))
+            rows = self.traced('filter', rows)
+
+        def output_rows():
+            for key, stats in group_rows(rows, keys, positions,
+                                         self.memory_budget):
+                yield [key[item[1]] if item[0] == 'key' else
+                       aggregate_value(item[1], stats[item[2]])
+                       for item in items]
+
+        def resolve(name):
+            if name in labels:
+                return labels[name]
+            if name.lower().replace(' ', '') in labels:
+                return labels[name.lower().replace(' ', '')]
+            raise NameError(name)
+        self.write_rows(','.join(header), self.traced('aggregate',
+                                                      output_rows()),
+                        list(range(len(items))), resolve)
 
     def process_aggregate(self, queries, tables, tables_data):
         """Deals with aggregate functions and distinct"""
-        header, result = '', ''
+        header, needed = self.aggregate_columns(queries, tables)
+
+        # one pass over every table computes all of its aggregates
+        stats = {}
+        with self.timed('aggregate'):
+            for table in tables:
+                indices = set(index for _, tab, index in needed
+                              if tab == table and
+                              (tab, index) not in self.shared_stats)
+                if not indices:
+                    continue
+                table_stats = {}
+                arrays = None
+                if self.vectorized:
+                    arrays = column_arrays(tables_data[table],
+                                           indices - {None})
+                for index in indices:
+                    stat = None
+                    if arrays is not None and index is not None:
+                        stat = column_stats(arrays[index])
+                    if stat is None:
+                        stat = cached_stat(tables_data[table], index)
+                    if stat is not None:
+                        stats[(table, index)] = stat
+                    else:
+                        table_stats[index] = new_stat()
+                if table_stats and \
+                        not is_typed(self.tables_info[table]) and \
+                        self.scan_in_parallel(tables_data[table]):
+                    table_stats = parallel_stats(table_file(table),
+                                                 self.workers,
+                                                 list(table_stats))
+                elif table_stats:
+                    for row in self.traced('scan', tables_data[table],
+                                           measure=True):
+                        update_row_stats(table_stats, row)
+                for index, stat in table_stats.items():
+                    stats[(table, index)] = stat
+        stats.update(self.shared_stats)
+        self.write_aggregates(header, needed, stats)
+
+    def materialized_aggregate(self, queries, tables):
+        """Writes the aggregate functions from the materialized aggregate
+        views of the tables. Returns False, writing nothing, if some
+        function cannot be answered from them"""
+        header, needed = self.aggregate_columns(queries, tables)
+        views = {}
+        stats = {}
+        with self.timed('aggregate'):
+            for _, table, index in needed:
+                if table not in views:
+                    views[table] = AggregateView(table, self.tables_info[table])
+                    if not views[table].refresh():
+                        return False
+                stats[(table, index)] = views[table].stat(index)
+                if stats[(table, index)] is None:
+                    return False
+        self.write_aggregates(header, needed, stats)
+        return True
+
+    def write_aggregates(self, header, needed, stats):
+        """Writes the header and the values of the aggregate functions
+        from the stats of their columns"""
+        result = ''
+        for function_name, table, index in needed:
+            result += aggregate_value(function_name, stats[(table, index)])
+            result += ','
+        self.output.write_line(header)
+        self.output.write_line(result)
+
+    def aggregate_columns(self, queries, tables):
+        """Returns the header of the aggregate functions and the
+        (function, table, column position) of every one of them, the
+        position of count(*) being None"""
+        header = ''
+        needed = []
         for query in queries:
             function_name = query[0]
             column_name = query[1]
             table, column = '', ''
+            if column_name == '*':
+                if function_name.lower() != 'count':
+                    error_exit('ERR: \'*\' can only be given to count')
+                if len(tables) > 1:
+                    error_exit('ERR: count(*) can only be given to a single '
+                               'table')
+                header += tables[0] + '.*,'
+                needed.append(('count', tables[0], None))
+                continue
             if '.' in column_name:
                 table, column = column_name.split('.')
             else:
@@ -273,23 +748,10 @@ class QueryProcessor:
                 elif cnt > 1:
                     error_exit('Ambiguous column name \'' +
                                column_name + '\' given')
-            data = []
             header += table + '.' + column + ','
-            for row in tables_data[table]:
-                data.append(int(row[self.tables_info[table].index(column)]))
-
-            if function_name.lower() == 'max':
-                result += str(max(data))
-            elif function_name.lower() == 'min':
-                result += str(min(data))
-            elif function_name.lower() == 'sum':
-                result += str(sum(data))
-            elif function_name.lower() == 'avg':
-                result += str(float(sum(data)) / len(data))
-            result += ','
-        header.strip(',')
-        print(header)
-        print(result)
+            needed.append((function_name.lower(), table,
+                           self.tables_info[table].index(column)))
+        return header, needed
 
     def get_tables_columns(self, columns, tables):
         """ Selects required tables and columns in it"""
@@ -310,49 +772,54 @@ class QueryProcessor:
             columns_in_table[table].append(column)
         return columns_in_table, tables_needed
 
-    def generate_evaluator(self, condition, table, data):
-        """Generates the evaluator string for single table where"""
-        condition = condition.split(' ')
-        evaluator = ''
-        for i in condition:
-            i = format_string(i)
-            if i == '=':
-                evaluator += i * 2
-            elif i.lower() == 'and' or i.lower == 'or':
-                evaluator += ' ' + i.lower() + ' '
-            elif '.' in i:
-                table_here, column = self.search_column(i, [table])
+    def compile_condition(self, condition, table):
+        """Compiles the where condition tree on a single table into a
+        predicate taking a row of the table"""
+        predicate = compile_predicate(condition, self.column_resolver(table),
+                                      self.typed_positions(table))
+        if self.profile is not None:
+            return self.profile.counted(predicate)
+        return predicate
+
+    def typed_positions(self, table):
+        """Returns the positions of the columns of the table whose values
+        are compared as they are in its rows"""
+        return [position for position, kind in
+                enumerate(column_types(self.tables_info[table]))
+                if kind is not None]
+
+    def column_resolver(self, table):
+        """Returns a function mapping a column name in a where condition on
+        the table to its position in a row"""
+        def resolve(name):
+            if '.' in name:
+                table_here, column = self.search_column(name, [table])
                 check_errors_in_condition(column, table, table_here,
                                           self.tables_info[table])
-                evaluator += data[self.tables_info[table_here].index(column)]
-            elif i in self.tables_info[table]:
-                evaluator += data[self.tables_info[table].index(i)]
+                return self.tables_info[table].index(column)
+            if name in self.tables_info[table]:
+                return self.tables_info[table].index(name)
+            raise NameError(name)
+        return resolve
+
+    def column_type_resolver(self, tables):
+        """Returns a function mapping a column name in a query over the
+        tables to its declared type, or None if it has none or is unknown"""
+        def type_of(name):
+            if '.' in name:
+                table, column = [format_string(part)
+                                 for part in name.split('.', 1)]
+                candidates = [table] if table in tables else []
             else:
-                evaluator += i
-        return evaluator
-
-    def get_needed_data(self, condition, tables, tables_data):
-        """ Gets needed data for where clause"""
-        operators = ['<', '>', '=']
-        needed_data = {}
-        for query in condition:
-            needed = []
-            for operator in operators:
-                if operator in query:
-                    needed = query.split(operator)
-                    break
-            check_error_in_where_clause(needed)
-            table, column = self.search_column(format_string(needed[0]), tables)
-            needed_data[table] = []
-            query = query.replace(needed[0], ' ' + column + ' ')
-            for data in tables_data[table]:
-                evaluator = self.generate_evaluator(query, table, data)
-                try:
-                    eval(evaluator)
-                    needed_data[table].append(data)
-                except NameError:
-                    error_exit('AND clause cannot be used in join queries')
-        return needed_data
+                column = name
+                candidates = [table for table in tables
+                              if column in self.tables_info[table]]
+            if len(candidates) != 1 or \
+                    column not in self.tables_info[candidates[0]]:
+                return None
+            columns = self.tables_info[candidates[0]]
+            return column_types(columns)[columns.index(column)]
+        return type_of
 
     def search_column(self, column, tables):
         """Searches for column in list of tables"""
@@ -376,27 +843,17 @@ class QueryProcessor:
         return table_needed, column
 
 
-    def process_select(self, required):
-        """Process the select part of the query and return tokens"""
+    def process_select(self, items):
+        """Splits the items of the select clause into the projected
+        columns, the aggregate functions and the distinct columns"""
         columns = []
         function_process = []
         distinct_process = []
-        for item in required:
-            taken = False
-            item = format_string(item)
-            for func in AGGR_FUN:
-                if func + '(' in item.lower():
-                    if ')' not in item:
-                        error_exit('Syntax Error: \')\' expected ')
-                    taken = True
-                    column_name = item.strip(')').split(func + '(')[1]
-                    if func == 'distinct':
-                        distinct_process.append(column_name)
-                    else:
-                        function_process.append([func, column_name])
-                    break
-            if not taken:
-                item = format_string(item)
-                if item != '':
-                    columns.append(item.strip('()'))
-        return columns, function_process, distinct_process
\ No newline at end of file
+        for item in items:
+            if item[0] == 'aggregate':
+                function_process.append([item[1], item[2]])
+            elif item[0] == 'distinct':
+                distinct_process.append(item[1])
+            else:
+                columns.append(item[1])
+        return columns, function_process, distinct_process
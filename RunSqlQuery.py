@@ -1,23 +1,141 @@
 """
 Main runner file for sql engine
 """
+import argparse
+import json
 import sys
 
 from com.nb.dbms.QueryProcessor import QueryProcessor
-from com.nb.dbms.utility_functions import read_meta
+from com.nb.dbms.batch import QueryBatch
+from com.nb.dbms.result_cache import RESULT_CACHE_BYTES
+from com.nb.dbms.table_storage import file_version
+from com.nb.dbms.utility_functions import format_string, read_meta
 
 
 METAFILE = 'metadata.txt'
+PROMPT = 'sql> '
+END_OF_RESULT = ';'  # written after every result when reading from a pipe
+
+
+def parse_arguments():
+    """ Parses the command line arguments"""
+    parser = argparse.ArgumentParser(description='Mini sql engine')
+    parser.add_argument('queries', nargs='?',
+                        help='queries to run, separated by \';\'')
+    parser.add_argument('-i', '--interactive', action='store_true',
+                        help='read queries from stdin, keeping the tables '
+                             'in memory between queries')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='read every table once for all the queries, '
+                             'in a scan shared by their filters and '
+                             'aggregates')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='processes scanning a large table in parallel')
+    parser.add_argument('-o', '--output',
+                        help='file to write the results to instead of stdout')
+    parser.add_argument('-c', '--cache-dir',
+                        help='directory keeping query results between runs, '
+                             'reused while the tables\' files are unchanged')
+    parser.add_argument('--column-cache', action='store_true',
+                        help='answer aggregates from a columnar copy of '
+                             'every table, built by the first aggregate '
+                             'over it')
+    parser.add_argument('-p', '--profile',
+                        help='file to append the profile of every query to, '
+                             'one JSON object per line')
+    arguments = parser.parse_args()
+    if arguments.queries is None and not arguments.interactive:
+        parser.error('no queries given')
+    return arguments
 
 
 def main():
     """ The Main function. Initiates the sql engine functioning"""
-    queries = str(sys.argv[1]).split(';')
-    query_processor = QueryProcessor(read_meta(METAFILE))
+    arguments = parse_arguments()
+    if arguments.interactive:
+        run_interactive(arguments.workers, arguments.output,
+                        arguments.profile, arguments.cache_dir,
+                        arguments.column_cache)
+        return
+    queries = str(arguments.queries).split(';')
+    # a single run rarely repeats a query, so results are only recorded
+    # when they are kept on disk for the following runs
+    query_processor = QueryProcessor(read_meta(METAFILE),
+                                     workers=arguments.workers,
+                                     output_file=arguments.output,
+                                     profile_hook=profile_logger(
+                                         arguments.profile),
+                                     result_cache_size=RESULT_CACHE_BYTES
+                                     if arguments.cache_dir is not None
+                                     else 0,
+                                     result_cache_directory=arguments.cache_dir,
+                                     use_cache=arguments.column_cache)
+    if arguments.batch:
+        QueryBatch(query_processor, queries).run()
+        return
     for query in queries:
         if query != '':
             query_processor.process_query(query)
 
 
+def profile_logger(file_name):
+    """ Returns the profile hook appending every profile to the file as a
+    line of JSON, or None if no file is given"""
+    if file_name is None:
+        return None
+
+    def log_profile(profile):
+        with open(file_name, 'a') as profile_file:
+            profile_file.write(json.dumps(profile) + '\n')
+    return log_profile
+
+
+def read_lines():
+    """ Yields the lines typed by the user or piped to stdin"""
+    if not sys.stdin.isatty():
+        for line in sys.stdin:
+            yield line
+        return
+    while True:
+        try:
+            yield input(PROMPT)
+        except EOFError:
+            return
+
+
+def run_interactive(workers=1, output_file=None, profile_file=None,
+                    cache_dir=None, column_cache=False):
+    """ Runs queries read from stdin, one or more per line, keeping the
+    metadata and the tables in memory between queries. When stdin is a
+    pipe every result is followed by a line holding END_OF_RESULT"""
+    meta_version = file_version(METAFILE)
+    query_processor = QueryProcessor(read_meta(METAFILE), keep_tables=True,
+                                     workers=workers, output_file=output_file,
+                                     profile_hook=profile_logger(profile_file),
+                                     result_cache_directory=cache_dir,
+                                     use_cache=column_cache)
+    piped = not sys.stdin.isatty()
+    for line in read_lines():
+        if format_string(line).lower() in ('quit', 'exit'):
+            break
+        try:
+            if file_version(METAFILE) != meta_version:
+                meta_version = file_version(METAFILE)
+                query_processor.tables_info = read_meta(METAFILE)
+        except (OSError, SystemExit):
+            pass
+        for query in line.split(';'):
+            if format_string(query) == '':
+                continue
+            try:
+                query_processor.process_query(query)
+            except SystemExit:
+                # error_exit already reported the error
+                pass
+            if piped:
+                print(END_OF_RESULT)
+            sys.stdout.flush()
+
+
 if __name__ == '__main__':
     main()
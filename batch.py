@@ -0,0 +1,135 @@
+"""
+Batches of queries run together, reading every table they reference
+once in a scan shared by the filters and aggregates of all the queries
+"""
+from com.nb.dbms.grouping import cached_stat, new_stat, update_row_stats
+from com.nb.dbms.predicates import bind_parameters, coerce_literals
+from com.nb.dbms.table_storage import LoadedTable
+from com.nb.dbms.utility_functions import QueryError, format_string, \
+raised_errors
+
+
+class TableReaders:
+    """What the queries of a batch read from one table: the stats of the
+    columns given to aggregate functions, the rows satisfying single table
+    where conditions and whether every row is needed"""
+
+    def __init__(self):
+        self.stats = set()
+        self.filters = {}
+        self.keep = False
+
+
+class QueryBatch:
+    """Queries analyzed up front so that every table referenced by them
+    is scanned once. Aggregates without a where condition are computed
+    and single table where conditions evaluated during that scan, the
+    rows of tables needed by other queries are kept in memory for the
+    whole batch. The results are written query by query in their order"""
+
+    def __init__(self, query_processor, queries):
+        """
+        Default constructor
+        :param query_processor: QueryProcessor running the queries
+        :param queries: the queries of the batch
+        """
+        self.query_processor = query_processor
+        self.queries = [query for query in queries
+                        if format_string(query) != '']
+        self.readers = {}
+
+    def run(self):
+        """ Scans the tables and runs every query of the batch"""
+        query_processor = self.query_processor
+        for query in self.queries:
+            quietly(self.analyze, query)
+        try:
+            for table, readers in self.readers.items():
+                quietly(self.scan, table, readers)
+            for query in self.queries:
+                query_processor.process_query(query)
+        finally:
+            query_processor.shared_tables = {}
+            query_processor.shared_filters = {}
+            query_processor.shared_stats = {}
+
+    def readers_of(self, table):
+        """ Returns the readers of the table, adding it to the tables
+        scanned by the batch"""
+        if table not in self.readers:
+            self.readers[table] = TableReaders()
+        return self.readers[table]
+
+    def analyze(self, query):
+        """ Records what the query reads from every table. Queries which
+        are not selects are left to run on their own"""
+        query_processor = self.query_processor
+        query = format_string(query)
+        if query.lower().startswith('explain analyze '):
+            query = format_string(query[len('explain analyze '):])
+        if query.lower().startswith('create index'):
+            return
+        plan = query_processor.plan_for(query)
+        tables = list(plan.tables)
+        condition = coerce_literals(
+            bind_parameters(plan.condition, ()),
+            query_processor.column_type_resolver(tables))
+        if condition is None and plan.group_by is None and plan.functions:
+            if query_processor.materialized:
+                # answered from the materialized aggregate views
+                return
+            _, needed = query_processor.aggregate_columns(plan.functions,
+                                                          tables)
+            for _, table, index in needed:
+                self.readers_of(table).stats.add(index)
+        elif condition is not None and len(tables) == 1:
+            self.readers_of(tables[0]).filters[condition] = \
+                query_processor.compile_condition(condition, tables[0])
+        else:
+            for table in tables:
+                self.readers_of(table).keep = True
+
+    def scan(self, table, readers):
+        """ Reads the table once, computing the stats, filtering the rows
+        and keeping them as the batch's readers of the table need"""
+        query_processor = self.query_processor
+        source = query_processor.open_table(table)
+        stats = {}
+        for index in readers.stats:
+            stat = cached_stat(source, index)
+            if stat is not None:
+                query_processor.shared_stats[(table, index)] = stat
+            else:
+                stats[index] = new_stat()
+        filters = [(predicate, []) for predicate in readers.filters.values()]
+        keep = readers.keep and not isinstance(source, list)
+        if stats or filters or keep:
+            kept = []
+            for row in source:
+                if stats:
+                    update_row_stats(stats, row)
+                for predicate, rows in filters:
+                    if predicate(row):
+                        rows.append(row)
+                if keep:
+                    kept.append(row)
+            if keep:
+                source = LoadedTable(source, query_processor.tables_info[table],
+                                     kept)
+        for index, stat in stats.items():
+            query_processor.shared_stats[(table, index)] = stat
+        for condition, (_, rows) in zip(readers.filters, filters):
+            query_processor.shared_filters[(table, condition)] = rows
+        query_processor.shared_tables[table] = source
+
+
+def quietly(function, *args):
+    """ Calls function(*args), ignoring the errors of a query in it: the
+    errors it reports and the unknown column names met while compiling its
+    condition. The query reports them again when its turn comes. Other
+    errors are raised as they would be running the query on its own"""
+    try:
+        with raised_errors():
+            function(*args)
+    except (QueryError, NameError):
+        pass
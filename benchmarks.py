@@ -0,0 +1,568 @@
+"""
+Benchmarks for the mini sql engine
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from bisect import bisect_left
+from itertools import accumulate
+
+from com.nb.dbms.QueryProcessor import QueryProcessor
+from com.nb.dbms.batch import QueryBatch
+from com.nb.dbms.compressed import write_blocks
+from com.nb.dbms.planner import TableStatistics, execute_plan, plan_joins
+from com.nb.dbms.predicates import parse_condition
+from com.nb.dbms.query_parser import parse_select
+from com.nb.dbms.query_service import QueryClient, QueryService, \
+ServiceError
+from com.nb.dbms.table_storage import TableScan, cache_directory
+from com.nb.dbms.utility_functions import TableColumns, read_meta, \
+table_file
+
+
+JOIN_SIZES = [250, 500, 1000, 2000]
+OR_JOIN_SIZES = [1000, 2000, 10000]
+NESTED_LOOP_LIMIT = 2000  # largest size the nested loop join is timed at
+OR_CONDITION = 't1.a = t2.b or t1.b < t2.a'
+PARSE_ROUNDS = 2000
+QUERY_CORPUS = [
+    'select * from table1',
+    'select A, B from table1 where A > 10',
+    'select max(A), min(B), sum(C), avg(A) from table1',
+    'select distinct(B) from table1',
+    'select count(*), sum(A) from table1 where A > 0 and B < 5 group by B',
+    'select table1.A, table2.D from table1, table2 '
+    'where table1.B = table2.B and table2.D > 3',
+    'select A from table1 where (A > 2 or C < 30) and (B = 7 or B = 3) '
+    'and not_a_keyword != 4 order by A desc, B limit 10',
+    'select brand, format from orders where brand = \'x\' or format = ?',
+]
+SUITE_DIRECTORY = 'benchmark_data'
+SUITE_ROWS = 100000
+SUITE_CARDINALITY = 1000
+SUITE_SKEW = 1.0
+SUITE_REPEAT = 5
+SUITE_SEED = 42
+BANDS = 20
+REGRESSION_TOLERANCE = 1.25  # slowdown of the median reported as regression
+DATA_ARGUMENTS = ['rows', 'cardinality', 'skew', 'seed', 'typed']
+TABLES = [('facts', ['ID', 'K', 'V', 'T']), ('dims', ['DK', 'W']),
+          ('bands', ['LO', 'HI'])]
+WORKLOAD = [
+    ('project', 'select ID, V from facts'),
+    ('where', 'select ID, V from facts where V < 100'),
+    ('where_range', 'select ID from facts where T >= 1000 and T < 1500'),
+    ('hash_join', 'select ID, W from facts, dims '
+                  'where facts.K = dims.DK and V < 50'),
+    ('range_join', 'select DK, LO from dims, bands where W >= LO and W < HI'),
+    ('aggregate', 'select max(V), min(V), sum(V), avg(V) from facts'),
+    ('distinct', 'select distinct(K) from facts'),
+    ('group_by', 'select K, count(*), sum(V) from facts group by K'),
+    ('order_limit', 'select ID, V from facts order by V desc limit 10'),
+]
+LOAD_CLIENTS = 8
+LOAD_REQUESTS = 20  # queries sent by every client
+BATCH_SIZE = 50
+BATCH_QUERIES = [
+    'select ID, V from facts where V < %d',
+    'select max(V), min(T), sum(V) from facts',
+    'select DK from dims where W > %d',
+    'select max(W), avg(W) from dims',
+    'select LO, HI from bands where LO >= %d',
+]
+
+
+def generate_rows(count, cardinality, width=2):
+    """ Generates count rows of random integer strings"""
+    rows = []
+    for _ in range(count):
+        rows.append([str(random.randint(0, cardinality))
+                     for _ in range(width)])
+    return rows
+
+
+def time_call(function, *args):
+    """ Returns the wall time taken by function(*args) and its result"""
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def join_plan(rows1, rows2, hashed):
+    """ Plans `t1.a = t2.b` over the two tables, as a hash join or, if
+    hashed is False, as a nested loop join"""
+    locate = lambda name: (name.split('.')[0], 0 if name == 't1.a' else 1)
+    statistics = {'t1': TableStatistics(rows1), 't2': TableStatistics(rows2)}
+    tree = parse_condition('t1.a = t2.b')
+    plan = plan_joins(['t1', 't2'], tree, locate, statistics)
+    if not hashed:
+        plan.steps[1].equality = None
+        plan.steps[1].conditions = [tree]
+    return lambda: execute_plan(plan, {'t1': rows1, 't2': rows2}, locate,
+                                {'t1': 2, 't2': 2})
+
+
+def benchmark_join(sizes=None):
+    """ Compares the nested loop join with the hash join on equality
+    conditions for growing table sizes
+    """
+    random.seed(0)
+    print('rows,nested_loop_s,hash_join_s,speedup')
+    for size in sizes or JOIN_SIZES:
+        rows1 = generate_rows(size, size)
+        rows2 = generate_rows(size, size)
+        nested_time, nested = time_call(join_plan(rows1, rows2, False))
+        hash_time, hashed = time_call(join_plan(rows1, rows2, True))
+        if nested != hashed:
+            sys.stderr.write('ERR: hash join output differs at ' +
+                             str(size) + ' rows\n')
+        print('%d,%.4f,%.4f,%.1fx' % (size, nested_time, hash_time,
+                                      nested_time / max(hash_time, 1e-9)))
+
+
+def or_join_plan(rows1, rows2, union):
+    """ Plans OR_CONDITION over the two tables, as a union join over the
+    access paths of its disjuncts or, if union is False, as a nested loop
+    join"""
+    locate = lambda name: (name.split('.')[0],
+                           0 if name.endswith('.a') else 1)
+    statistics = {'t1': TableStatistics(rows1), 't2': TableStatistics(rows2)}
+    plan = plan_joins(['t1', 't2'], parse_condition(OR_CONDITION), locate,
+                      statistics)
+    if not union:
+        plan.steps[1].union = None
+    return lambda: execute_plan(plan, {'t1': rows1, 't2': rows2}, locate,
+                                {'t1': 2, 't2': 2})
+
+
+def benchmark_or_join(sizes=None):
+    """ Compares the nested loop join with the union join on an OR of an
+    equality and a comparison for growing table sizes. The nested loop
+    join is only run up to NESTED_LOOP_LIMIT rows
+    """
+    random.seed(0)
+    print('rows,nested_loop_s,union_join_s,result_rows')
+    for size in sizes or OR_JOIN_SIZES:
+        rows1 = generate_rows(size, size)
+        # the comparison matches about one row of t2 in size for every row
+        rows2 = [[str(size - size * int(a)), b]
+                 for a, b in generate_rows(size, size)]
+        union_time, unioned = time_call(or_join_plan(rows1, rows2, True))
+        nested_time = float('nan')
+        if size <= NESTED_LOOP_LIMIT:
+            nested_time, nested = time_call(or_join_plan(rows1, rows2, False))
+            if nested != unioned:
+                sys.stderr.write('ERR: union join output differs at ' +
+                                 str(size) + ' rows\n')
+        print('%d,%.4f,%.4f,%d' % (size, nested_time, union_time,
+                                   len(unioned)))
+
+
+def benchmark_parse(rounds=PARSE_ROUNDS):
+    """ Measures how many queries of every shape in the corpus are parsed
+    into a syntax tree per second
+    """
+    print('query,parses_per_s')
+    total_time = 0.0
+    for query in QUERY_CORPUS:
+        elapsed, _ = time_call(lambda: [parse_select(query)
+                                        for _ in range(rounds)])
+        total_time += elapsed
+        print('"%s",%.0f' % (query, rounds / max(elapsed, 1e-9)))
+    print('"all",%.0f' % (rounds * len(QUERY_CORPUS) /
+                          max(total_time, 1e-9)))
+
+
+def skewed_keys(count, cardinality, skew):
+    """ Returns count keys in [0, cardinality) drawn from a zipf like
+    distribution, key i having weight 1 / (i + 1) ** skew. A skew of 0
+    draws uniform keys"""
+    weights = list(accumulate(1.0 / (key + 1) ** skew
+                              for key in range(cardinality)))
+    return [bisect_left(weights, random.random() * weights[-1])
+            for _ in range(count)]
+
+
+def generate_tables(directory=SUITE_DIRECTORY, rows=SUITE_ROWS,
+                    cardinality=SUITE_CARDINALITY, skew=SUITE_SKEW,
+                    seed=SUITE_SEED, typed=False):
+    """ Writes metadata.txt and the csv files of the benchmark tables into
+    directory. facts has rows rows with a key K of the given cardinality
+    and skew, a uniform value V and an increasing time T. dims has one row
+    per key and bands BANDS ranges over its W column. typed declares every
+    column as int in the metadata. The same arguments always produce the
+    same files"""
+    random.seed(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, 'metadata.txt'), 'w') as meta_file:
+        for table, columns in TABLES:
+            if typed:
+                columns = [column + ' int' for column in columns]
+            meta_file.write('<begin_table>\n' + table + '\n' +
+                            '\n'.join(columns) + '\n<end_table>\n')
+    keys = skewed_keys(rows, cardinality, skew)
+    with open(os.path.join(directory, 'facts.csv'), 'w') as data_file:
+        moment = 0
+        for i, key in enumerate(keys):
+            moment += random.randint(0, 2)
+            data_file.write('%d,%d,%d,%d\n' % (i, key, random.randint(0, 999),
+                                              moment))
+    with open(os.path.join(directory, 'dims.csv'), 'w') as data_file:
+        for key in range(cardinality):
+            data_file.write('%d,%d\n' % (key, random.randint(0, 999)))
+    with open(os.path.join(directory, 'bands.csv'), 'w') as data_file:
+        width = 1000 // BANDS
+        for band in range(BANDS):
+            data_file.write('%d,%d\n' % (band * width, (band + 1) * width))
+
+
+def percentile(latencies, fraction):
+    """ Returns the latency below which the fraction of the sorted
+    latencies fall, by the nearest rank"""
+    rank = max(int(round(fraction * len(latencies))), 1)
+    return latencies[min(rank, len(latencies)) - 1]
+
+
+def run_workload(directory=SUITE_DIRECTORY, repeat=SUITE_REPEAT):
+    """ Runs every query of the workload repeat times through
+    QueryProcessor.process_query, after one run warming up the caches, and
+    returns a dictionary mapping the name of every query to its latency
+    percentiles in seconds and throughput in queries per second"""
+    current = os.getcwd()
+    os.chdir(directory)
+    try:
+        query_processor = QueryProcessor(read_meta('metadata.txt'),
+                                         output_file=os.devnull,
+                                         result_cache_size=0)
+        results = {}
+        for name, query in WORKLOAD:
+            query_processor.process_query(query)
+            latencies = []
+            for _ in range(repeat):
+                elapsed, _ = time_call(query_processor.process_query, query)
+                latencies.append(elapsed)
+            latencies.sort()
+            results[name] = {'p50': percentile(latencies, 0.5),
+                             'p95': percentile(latencies, 0.95),
+                             'p99': percentile(latencies, 0.99),
+                             'qps': len(latencies) / sum(latencies)}
+        return results
+    finally:
+        os.chdir(current)
+
+
+def benchmark_batch(arguments):
+    """ Compares running BATCH_SIZE report queries over the benchmark
+    tables one at a time with running them as a batch sharing one scan of
+    every table
+    """
+    generate_tables(arguments.directory, arguments.rows,
+                    arguments.cardinality, arguments.skew, arguments.seed,
+                    arguments.typed)
+    queries = [BATCH_QUERIES[i % len(BATCH_QUERIES)].replace('%d', str(i))
+               for i in range(BATCH_SIZE)]
+    current = os.getcwd()
+    os.chdir(arguments.directory)
+    try:
+        tables_info = read_meta('metadata.txt')
+        QueryProcessor(tables_info, output_file=os.devnull).process_query(
+            queries[0])
+        query_processor = QueryProcessor(tables_info, output_file=os.devnull,
+                                         result_cache_size=0)
+        single_time, _ = time_call(lambda: [query_processor.process_query(
+            query) for query in queries])
+        query_processor = QueryProcessor(tables_info, output_file=os.devnull,
+                                         result_cache_size=0)
+        batch_time, _ = time_call(QueryBatch(query_processor, queries).run)
+    finally:
+        os.chdir(current)
+    print('queries,one_by_one_s,batch_s,speedup')
+    print('%d,%.4f,%.4f,%.1fx' % (len(queries), single_time, batch_time,
+                                  single_time / max(batch_time, 1e-9)))
+
+
+async def load_client(client, queries, latencies, errors):
+    """ Sends the queries one after the other on the connection, adding
+    the latency of every query to latencies and its error to errors"""
+    try:
+        for query in queries:
+            start = time.time()
+            try:
+                await client.query(query)
+            except ServiceError as error:
+                errors.append(error.message)
+            latencies.append(time.time() - start)
+    finally:
+        await client.close()
+
+
+async def run_load(connect, clients, requests):
+    """ Runs clients connections at once, each sending requests queries
+    of the workload, and returns the wall time, the latencies of the
+    queries and their errors"""
+    latencies, errors = [], []
+    connections = [await connect() for _ in range(clients)]
+    start = time.time()
+    await asyncio.gather(*[load_client(
+        client, [WORKLOAD[(number + i) % len(WORKLOAD)][1]
+                 for i in range(requests)], latencies, errors)
+        for number, client in enumerate(connections)])
+    return time.time() - start, latencies, errors
+
+
+async def load_service(arguments):
+    """ Load tests the service at the address given in the arguments, or
+    one started on the benchmark tables if no address is given"""
+    if arguments.port is not None or arguments.socket is not None:
+        return await run_load(lambda: QueryClient.connect(
+            arguments.host, arguments.port, arguments.socket),
+            arguments.clients, arguments.requests)
+    generate_tables(arguments.directory, arguments.rows,
+                    arguments.cardinality, arguments.skew, arguments.seed,
+                    arguments.typed)
+    current = os.getcwd()
+    os.chdir(arguments.directory)
+    service = QueryService(read_meta('metadata.txt'), result_cache_size=0)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'service.sock')
+            server = await service.start(path=path)
+            async with server:
+                return await run_load(lambda: QueryClient.connect(path=path),
+                                      arguments.clients, arguments.requests)
+    finally:
+        service.close()
+        os.chdir(current)
+
+
+def benchmark_load(arguments):
+    """ Sends the workload queries to a query service from concurrent
+    clients and reports the throughput and the latency percentiles
+    """
+    elapsed, latencies, errors = asyncio.run(load_service(arguments))
+    latencies.sort()
+    print('clients,queries,errors,qps,p50_s,p95_s,p99_s')
+    print('%d,%d,%d,%.1f,%.4f,%.4f,%.4f' % (
+        arguments.clients, len(latencies), len(errors),
+        len(latencies) / max(elapsed, 1e-9), percentile(latencies, 0.5),
+        percentile(latencies, 0.95), percentile(latencies, 0.99)))
+    for error in sorted(set(errors)):
+        sys.stderr.write(error + '\n')
+
+
+def write_gzip(source, target):
+    """ Compresses the source file into a gzip file of one stream"""
+    with open(source, 'rb') as data_file, gzip.open(target, 'wb') as out:
+        out.write(data_file.read())
+
+
+def benchmark_compressed(arguments):
+    """ Compares scanning the facts table from its csv file, from a gzip
+    file decompressed as one stream and from a gzip file in blocks
+    decompressed in parallel
+    """
+    generate_tables(arguments.directory, arguments.rows,
+                    arguments.cardinality, arguments.skew, arguments.seed,
+                    arguments.typed)
+    current = os.getcwd()
+    os.chdir(arguments.directory)
+    try:
+        columns = read_meta('metadata.txt')['facts']
+        compressed = TableColumns(columns, columns.types, 'gzip')
+        print('format,file_mb,scan_s,rows')
+        for label, write in [
+                ('csv', None),
+                ('gzip', write_gzip),
+                ('gzip blocks', write_blocks)]:
+            table = columns
+            if write is not None:
+                write(table_file('facts'), table_file('facts', 'gzip'))
+                table = compressed
+            elapsed, rows = time_call(
+                lambda: sum(1 for _ in TableScan('facts', table)))
+            size = os.path.getsize(table_file('facts', table.storage))
+            print('%s,%.1f,%.4f,%d' % (label, size / 1e6, elapsed, rows))
+        os.remove(table_file('facts', 'gzip'))
+    finally:
+        os.chdir(current)
+
+
+def benchmark_result_cache(arguments):
+    """ Compares running every workload query with and without the
+    result cache, once the cache holds its result
+    """
+    generate_tables(arguments.directory, arguments.rows,
+                    arguments.cardinality, arguments.skew, arguments.seed,
+                    arguments.typed)
+    current = os.getcwd()
+    os.chdir(arguments.directory)
+    try:
+        tables_info = read_meta('metadata.txt')
+        uncached = QueryProcessor(tables_info, output_file=os.devnull,
+                                  result_cache_size=0)
+        cached = QueryProcessor(tables_info, output_file=os.devnull)
+        print('query,uncached_s,cached_s')
+        for name, query in WORKLOAD:
+            cached.process_query(query)
+            uncached_time, _ = time_call(uncached.process_query, query)
+            cached_time, _ = time_call(cached.process_query, query)
+            print('%s,%.4f,%.6f' % (name, uncached_time, cached_time))
+    finally:
+        os.chdir(current)
+
+
+def benchmark_column_cache(arguments):
+    """ Compares running every workload query from the csv files alone
+    with running it with the columnar cache, first when the cache is built
+    and then once it is. Zone maps, views and the result cache are off
+    """
+    generate_tables(arguments.directory, arguments.rows,
+                    arguments.cardinality, arguments.skew, arguments.seed,
+                    arguments.typed)
+    current = os.getcwd()
+    os.chdir(arguments.directory)
+    try:
+        tables_info = read_meta('metadata.txt')
+        for table in tables_info:
+            shutil.rmtree(cache_directory(table), ignore_errors=True)
+        options = {'output_file': os.devnull, 'zone_maps': False,
+                   'materialized': False, 'result_cache_size': 0}
+        plain = QueryProcessor(tables_info, **options)
+        cached = QueryProcessor(tables_info, use_cache=True, **options)
+        print('query,csv_s,cache_first_s,cache_s')
+        for name, query in WORKLOAD:
+            plain_time, _ = time_call(plain.process_query, query)
+            first_time, _ = time_call(cached.process_query, query)
+            cached_time, _ = time_call(cached.process_query, query)
+            print('%s,%.4f,%.4f,%.4f' % (name, plain_time, first_time,
+                                         cached_time))
+    finally:
+        os.chdir(current)
+
+
+def compare_runs(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """ Prints the median latency of every query against the baseline and
+    returns the names of the queries slower than tolerance times their
+    baseline"""
+    regressions = []
+    print('query,baseline_p50_s,p50_s,ratio')
+    for name, _ in WORKLOAD:
+        if name not in baseline:
+            continue
+        ratio = results[name]['p50'] / max(baseline[name]['p50'], 1e-9)
+        print('%s,%.4f,%.4f,%.2f' % (name, baseline[name]['p50'],
+                                     results[name]['p50'], ratio))
+        if ratio > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def benchmark_suite(arguments):
+    """ Generates the benchmark tables, runs the workload on them and
+    reports the results, comparing them with a stored baseline if one is
+    given. Exits with an error when a query regressed
+    """
+    generate_tables(arguments.directory, arguments.rows,
+                    arguments.cardinality, arguments.skew, arguments.seed,
+                    arguments.typed)
+    results = run_workload(arguments.directory, arguments.repeat)
+    print('query,p50_s,p95_s,p99_s,qps')
+    for name, _ in WORKLOAD:
+        result = results[name]
+        print('%s,%.4f,%.4f,%.4f,%.1f' % (name, result['p50'], result['p95'],
+                                          result['p99'], result['qps']))
+    run = {'rows': arguments.rows, 'cardinality': arguments.cardinality,
+           'skew': arguments.skew, 'seed': arguments.seed,
+           'typed': arguments.typed, 'results': results}
+    if arguments.save is not None:
+        with open(arguments.save, 'w') as run_file:
+            json.dump(run, run_file, indent=2, sort_keys=True)
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if [baseline.get(key) for key in DATA_ARGUMENTS] != \
+                [run[key] for key in DATA_ARGUMENTS]:
+            sys.stderr.write('WARNING: baseline was run on other data\n')
+        regressions = compare_runs(results, baseline['results'],
+                                   arguments.tolerance)
+        if regressions:
+            sys.stderr.write('ERR: regressions in ' + ', '.join(regressions) +
+                             '\n')
+            sys.exit(-1)
+
+
+def parse_arguments():
+    """ Parses the command line arguments"""
+    parser = argparse.ArgumentParser(description='Mini sql engine benchmarks')
+    parser.add_argument('benchmark', nargs='?', default='join',
+                        help='join, or_join, parse, generate, suite, '
+                             'batch, load, compressed, result_cache or '
+                             'column_cache')
+    parser.add_argument('--directory', default=SUITE_DIRECTORY,
+                        help='directory of the generated tables')
+    parser.add_argument('--rows', type=int, default=SUITE_ROWS,
+                        help='rows of the facts table')
+    parser.add_argument('--cardinality', type=int, default=SUITE_CARDINALITY,
+                        help='distinct keys of the facts table')
+    parser.add_argument('--skew', type=float, default=SUITE_SKEW,
+                        help='zipf exponent of the key distribution')
+    parser.add_argument('--seed', type=int, default=SUITE_SEED,
+                        help='seed of the generated data')
+    parser.add_argument('--typed', action='store_true',
+                        help='declare the generated columns as int')
+    parser.add_argument('--repeat', type=int, default=SUITE_REPEAT,
+                        help='timed runs of every query')
+    parser.add_argument('--clients', type=int, default=LOAD_CLIENTS,
+                        help='connections of the load test')
+    parser.add_argument('--requests', type=int, default=LOAD_REQUESTS,
+                        help='queries sent by every load test connection')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address of the query service to load test')
+    parser.add_argument('--port', type=int,
+                        help='port of the query service to load test, one '
+                             'is started on the benchmark tables if neither '
+                             'port nor socket is given')
+    parser.add_argument('--socket',
+                        help='Unix socket of the query service to load test')
+    parser.add_argument('--save', help='file to store the results in')
+    parser.add_argument('--baseline',
+                        help='results stored by an earlier run to compare to')
+    parser.add_argument('--tolerance', type=float,
+                        default=REGRESSION_TOLERANCE,
+                        help='slowdown of a median latency over the baseline '
+                             'reported as a regression')
+    return parser.parse_args()
+
+
+def main():
+    """ Runs the benchmark given as the first argument"""
+    arguments = parse_arguments()
+    benchmarks = {'join': benchmark_join, 'or_join': benchmark_or_join,
+                  'parse': benchmark_parse,
+                  'generate': lambda: generate_tables(
+                      arguments.directory, arguments.rows,
+                      arguments.cardinality, arguments.skew, arguments.seed,
+                      arguments.typed),
+                  'suite': lambda: benchmark_suite(arguments),
+                  'batch': lambda: benchmark_batch(arguments),
+                  'load': lambda: benchmark_load(arguments),
+                  'compressed': lambda: benchmark_compressed(arguments),
+                  'result_cache': lambda: benchmark_result_cache(arguments),
+                  'column_cache': lambda: benchmark_column_cache(arguments)}
+    name = arguments.benchmark
+    if name not in benchmarks:
+        sys.stderr.write('No such benchmark \'' + name + '\'\n')
+        sys.exit(-1)
+    benchmarks[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Tables stored as gzip compressed csv files. A file written in blocks,
+each a gzip member of whole lines which records its own compressed size,
+is decompressed by several threads at once. Any other gzip file is
+decompressed as one stream. Block files are read by gzip tools as usual
+"""
+import argparse
+import csv
+import gzip
+import io
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from com.nb.dbms.utility_functions import error_exit, table_file
+
+
+BLOCK_BYTES = 1024 * 1024  # uncompressed bytes of lines in a block
+DECODE_THREADS = min(os.cpu_count() or 1, 4)
+BLOCKS_AHEAD = 2  # blocks decoded ahead of the rows read, per thread
+SUBFIELD = b'BL'  # gzip extra subfield holding the size of a block
+# magic, deflate, FEXTRA flag, mtime, extra flags, unknown os, extra length,
+# then the subfield id and length
+HEADER = b'\x1f\x8b\x08\x04' + b'\x00' * 4 + b'\x00\xff' + \
+    struct.pack('<H', 8) + SUBFIELD + struct.pack('<H', 4)
+HEADER_BYTES = len(HEADER) + 4
+TRAILER_BYTES = 8
+
+
+def compress_block(data, level=6):
+    """ Returns the gzip member holding the bytes, with its size in the
+    extra field of its header"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    size = HEADER_BYTES + len(body) + TRAILER_BYTES
+    return HEADER + struct.pack('<I', size) + body + \
+        struct.pack('<II', zlib.crc32(data), len(data) & 0xFFFFFFFF)
+
+
+def write_blocks(source, target, block_bytes=BLOCK_BYTES):
+    """ Compresses the lines of the source file into a block file"""
+    with open(source, 'rb') as data_file, open(target, 'wb') as out:
+        lines = []
+        size = 0
+        for line in data_file:
+            lines.append(line)
+            size += len(line)
+            if size >= block_bytes:
+                out.write(compress_block(b''.join(lines)))
+                lines, size = [], 0
+        if lines:
+            out.write(compress_block(b''.join(lines)))
+
+
+def block_ranges(file_name):
+    """ Returns the (offset, size) of every block of the file, or None if
+    the file is not made of blocks"""
+    ranges = []
+    offset = 0
+    end = os.path.getsize(file_name)
+    with open(file_name, 'rb') as data_file:
+        while offset < end:
+            data_file.seek(offset)
+            header = data_file.read(HEADER_BYTES)
+            # gzip magic and deflate, FEXTRA set, then our subfield alone
+            if len(header) < HEADER_BYTES or header[:3] != HEADER[:3] or \
+                    not header[3] & 4 or \
+                    header[10:len(HEADER)] != HEADER[10:]:
+                return None
+            size = struct.unpack('<I', header[len(HEADER):])[0]
+            if size < HEADER_BYTES + TRAILER_BYTES or offset + size > end:
+                return None
+            ranges.append((offset, size))
+            offset += size
+    return ranges
+
+
+def decompress_block(data):
+    """ Returns the text of the lines in the gzip member"""
+    # zlib releases the GIL, so blocks are decompressed in parallel
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS).decode('utf-8')
+
+
+def block_lines(file_name, ranges, threads=DECODE_THREADS):
+    """ Yields the lines of the blocks in order, decompressing the next
+    blocks in a pool of threads while the rows of a block are read"""
+    with open(file_name, 'rb') as data_file, \
+            ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for offset, size in ranges:
+            data_file.seek(offset)
+            pending.append(executor.submit(decompress_block,
+                                           data_file.read(size)))
+            if len(pending) >= threads * BLOCKS_AHEAD:
+                for line in io.StringIO(pending.popleft().result(),
+                                        newline=''):
+                    yield line
+        while pending:
+            for line in io.StringIO(pending.popleft().result(), newline=''):
+                yield line
+
+
+def compressed_lines(file_name):
+    """ Yields the lines of the gzip file as they are decompressed"""
+    ranges = block_ranges(file_name)
+    if ranges is not None:
+        for line in block_lines(file_name, ranges):
+            yield line
+        return
+    with gzip.open(file_name, 'rt', encoding='utf-8',
+                   newline='') as data_file:
+        for line in data_file:
+            yield line
+
+
+def scan_compressed(table_name):
+    """ Yields the rows of the table's gzip file one at a time as they are
+    decompressed"""
+    file_name = table_file(table_name, 'gzip')
+    if not os.path.isfile(file_name):
+        error_exit('ERR: No file for given table: \'' + table_name + '\' found')
+    try:
+        for row in csv.reader(compressed_lines(file_name)):
+            yield row
+    except (OSError, EOFError, zlib.error, UnicodeDecodeError):
+        error_exit('ERR: Compressed file of table \'' + table_name +
+                   '\' is corrupt')
+
+
+def parse_arguments():
+    """ Parses the command line arguments"""
+    parser = argparse.ArgumentParser(
+        description='Compresses the csv file of a table into blocks')
+    parser.add_argument('table', help='table whose csv file is compressed')
+    parser.add_argument('--block-bytes', type=int, default=BLOCK_BYTES,
+                        help='uncompressed bytes of lines in a block')
+    return parser.parse_args()
+
+
+def main():
+    """ Writes <table>.csv.gz in blocks from <table>.csv"""
+    arguments = parse_arguments()
+    write_blocks(table_file(arguments.table),
+                 table_file(arguments.table, 'gzip'), arguments.block_bytes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Duplicate elimination for distinct queries, spilling to disk when the
+distinct values do not fit in memory
+"""
+import csv
+import heapq
+import tempfile
+
+
+MEMORY_BUDGET = 1000000  # distinct values kept in memory before spilling
+SPILL_PARTITIONS = 64
+
+
+def distinct_values(values, memory_budget=MEMORY_BUDGET):
+    """ Yields every value the first time it is seen, in the order the
+    values are given. Values are strings"""
+    seen = {}
+    values = enumerate(values)
+    for index, value in values:
+        if value not in seen:
+            seen[value] = index
+            if len(seen) > memory_budget:
+                break
+    else:
+        for value in seen:
+            yield value
+        return
+    for value in spilled_distinct_values(seen, values):
+        yield value
+
+
+def spilled_distinct_values(seen, values):
+    """ Finishes distinct_values once it runs out of memory. The
+    (position, value) pairs are hash partitioned into temporary files so
+    that the values of one partition fit in memory. Every partition is
+    deduplicated on its own and the partitions are merged back by the
+    position at which each value was first seen"""
+    partitions = [tempfile.TemporaryFile('w+', newline='')
+                  for _ in range(SPILL_PARTITIONS)]
+    writers = [csv.writer(partition) for partition in partitions]
+    for value, index in seen.items():
+        writers[hash(value) % SPILL_PARTITIONS].writerow([index, value])
+    seen.clear()
+    for index, value in values:
+        writers[hash(value) % SPILL_PARTITIONS].writerow([index, value])
+
+    deduplicated = []
+    for partition in partitions:
+        partition.seek(0)
+        first_seen = {}
+        for index, value in csv.reader(partition):
+            if value not in first_seen:
+                first_seen[value] = int(index)
+        partition.close()
+        result = tempfile.TemporaryFile('w+', newline='')
+        csv.writer(result).writerows(
+            (index, value) for value, index in first_seen.items())
+        result.seek(0)
+        deduplicated.append(result)
+        first_seen.clear()
+
+    readers = [((int(index), value) for index, value in csv.reader(result))
+               for result in deduplicated]
+    for _, value in heapq.merge(*readers):
+        yield value
+    for result in deduplicated:
+        result.close()
@@ -0,0 +1,176 @@
+"""
+Hash aggregation for group by queries, spilling partial groups to disk
+when there are more groups than fit in memory
+"""
+import heapq
+import pickle
+import tempfile
+from operator import itemgetter
+
+from com.nb.dbms.distinct import MEMORY_BUDGET, SPILL_PARTITIONS
+from com.nb.dbms.predicates import to_value
+from com.nb.dbms.sorting import read_run, write_run
+from com.nb.dbms.utility_functions import error_exit
+
+
+def new_stat():
+    """ Returns the [count, sum, min, max] of no values"""
+    return [0, 0, None, None]
+
+
+MIXED_VALUES = 'ERR: Column holds both numbers and text, which cannot be ' \
+    'compared'
+
+
+def update_stat(stat, value):
+    """ Adds a column value to the stat. The sum becomes None once a value
+    is not a number. Exits if the value cannot be compared with the
+    minimum and maximum so far"""
+    try:
+        add_value(stat, value)
+    except TypeError:
+        error_exit(MIXED_VALUES)
+
+
+def add_value(stat, value):
+    """ Adds a column value to the stat as update_stat does, raising
+    TypeError if it cannot be compared with the minimum and maximum"""
+    value = to_value(value)
+    stat[0] += 1
+    if stat[1] is not None:
+        try:
+            stat[1] += value
+        except TypeError:
+            stat[1] = None
+    if stat[2] is None or value < stat[2]:
+        stat[2] = value
+    if stat[3] is None or value > stat[3]:
+        stat[3] = value
+
+
+def update_row_stats(stats, row):
+    """ Adds the values of the row to the stat of every column position
+    in stats, the stat at a position of None counting the rows. Empty
+    values are nulls and are left out of the stats of their column"""
+    for index, stat in stats.items():
+        if index is None:
+            stat[0] += 1
+        elif row[index] != '':
+            update_stat(stat, row[index])
+
+
+def cached_stat(table_data, index):
+    """ Returns the [count, sum, min, max] of the column at index of the
+    table, or the count of its rows for an index of None, from its
+    columnar cache, or None if the cache cannot answer it"""
+    if index is None:
+        count = table_data.row_count()
+        return [count, 0, None, None] if count is not None else None
+    column = table_data.int_column(index)
+    if column is not None and len(column) > 0:
+        return [len(column), sum(column), min(column), max(column)]
+    return None
+
+
+def merge_stats(stat, other):
+    """ Adds the values counted in other to stat. Exits if their minimums
+    and maximums cannot be compared"""
+    stat[0] += other[0]
+    if stat[1] is None or other[1] is None:
+        stat[1] = None
+    else:
+        stat[1] += other[1]
+    try:
+        if other[2] is not None and (stat[2] is None or other[2] < stat[2]):
+            stat[2] = other[2]
+        if other[3] is not None and (stat[3] is None or other[3] > stat[3]):
+            stat[3] = other[3]
+    except TypeError:
+        error_exit(MIXED_VALUES)
+
+
+def aggregate_value(function_name, stat):
+    """ Returns the output text of the aggregate function over the values
+    counted in stat"""
+    count, total, minimum, maximum = stat
+    if function_name == 'count':
+        return str(count)
+    if function_name == 'max':
+        return str(maximum)
+    if function_name == 'min':
+        return str(minimum)
+    if total is None:
+        error_exit('ERR: ' + function_name + ' can only be given to numeric '
+                   'columns')
+    if function_name == 'sum':
+        return str(total)
+    return str(float(total) / count)
+
+
+def group_rows(rows, keys, positions, memory_budget=MEMORY_BUDGET):
+    """ Groups the rows on the values at the key positions and yields
+    (key values, stats) for every group in the order the groups are first
+    seen. stats holds the [count, sum, min, max] of the column at every
+    one of positions, a position of None counts the rows of the group.
+    All stats of a row are updated in the same pass"""
+    if len(keys) == 1:
+        key_position = keys[0]
+        key_of = lambda row: (row[key_position],)
+    else:
+        key_of = itemgetter(*keys)
+    groups = {}
+    partitions = None
+    for index, row in enumerate(rows):
+        key = key_of(row)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = (index, [new_stat() for _ in positions])
+        for stat, position in zip(group[1], positions):
+            if position is None:
+                stat[0] += 1
+            elif row[position] != '':
+                update_stat(stat, row[position])
+        if len(groups) > memory_budget:
+            if partitions is None:
+                partitions = [tempfile.TemporaryFile()
+                              for _ in range(SPILL_PARTITIONS)]
+            spill_groups(groups, partitions)
+    if partitions is None:
+        for key, (_, stats) in groups.items():
+            yield list(key), stats
+        return
+    spill_groups(groups, partitions)
+    for _, key, stats in merge_partitions(partitions):
+        yield list(key), stats
+
+
+def spill_groups(groups, partitions):
+    """ Writes the partial groups to the partition of their key and
+    forgets them"""
+    for key, (index, stats) in groups.items():
+        pickle.dump((index, key, stats), partitions[hash(key) % len(partitions)],
+                    pickle.HIGHEST_PROTOCOL)
+    groups.clear()
+
+
+def merge_partitions(partitions):
+    """ Combines the partial groups of every partition, which all fit in
+    memory, and merges the partitions back by the position at which each
+    group was first seen"""
+    runs = []
+    for partition in partitions:
+        partition.seek(0)
+        merged = {}
+        for index, key, stats in read_run(partition):
+            group = merged.get(key)
+            if group is None:
+                merged[key] = [index, stats]
+                continue
+            group[0] = min(group[0], index)
+            for stat, other in zip(group[1], stats):
+                merge_stats(stat, other)
+        runs.append(write_run(sorted(
+            (index, key, stats) for key, (index, stats) in merged.items())))
+        merged.clear()
+    return heapq.merge(*[read_run(run) for run in runs],
+                       key=lambda group: group[0])
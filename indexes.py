@@ -0,0 +1,152 @@
+"""
+Persistent sorted indexes on a column of a table, used to answer point
+and range conditions without scanning the whole table
+"""
+import csv
+import json
+import os
+import shutil
+from array import array
+from bisect import bisect_left, bisect_right
+
+from com.nb.dbms.predicates import to_value
+from com.nb.dbms.table_storage import file_version, map_file, \
+temporary_name
+from com.nb.dbms.utility_functions import QueryError, error_exit, \
+raised_errors, table_file
+
+
+INDEX_OPERATORS = ['=', '<', '>', '<=', '>=']
+FLIPPED = {'=': '=', '<': '>', '>': '<', '<=': '>=', '>=': '<='}
+
+
+def index_directory(table_name, column):
+    """ Returns the directory holding the index on table_name.column"""
+    return '.' + table_name + '.' + column + '.index'
+
+
+class SortedIndex:
+    """Sorted array of the values of one column with the byte offset in
+    the csv file of the row holding every value. The index is stored next
+    to the csv and rebuilt when the csv changes"""
+
+    def __init__(self, table_name, column, position):
+        """
+        Default constructor
+        :param table_name: name of the indexed table
+        :param column: name of the indexed column
+        :param position: position of the column in a row
+        """
+        self.table_name = table_name
+        self.column = column
+        self.position = position
+        self.directory = index_directory(table_name, column)
+        self.keys = None
+        self.offsets = None
+
+    def exists(self):
+        """ Checks whether the index has been created"""
+        return os.path.isdir(self.directory)
+
+    def build(self):
+        """ Reads the csv and writes the index for it. Rows with an empty
+        value in the column are left out, nulls satisfying no condition"""
+        version = file_version(table_file(self.table_name))
+        entries = []
+        kind = 'q'
+        with open(table_file(self.table_name), 'rb') as data_file:
+            offset = 0
+            for line in data_file:
+                row = next(csv.reader([line.decode('utf-8')]), None)
+                if row and self.position >= len(row):
+                    error_exit('ERR: Row without column \'' + self.column +
+                               '\' in table \'' + self.table_name + '\'')
+                if row and row[self.position].strip() != '':
+                    key = to_value(row[self.position])
+                    if isinstance(key, str):
+                        error_exit('ERR: Index can only be created on numeric '
+                                   'columns, \'' + self.column + '\' holds \'' +
+                                   key + '\'')
+                    if isinstance(key, float):
+                        kind = 'd'
+                    entries.append((key, offset))
+                offset += len(line)
+        entries.sort()
+        temp = temporary_name(self.directory)
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+        try:
+            with open(os.path.join(temp, 'keys'), 'wb') as keys_file:
+                array(kind, [key for key, _ in entries]).tofile(keys_file)
+            with open(os.path.join(temp, 'offsets'), 'wb') as offsets_file:
+                array('q', [offset for _, offset in entries]).tofile(
+                    offsets_file)
+            with open(os.path.join(temp, 'meta.json'), 'w') as meta_file:
+                json.dump({'version': version, 'type': kind,
+                           'position': self.position}, meta_file)
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.rename(temp, self.directory)
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+
+    def load(self):
+        """ Maps the index into memory, rebuilding it first if the csv has
+        changed since it was built. Returns False, removing the index, if
+        the csv now holds values which cannot be indexed"""
+        try:
+            with open(os.path.join(self.directory, 'meta.json')) as meta_file:
+                meta = json.load(meta_file)
+        except (IOError, ValueError):
+            meta = None
+        if meta is None or meta['position'] != self.position or \
+                meta['version'] != file_version(table_file(self.table_name)):
+            try:
+                with raised_errors():
+                    self.build()
+            except QueryError:
+                # the query reading the table goes on without the index
+                shutil.rmtree(self.directory, ignore_errors=True)
+                return False
+            return self.load()
+        self.keys = map_file(os.path.join(self.directory, 'keys')).cast(
+            meta['type'])
+        self.offsets = map_file(os.path.join(self.directory,
+                                             'offsets')).cast('q')
+        return True
+
+    def lookup(self, oper, value):
+        """ Returns the offsets of the rows whose column satisfies
+        `column oper value`, in the order the rows appear in the csv"""
+        start, end = 0, len(self.keys)
+        if oper in ('=', '>='):
+            start = bisect_left(self.keys, value)
+        elif oper == '>':
+            start = bisect_right(self.keys, value)
+        if oper in ('=', '<='):
+            end = bisect_right(self.keys, value)
+        elif oper == '<':
+            end = bisect_left(self.keys, value)
+        return sorted(self.offsets[start:end])
+
+    def read_rows(self, offsets):
+        """ Yields the rows starting at the given byte offsets of the csv"""
+        with open(table_file(self.table_name), 'rb') as data_file:
+            for offset in offsets:
+                data_file.seek(offset)
+                line = data_file.readline().decode('utf-8')
+                yield next(csv.reader([line]))
+
+
+def indexable_comparison(tree):
+    """ Returns (column, operator, value) if the condition tree is a
+    comparison of a column with a number that an index can answer,
+    otherwise None"""
+    if tree[0] != 'cmp' or tree[1] not in INDEX_OPERATORS:
+        return None
+    oper, left, right = tree[1], tree[2], tree[3]
+    if left[0] == 'lit' and right[0] == 'col':
+        oper, left, right = FLIPPED[oper], right, left
+    if left[0] != 'col' or right[0] != 'lit' or isinstance(right[1], str):
+        return None
+    return left[1], oper, right[1]
+
@@ -0,0 +1,182 @@
+"""
+Materialized aggregate views of append-only tables: the count, sum, min
+and max of every column, kept up to date by reading only the rows
+appended to the csv since the view was last updated
+"""
+import csv
+import json
+import os
+import zlib
+from datetime import date
+
+from com.nb.dbms.grouping import add_value, new_stat
+from com.nb.dbms.table_storage import temporary_name, typed_rows
+from com.nb.dbms.utility_functions import column_types, storage_format, \
+table_file
+
+
+CHECKED_BYTES = 4096  # bytes at the start and at the end of the consumed
+# part of the csv compared to tell appends from rewrites
+
+
+def view_file(table_name):
+    """ Returns the file holding the aggregate view of the table"""
+    return '.' + table_name + '.aggregates'
+
+
+def fingerprint(data_file, offset):
+    """ Returns checksums of the first and the last CHECKED_BYTES bytes
+    before offset in the file"""
+    data_file.seek(0)
+    head = zlib.crc32(data_file.read(min(offset, CHECKED_BYTES)))
+    data_file.seek(max(offset - CHECKED_BYTES, 0))
+    tail = zlib.crc32(data_file.read(min(offset, CHECKED_BYTES)))
+    return [head, tail]
+
+
+class AggregateView:
+    """Running [count, sum, min, max] of every column of a table, followed
+    by the count of its rows, together with the number of bytes of the csv
+    they were computed from. The view is stored next to the csv. When the
+    csv grows only the rows after that offset are read. The view is
+    computed again from the start if the csv was truncated, replaced or its
+    consumed bytes changed, or if it was rewritten in place to the same size
+    as when the view was stored"""
+
+    def __init__(self, table_name, columns):
+        """
+        Default constructor
+        :param table_name: name of the table
+        :param columns: column names of the table from the metadata
+        """
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.types = column_types(columns)
+        self.storage = storage_format(columns)
+        self.file_name = view_file(table_name)
+        self.offset = 0
+        self.stats = []
+        self.current = []
+
+    def read_meta(self):
+        """ Returns the stored view, or None if there is none"""
+        try:
+            with open(self.file_name) as view:
+                return json.load(view)
+        except (IOError, ValueError):
+            return None
+
+    def refresh(self):
+        """ Brings the view up to date with the csv, storing it if rows
+        were added. Returns False if the csv could not be read or the
+        table is not stored as csv"""
+        if self.storage != 'csv':
+            return False
+        try:
+            with open(table_file(self.table_name), 'rb') as data_file:
+                meta = self.read_meta()
+                stat = os.fstat(data_file.fileno())
+                inode, size, mtime = stat.st_ino, stat.st_size, \
+                    stat.st_mtime_ns
+                if meta is not None and meta['columns'] == self.columns and \
+                        meta['types'] == self.types and \
+                        len(meta['stats']) == len(self.columns) + 1 and \
+                        meta['inode'] == inode and meta['offset'] <= size and \
+                        (meta.get('size') != size or
+                         meta.get('mtime') == mtime) and \
+                        meta['fingerprint'] == fingerprint(data_file,
+                                                           meta['offset']):
+                    self.offset = meta['offset']
+                    self.stats = [self.decode(stat, kind) for stat, kind
+                                  in zip(meta['stats'], self.types + [None])]
+                else:
+                    meta = None
+                    self.offset = 0
+                    self.stats = [new_stat() for _ in self.columns] + \
+                        [new_stat()]
+                data_file.seek(self.offset)
+                start = self.offset
+                # a last line without a newline may still be being written,
+                # it is counted in the answer but read again next time
+                partial = []
+                self.add_rows(self.complete_lines(data_file, partial),
+                              self.stats)
+                if meta is None or self.offset > start or \
+                        meta.get('size') != size or meta.get('mtime') != mtime:
+                    self.save(inode, size, mtime,
+                              fingerprint(data_file, self.offset))
+        except (IOError, OSError):
+            return False
+        self.current = [list(stat) if stat is not None else None
+                        for stat in self.stats]
+        self.add_rows([line.decode('utf-8') for line in partial], self.current)
+        return True
+
+    def complete_lines(self, data_file, partial):
+        """ Yields the lines of the file from its position one at a time,
+        moving the offset past every line ending with a newline. A last
+        line without one is put in partial instead"""
+        for line in data_file:
+            if not line.endswith(b'\n'):
+                partial.append(line)
+                return
+            self.offset += len(line)
+            yield line.decode('utf-8')
+
+    def add_rows(self, lines, stats):
+        """ Adds the rows of the csv lines to the stats one at a time. The
+        stat of a column is set to None once it holds a value that cannot be
+        aggregated the way a scan of the table would"""
+        rows = (row for row in csv.reader(lines) if row)
+        width = len(self.columns)
+        for row in typed_rows(rows, self.table_name, self.types):
+            stats[width][0] += 1
+            for index in range(width):
+                stat = stats[index]
+                if stat is None:
+                    continue
+                if index >= len(row):
+                    stats[index] = None
+                elif row[index] != '':
+                    # empty values are nulls
+                    try:
+                        add_value(stat, row[index])
+                    except TypeError:
+                        stats[index] = None
+
+    def save(self, inode, size, mtime, checksums):
+        """ Stores the view in its file"""
+        temp = temporary_name(self.file_name)
+        with open(temp, 'w') as view:
+            json.dump({'columns': self.columns, 'types': self.types,
+                       'inode': inode, 'size': size, 'mtime': mtime,
+                       'offset': self.offset,
+                       'fingerprint': checksums,
+                       'stats': [self.encode(stat) for stat in self.stats]},
+                      view)
+        os.replace(temp, self.file_name)
+
+    def encode(self, stat):
+        """ Returns the stat with its dates written as text"""
+        if stat is None:
+            return None
+        return [value.isoformat() if isinstance(value, date) else value
+                for value in stat]
+
+    def decode(self, stat, kind):
+        """ Returns the stored stat of a column of the given type"""
+        if stat is None or kind != 'date':
+            return stat
+        return [stat[0], stat[1]] + [date.fromisoformat(value)
+                                     if value is not None else None
+                                     for value in stat[2:]]
+
+    def stat(self, index):
+        """ Returns the [count, sum, min, max] of the column at index, or
+        the count of rows for an index of None, or None if it cannot be
+        answered from the view"""
+        if index is None:
+            return self.current[-1]
+        if index >= len(self.current) - 1:
+            return None
+        return self.current[index]
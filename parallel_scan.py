@@ -0,0 +1,128 @@
+"""
+Parallel scan of a table's csv file. The file is split into byte ranges
+aligned to line boundaries which are filtered, projected and aggregated
+by a pool of worker processes
+"""
+import csv
+import io
+import os
+from multiprocessing import Pool
+
+from com.nb.dbms.grouping import merge_stats, new_stat, update_row_stats
+from com.nb.dbms.predicates import compile_predicate
+from com.nb.dbms.table_storage import typed_rows
+from com.nb.dbms.utility_functions import QueryError, error_exit, \
+raised_errors
+
+
+CHUNK_BYTES = 16 * 1024 * 1024  # largest byte range given to a worker
+CHUNKS_PER_WORKER = 4
+
+
+def chunk_ranges(file_name, workers):
+    """ Splits the file into (start, end) byte ranges which begin at the
+    start of a line and end after a newline or at the end of the file"""
+    size = os.path.getsize(file_name)
+    count = max(workers * CHUNKS_PER_WORKER, size // CHUNK_BYTES + 1)
+    boundaries = [0]
+    with open(file_name, 'rb') as data_file:
+        for i in range(1, count):
+            position = max(size * i // count, boundaries[-1])
+            if position >= size:
+                break
+            if position == 0:
+                # files smaller than count bytes start at a line already
+                continue
+            # move to the start of the line following position - 1
+            data_file.seek(position - 1)
+            data_file.readline()
+            boundaries.append(data_file.tell())
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:])
+            if start < end]
+
+
+def scan_chunk(task):
+    """ Runs in a worker. Reads the byte range of the file and returns the
+    projected lines of the rows satisfying the condition, or the count,
+    sum, minimum and maximum of every aggregated column. Given the declared
+    types of the columns, rows are typed before being filtered. An error
+    in the data is returned as its message, for the parent to report"""
+    try:
+        with raised_errors():
+            return scan_range(*task)
+    except QueryError as error:
+        return str(error)
+
+
+def scan_range(file_name, start, end, condition, positions, project,
+               aggregate, types):
+    """ Does the work of scan_chunk"""
+    predicate = None
+    typed = []
+    if types is not None:
+        typed = [position for position, kind in enumerate(types)
+                 if kind is not None]
+    if condition is not None:
+        predicate = compile_predicate(condition, positions.__getitem__, typed)
+    with open(file_name, 'rb') as data_file:
+        data_file.seek(start)
+        text = data_file.read(end - start).decode('utf-8')
+    lines = []
+    stats = dict((index, new_stat()) for index in aggregate)
+    rows = csv.reader(io.StringIO(text, newline=''))
+    if typed:
+        rows = typed_rows((row for row in rows if row), os.path.splitext(
+            os.path.basename(file_name))[0], types)
+    for row in rows:
+        if not row or (predicate is not None and not predicate(row)):
+            continue
+        if project and typed:
+            lines.append(','.join([str(row[index]) for index in project])
+                         .strip(','))
+        elif project:
+            lines.append(','.join([row[index] for index in project])
+                         .strip(','))
+        if stats:
+            update_row_stats(stats, row)
+    return lines if project else stats
+
+
+def run_chunks(file_name, workers, condition, positions, project, aggregate,
+               types=None):
+    """ Yields the result of every chunk of the file in file order, while
+    the workers go on with the following chunks"""
+    tasks = [(file_name, start, end, condition, positions, project, aggregate,
+              types) for start, end in chunk_ranges(file_name, workers)]
+    pool = Pool(workers)
+    try:
+        for result in pool.imap(scan_chunk, tasks):
+            if isinstance(result, str):
+                error_exit(result)
+            yield result
+    finally:
+        pool.terminate()
+
+
+def parallel_rows(file_name, workers, project, condition=None,
+                  positions=None, types=None):
+    """ Yields the output line of every row of the file satisfying the
+    condition tree, in file order. project gives the positions of the
+    output columns, positions maps the columns of the condition to
+    theirs and types gives the declared type of every column"""
+    for lines in run_chunks(file_name, workers, condition, positions,
+                            project, [], types):
+        for line in lines:
+            yield line
+
+
+def parallel_stats(file_name, workers, aggregate):
+    """ Returns a dictionary mapping every position in aggregate to the
+    count, sum, minimum and maximum of that column, or the count of rows
+    for a position of None, merged from the partial results of the
+    workers"""
+    merged = dict((index, new_stat()) for index in aggregate)
+    for stats in run_chunks(file_name, workers, None, None, [], aggregate):
+        for index, stat in stats.items():
+            merge_stats(merged[index], stat)
+    return merged
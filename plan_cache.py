@@ -0,0 +1,114 @@
+"""
+Cache of parsed queries and prepared statements, so that a query run again,
+or with other constants, is parsed and checked only once
+"""
+from collections import OrderedDict
+
+
+PLAN_CACHE_SIZE = 256  # parsed queries kept by the plan cache
+
+
+class ParsedQuery:
+    """Result of parsing and checking a select query. Holds everything
+    needed to run the query except the table data"""
+
+    def __init__(self, tables_info, tables, required, columns, functions,
+                 distinct, condition, order_by, limit, group_by, parameters):
+        """
+        Default constructor
+        :param tables_info: metadata the query was checked against
+        :param tables: tables of the from clause
+        :param required: items of the select clause
+        :param columns: projected columns
+        :param functions: [function, column] of the aggregate functions
+        :param distinct: columns given to distinct
+        :param condition: where condition tree or None
+        :param order_by: list of (column, descending) pairs or None
+        :param limit: number of rows to output or None
+        :param group_by: grouping columns or None
+        :param parameters: number of '?' parameters in the condition
+        """
+        self.tables_info = tables_info
+        self.tables = tables
+        self.required = required
+        self.columns = columns
+        self.functions = functions
+        self.distinct = distinct
+        self.condition = condition
+        self.order_by = order_by
+        self.limit = limit
+        self.group_by = group_by
+        self.parameters = parameters
+
+
+class PlanCache:
+    """Least recently used cache of parsed queries keyed by the formatted
+    query text, counting its hits and misses"""
+
+    def __init__(self, size=PLAN_CACHE_SIZE):
+        """
+        Default constructor
+        :param size: number of parsed queries kept, 0 disables the cache
+        """
+        self.size = size
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query, tables_info):
+        """ Returns the parsed query, or None if it is not cached or was
+        checked against other metadata"""
+        plan = self.plans.get(query)
+        if plan is None or plan.tables_info is not tables_info:
+            self.misses += 1
+            return None
+        self.plans.move_to_end(query)
+        self.hits += 1
+        return plan
+
+    def put(self, query, plan):
+        """ Caches the parsed query, evicting the least recently used one
+        when the cache is full"""
+        if self.size <= 0:
+            return
+        self.plans[query] = plan
+        self.plans.move_to_end(query)
+        while len(self.plans) > self.size:
+            self.plans.popitem(last=False)
+
+    def clear(self):
+        """ Forgets every parsed query"""
+        self.plans.clear()
+
+    def stats(self):
+        """ Returns the hits, misses and size of the cache"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.plans)}
+
+
+class PreparedStatement:
+    """Query parsed once and run many times with different values for its
+    '?' parameters"""
+
+    def __init__(self, query_processor, query):
+        """
+        Default constructor
+        :param query_processor: QueryProcessor running the statement
+        :param query: select query, '?' standing for a constant in the
+        where condition
+        """
+        self.query_processor = query_processor
+        self.query = query
+        self.plan = query_processor.plan_for(query)
+        self.executions = 0
+
+    def execute(self, *parameters):
+        """ Runs the statement with the parameters in place of the '?' in
+        order, and writes its result"""
+        if self.plan.tables_info is not self.query_processor.tables_info:
+            self.plan = self.query_processor.plan_for(self.query)
+        self.executions += 1
+        try:
+            self.query_processor.run_parsed(self.plan, parameters)
+        finally:
+            self.query_processor.output.flush()
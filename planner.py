@@ -0,0 +1,481 @@
+"""
+Logical planning and execution of queries over several tables. Conditions
+on a single table are pushed below the joins and the join order is chosen
+from statistics of the tables
+"""
+from bisect import bisect_left, bisect_right
+
+from com.nb.dbms.predicates import columns_in, compile_predicate, conjuncts, \
+    disjuncts, to_value
+from com.nb.dbms.sorting import merge_join, value_key
+
+
+RANGE_SELECTIVITY = 1.0 / 3
+OTHER_SELECTIVITY = 1.0 / 2
+FLIPPED = {'<': '>', '>': '<', '<=': '>=', '>=': '<='}
+
+
+class TableStatistics:
+    """Row count of a loaded table and, computed on first use, the number
+    of distinct values of its columns"""
+
+    def __init__(self, rows):
+        """
+        Default constructor
+        :param rows: list of the rows of the table
+        """
+        self.rows = rows
+        self.row_count = len(rows)
+        self.distinct_counts = {}
+
+    def distinct(self, position):
+        """ Returns the number of distinct values in the column"""
+        if position not in self.distinct_counts:
+            self.distinct_counts[position] = len(set(
+                row[position] for row in self.rows))
+        return max(self.distinct_counts[position], 1)
+
+
+class JoinStep:
+    """Joins one more table to the rows produced so far"""
+
+    def __init__(self, table, conditions, equality, estimate, merge=None,
+                 union=None):
+        """
+        Default constructor
+        :param table: table joined in this step
+        :param conditions: conditions checked on the joined rows
+        :param equality: (column of the rows so far, column of the table)
+        of the condition used to hash join, or None
+        :param estimate: estimated number of rows after this step
+        :param merge: (column of the rows so far, operator, column of the
+        table, condition) of the comparison used to sort merge join when
+        there is no equality, or None
+        :param union: access path of every disjunct of an OR condition,
+        from disjunct_paths, used when there is neither an equality nor a
+        comparison to merge join on. None for a nested loop join
+        """
+        self.table = table
+        self.conditions = conditions
+        self.equality = equality
+        self.estimate = estimate
+        self.merge = merge
+        self.union = union
+
+
+class JoinPlan:
+    """Order in which the tables are joined together with the conditions
+    pushed down to every table and evaluated at every join step"""
+
+    def __init__(self, tables):
+        """
+        Default constructor
+        :param tables: tables of the query in the order of the from clause
+        """
+        self.tables = tables
+        self.filters = dict((table, []) for table in tables)
+        self.steps = []
+
+    def describe(self):
+        """ Returns a line describing every step of the plan"""
+        lines = []
+        for step in self.steps:
+            if not lines:
+                line = 'scan ' + step.table
+            elif step.equality is not None:
+                line = 'hash join ' + step.table + ' on ' + \
+                    step.equality[0] + ' = ' + step.equality[1]
+            elif step.merge is not None:
+                line = 'merge join ' + step.table + ' on ' + \
+                    ' '.join(step.merge[:3])
+            elif step.union is not None:
+                line = 'union join ' + step.table + ' on ' + \
+                    ' or '.join(describe_path(path) for path in step.union)
+            else:
+                line = 'nested loop join ' + step.table
+            if self.filters[step.table]:
+                line += ' filtered'
+            lines.append(line + ' (~' + str(int(step.estimate)) + ' rows)')
+        return lines
+
+
+def equality_columns(tree):
+    """ Returns the two column names of a `column = column` condition, or
+    None for any other condition"""
+    if tree[0] == 'cmp' and tree[1] == '=' and tree[2][0] == 'col' and \
+            tree[3][0] == 'col':
+        return tree[2][1], tree[3][1]
+    return None
+
+
+def range_columns(tree, table, locate):
+    """ Returns (column of the rows so far, operator, column of the table)
+    if the condition compares a column of the table with <, >, <= or >= to
+    a column of another table, otherwise None"""
+    if tree[0] != 'cmp' or tree[1] not in FLIPPED or tree[2][0] != 'col' \
+            or tree[3][0] != 'col':
+        return None
+    left, oper, right = tree[2][1], tree[1], tree[3][1]
+    if locate(left)[0] == table:
+        left, oper, right = right, FLIPPED[oper], left
+    if locate(left)[0] == table or locate(right)[0] != table:
+        return None
+    return left, oper, right
+
+
+def disjunct_paths(tree, table, locate):
+    """ Returns an access path to the rows of the table for every
+    disjunct of the OR condition, or None if some disjunct has none. A
+    path finds a superset of the rows of the table which, joined to a
+    row so far, satisfy its disjunct:
+    ('hash', column so far, column of the table) for an equality,
+    ('range', column so far, operator, column of the table) for a
+    comparison, ('filter', condition) for a condition on the table only
+    and ('left', condition) for a condition on the rows so far only.
+    A disjunct made of several conditions joined by AND takes the path of
+    one of them"""
+    if tree[0] != 'or':
+        return None
+    paths = []
+    for disjunct in disjuncts(tree):
+        candidates = []
+        for condition in conjuncts(disjunct):
+            tables = set(locate(name)[0] for name in columns_in(condition))
+            columns = equality_columns(condition)
+            if table not in tables:
+                candidates.append((3, ('left', condition)))
+            elif len(tables) == 1:
+                candidates.append((1, ('filter', condition)))
+            elif columns is not None and len(tables) == 2:
+                candidates.append((0, ('hash',) +
+                                   join_columns(columns, table, locate)))
+            elif range_columns(condition, table, locate) is not None:
+                candidates.append((2, ('range',) + range_columns(
+                    condition, table, locate)))
+        if not candidates:
+            return None
+        paths.append(min(candidates, key=lambda candidate: candidate[0])[1])
+    return paths
+
+
+def describe_path(path):
+    """ Returns the text describing an access path of a union join"""
+    if path[0] == 'hash':
+        return path[1] + ' = ' + path[2]
+    if path[0] == 'range':
+        return ' '.join(path[1:])
+    return path[0] + ' ' + ', '.join(columns_in(path[1]))
+
+
+def filter_selectivity(tree, locate, statistics):
+    """ Estimates the fraction of rows of a table satisfying the condition"""
+    if tree[0] == 'cmp' and tree[1] == '=' and \
+            sorted([tree[2][0], tree[3][0]]) == ['col', 'lit']:
+        column = tree[2] if tree[2][0] == 'col' else tree[3]
+        table, position = locate(column[1])
+        return 1.0 / statistics[table].distinct(position)
+    if tree[0] == 'cmp':
+        return RANGE_SELECTIVITY
+    return OTHER_SELECTIVITY
+
+
+def plan_joins(tables, tree, locate, statistics):
+    """ Builds the JoinPlan for joining the tables under the condition tree.
+    locate maps a column name to its table and its position in a row of
+    that table. The plan starts from the
+    table with the fewest estimated rows after filtering and then adds,
+    one at a time, the table giving the smallest estimated result"""
+    plan = JoinPlan(tables)
+    pending = []
+    for condition in conjuncts(tree):
+        condition_tables = set(locate(name)[0]
+                               for name in columns_in(condition))
+        if len(condition_tables) == 1:
+            plan.filters[condition_tables.pop()].append(condition)
+        else:
+            pending.append((condition, condition_tables))
+
+    estimates = {}
+    for table in tables:
+        estimates[table] = float(statistics[table].row_count)
+        for condition in plan.filters[table]:
+            estimates[table] *= filter_selectivity(condition, locate,
+                                                   statistics)
+
+    first = min(tables, key=lambda table: (estimates[table],
+                                           tables.index(table)))
+    joined = set([first])
+    estimate = estimates[first]
+    plan.steps.append(JoinStep(first, [condition for condition, needed in
+                                       pending if not needed], None, estimate))
+    pending = [(condition, needed) for condition, needed in pending if needed]
+    while len(joined) < len(tables):
+        best = None
+        for table in tables:
+            if table in joined:
+                continue
+            conditions = [condition for condition, needed in pending
+                          if table in needed and needed <= joined | {table}]
+            size = estimate * estimates[table]
+            equality = None
+            checks = []
+            for condition in conditions:
+                columns = equality_columns(condition)
+                if columns is not None and equality is None:
+                    equality = join_columns(columns, table, locate)
+                    size /= max(statistics[t].distinct(p) for t, p in
+                                [locate(c) for c in columns])
+                else:
+                    checks.append(condition)
+                    size *= RANGE_SELECTIVITY
+            if best is None or size < best[0]:
+                best = (size, table, conditions, checks, equality)
+        estimate, table, conditions, checks, equality = best
+        merge = None
+        union = None
+        if equality is None:
+            for condition in checks:
+                columns = range_columns(condition, table, locate)
+                if columns is not None:
+                    merge = columns + (condition,)
+                    checks = [check for check in checks
+                              if check is not condition]
+                    break
+        if equality is None and merge is None:
+            for condition in checks:
+                union = disjunct_paths(condition, table, locate)
+                if union is not None:
+                    break
+        joined.add(table)
+        pending = [(condition, needed) for condition, needed in pending
+                   if condition not in conditions]
+        plan.steps.append(JoinStep(table, checks, equality, estimate, merge,
+                                   union))
+    return plan
+
+
+def join_columns(columns, table, locate):
+    """ Orders the columns of an equality as (column of the rows joined so
+    far, column of the table being joined)"""
+    if locate(columns[0])[0] == table:
+        return columns[1], columns[0]
+    return columns
+
+
+def execute_plan(plan, tables_data, locate, widths, typed=None, wrap=None):
+    """ Runs the plan and returns the joined rows, each as a list of the
+    values of all joined tables in the order of plan.tables, sorted as a
+    nested loop over the tables in that order would produce them.
+    widths maps every table to the number of columns in its rows and typed
+    to the positions of its columns holding typed values, as
+    compile_predicate takes them. wrap, if given, is applied to every
+    compiled predicate, e.g. to count its evaluations"""
+    order = [step.table for step in plan.steps]
+    offsets = {}
+    for table in order:
+        offsets[table] = sum(widths[t] for t in order[:order.index(table)])
+    typed = typed or {}
+    joined_typed = set(offsets[table] + position for table in order
+                       for position in typed.get(table, ()))
+
+    def resolve(joined):
+        def resolve_name(name):
+            table, position = locate(name)
+            if table not in joined:
+                raise NameError(name)
+            return offsets[table] + position
+        return resolve_name
+
+    def compiled(condition, resolve_name, positions):
+        predicate = compile_predicate(condition, resolve_name, positions)
+        return wrap(predicate) if wrap is not None else predicate
+
+    def joined_predicate(joined):
+        """ Returns the compiler of conditions over the rows joined from
+        the given tables"""
+        return lambda condition: compiled(condition, resolve(joined),
+                                          joined_typed)
+
+    def table_predicate(condition):
+        """ Compiles a condition over the rows of the table it reads"""
+        table = locate(columns_in(condition)[0])[0]
+        return compiled(condition, lambda name: locate(name)[1],
+                        typed.get(table, ()))
+
+    filtered = {}
+    for table in order:
+        predicates = [table_predicate(condition)
+                      for condition in plan.filters[table]]
+        # typed tables hold tuples and untyped ones lists, rows are joined
+        # as tuples
+        filtered[table] = [(i, tuple(row))
+                           for i, row in enumerate(tables_data[table])
+                           if all(predicate(row) for predicate in predicates)]
+
+    first = plan.steps[0]
+    checks = [joined_predicate(set())(condition)
+              for condition in first.conditions]
+    if not all(check([]) for check in checks):
+        return []
+    rows = [((i,), row) for i, row in filtered[first.table]]
+    joined = [first.table]
+    for step in plan.steps[1:]:
+        joined.append(step.table)
+        checks = [joined_predicate(set(joined))(condition)
+                  for condition in step.conditions]
+        merge_check = None
+        if step.merge is not None:
+            merge_check = joined_predicate(set(joined))(step.merge[3])
+        if step.union is not None:
+            rows = union_join(rows, filtered[step.table], step.union, checks,
+                              locate, offsets,
+                              joined_predicate(set(joined[:-1])),
+                              table_predicate)
+            continue
+        rows = join_step(rows, filtered[step.table], step, checks,
+                         merge_check, locate, offsets, joined_typed)
+
+    rank = [order.index(table) for table in plan.tables]
+    rows.sort(key=lambda item: [item[0][index] for index in rank])
+    result = []
+    for _, values in rows:
+        row = []
+        for table in plan.tables:
+            row += values[offsets[table]:offsets[table] + widths[table]]
+        result.append(row)
+    return result
+
+
+def join_step(rows, table_rows, step, checks, merge_check, locate, offsets,
+              typed=()):
+    """ Joins the (positions, values) rows produced so far with the
+    (position, row) pairs of the next table. An equality join builds its
+    hash table on whichever side has fewer rows. typed holds the positions
+    of typed values in the joined rows, whose empty values are nulls
+    matching nothing"""
+    result = []
+    if step.merge is not None:
+        left_table, left = locate(step.merge[0])
+        matches = merge_join(rows, left + offsets[left_table], step.merge[1],
+                             table_rows, locate(step.merge[2])[1])
+        if matches is not None:
+            for (ids, values), matched in matches:
+                for i, row in matched:
+                    joined = values + row
+                    if all(check(joined) for check in checks):
+                        result.append((ids + (i,), joined))
+            return result
+        # the join columns hold strings, compare every pair instead
+        checks = checks + [merge_check]
+    if step.equality is not None:
+        left_table, left = locate(step.equality[0])
+        _, right = locate(step.equality[1])
+        left += offsets[left_table]
+        # empty values of typed columns are nulls, which match nothing
+        left_null = '' if left in typed else None
+        right_null = '' if offsets[step.table] + right in typed else None
+        if len(rows) < len(table_rows):
+            # the hash table is built on the smaller side, the joined rows
+            # are put back in order once the plan is executed
+            buckets = {}
+            for ids, values in rows:
+                if values[left] != left_null:
+                    buckets.setdefault(to_value(values[left]), []).append(
+                        (ids, values))
+            for i, row in table_rows:
+                if row[right] == right_null:
+                    continue
+                for ids, values in buckets.get(to_value(row[right]), ()):
+                    joined = values + row
+                    if all(check(joined) for check in checks):
+                        result.append((ids + (i,), joined))
+            return result
+        buckets = {}
+        for i, row in table_rows:
+            if row[right] != right_null:
+                buckets.setdefault(to_value(row[right]), []).append((i, row))
+        for ids, values in rows:
+            if values[left] == left_null:
+                continue
+            for i, row in buckets.get(to_value(values[left]), ()):
+                joined = values + row
+                if all(check(joined) for check in checks):
+                    result.append((ids + (i,), joined))
+        return result
+    for ids, values in rows:
+        for i, row in table_rows:
+            joined = values + row
+            if all(check(joined) for check in checks):
+                result.append((ids + (i,), joined))
+    return result
+
+
+def union_join(rows, table_rows, paths, checks, locate, offsets,
+               left_predicate, table_predicate):
+    """ Joins the (positions, values) rows produced so far with the
+    (position, row) pairs of the next table on an OR condition. Every
+    disjunct finds its candidate rows of the table through its access
+    path, the candidates of all disjuncts are joined once and checked
+    against the whole condition. Rows of the table are told apart by
+    their position. left_predicate compiles a condition over the rows so
+    far and table_predicate one over the rows of the table"""
+    finders = [path_finder(path, table_rows, locate, offsets, left_predicate,
+                           table_predicate)
+               for path in paths]
+    everything = range(len(table_rows))
+    result = []
+    for ids, values in rows:
+        candidates = set()
+        for find in finders:
+            found = find(values)
+            if len(found) == len(table_rows):
+                candidates = everything
+                break
+            candidates.update(found)
+        for index in sorted(candidates):
+            i, row = table_rows[index]
+            joined = values + row
+            if all(check(joined) for check in checks):
+                result.append((ids + (i,), joined))
+    return result
+
+
+def path_finder(path, table_rows, locate, offsets, left_predicate,
+                table_predicate):
+    """ Returns a function giving the indices in table_rows of the
+    candidate rows of the access path for a row so far"""
+    if path[0] == 'left':
+        check = left_predicate(path[1])
+        everything = range(len(table_rows))
+        return lambda values: everything if check(values) else ()
+    if path[0] == 'filter':
+        check = table_predicate(path[1])
+        matched = [index for index, (_, row) in enumerate(table_rows)
+                   if check(row)]
+        return lambda values: matched
+    left_table, left = locate(path[1])
+    left += offsets[left_table]
+    right = locate(path[-1])[1]
+    if path[0] == 'hash':
+        buckets = {}
+        for index, (_, row) in enumerate(table_rows):
+            buckets.setdefault(to_value(row[right]), []).append(index)
+        return lambda values: buckets.get(to_value(values[left]), ())
+    # value_key orders numbers before strings, comparisons between the two
+    # fail when the whole condition is checked
+    keyed = sorted((value_key(row[right]), index)
+                   for index, (_, row) in enumerate(table_rows))
+    keys = [key for key, _ in keyed]
+    indices = [index for _, index in keyed]
+    oper = path[2]
+
+    def find(values):
+        key = value_key(values[left])
+        if oper == '<':
+            return indices[bisect_right(keys, key):]
+        if oper == '<=':
+            return indices[bisect_left(keys, key):]
+        if oper == '>':
+            return indices[:bisect_left(keys, key)]
+        return indices[:bisect_right(keys, key)]
+    return find
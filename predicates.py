@@ -0,0 +1,242 @@
+"""
+Parsing and compilation of where conditions into row predicates
+"""
+import datetime
+import re
+
+from com.nb.dbms.utility_functions import error_exit
+
+
+TOKEN_RE = re.compile(r'\s*(<=|>=|!=|<>|=|<|>|\(|\)|\?|,|\*|'
+                      r'[A-Za-z_][\w.]*|-?\d+(?:\.\d+)?|\'[^\']*\'|"[^"]*")')
+COMPARISONS = {'=': '==', '<': '<', '>': '>', '<=': '<=', '>=': '>=',
+               '!=': '!=', '<>': '!='}
+CONNECTORS = ['and', 'or']
+
+
+def to_value(text):
+    """ Converts a column value to the number it represents if it is one.
+    Values of typed columns are already converted and returned as they are"""
+    if text.__class__ is not str:
+        return text
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text.strip()
+
+
+def tokenize(condition, clause='where clause'):
+    """ Splits the condition, or the clause named by clause, into a list
+    of tokens"""
+    tokens = []
+    position = 0
+    condition = condition.strip()
+    while position < len(condition):
+        match = TOKEN_RE.match(condition, position)
+        if match is None:
+            error_exit('Syntax error in ' + clause + ' near \'' +
+                       condition[position:] + '\'')
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+def parse_condition(condition):
+    """ Parses a where condition into a tree of tuples:
+    ('or' | 'and', left, right), ('cmp', operator, left, right),
+    ('col', name), ('lit', value) and ('param',) for a '?' parameter
+    """
+    tokens = tokenize(condition)
+    tree, position = parse_condition_tokens(tokens, 0)
+    if position != len(tokens):
+        error_exit('Syntax error in where clause near \'' +
+                   ' '.join(tokens[position:]) + '\'')
+    return tree
+
+
+def parse_condition_tokens(tokens, position):
+    """ Parses the condition starting at tokens[position]. Returns its
+    tree and the position of the first token after it"""
+    return _parse_or(tokens, position)
+
+
+def _parse_or(tokens, position):
+    """ or_condition := and_condition ('or' and_condition)*"""
+    left, position = _parse_and(tokens, position)
+    while position < len(tokens) and tokens[position].lower() == 'or':
+        right, position = _parse_and(tokens, position + 1)
+        left = ('or', left, right)
+    return left, position
+
+
+def _parse_and(tokens, position):
+    """ and_condition := comparison ('and' comparison)*"""
+    left, position = _parse_comparison(tokens, position)
+    while position < len(tokens) and tokens[position].lower() == 'and':
+        right, position = _parse_comparison(tokens, position + 1)
+        left = ('and', left, right)
+    return left, position
+
+
+def _parse_comparison(tokens, position):
+    """ comparison := '(' or_condition ')' | operand operator operand"""
+    if position < len(tokens) and tokens[position] == '(':
+        tree, position = _parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position] != ')':
+            error_exit('Syntax Error: \')\' expected in where clause')
+        return tree, position + 1
+    left, position = _parse_operand(tokens, position)
+    if position >= len(tokens) or tokens[position] not in COMPARISONS:
+        error_exit('Syntax error in where clause')
+    oper = tokens[position]
+    right, position = _parse_operand(tokens, position + 1)
+    return ('cmp', oper, left, right), position
+
+
+def _parse_operand(tokens, position):
+    """ operand := column | number | quoted string | '?'"""
+    if position >= len(tokens):
+        error_exit('Syntax error in where clause')
+    token = tokens[position]
+    if token == '?':
+        return ('param',), position + 1
+    if token[0] in '\'"':
+        return ('lit', token[1:-1]), position + 1
+    if token[0].isdigit() or token[0] == '-':
+        return ('lit', to_value(token)), position + 1
+    if token in COMPARISONS or token in ('(', ')', ',', '*') or \
+            token.lower() in CONNECTORS:
+        error_exit('Syntax error in where clause near \'' + token + '\'')
+    return ('col', token), position + 1
+
+
+def columns_in(tree):
+    """ Returns the names of all columns referenced in the tree"""
+    if tree[0] == 'col':
+        return [tree[1]]
+    if tree[0] in ('lit', 'param'):
+        return []
+    columns = []
+    for child in tree[-2:]:
+        columns += columns_in(child)
+    return columns
+
+
+def parameter_count(tree):
+    """ Returns the number of '?' parameters in the tree"""
+    if tree is None or tree[0] in ('col', 'lit'):
+        return 0
+    if tree[0] == 'param':
+        return 1
+    return parameter_count(tree[-2]) + parameter_count(tree[-1])
+
+
+def bind_parameters(tree, parameters):
+    """ Returns the tree with the parameters, in order, in place of its
+    '?' parameters"""
+    if parameter_count(tree) != len(parameters):
+        error_exit('ERR: ' + str(parameter_count(tree)) + ' parameters '
+                   'expected, ' + str(len(parameters)) + ' given')
+    if not parameters:
+        return tree
+    return _bind(tree, iter(parameters))
+
+
+def _bind(tree, values):
+    """ Replaces the parameters of the tree with the next values"""
+    if tree[0] == 'param':
+        return ('lit', next(values))
+    if tree[0] in ('col', 'lit'):
+        return tree
+    left = _bind(tree[-2], values)
+    return tree[:-2] + (left, _bind(tree[-1], values))
+
+
+def conjuncts(tree):
+    """ Returns the conditions joined by AND at the top of the tree"""
+    if tree is None:
+        return []
+    if tree[0] == 'and':
+        return conjuncts(tree[1]) + conjuncts(tree[2])
+    return [tree]
+
+
+def disjuncts(tree):
+    """ Returns the conditions joined by OR at the top of the tree"""
+    if tree[0] == 'or':
+        return disjuncts(tree[1]) + disjuncts(tree[2])
+    return [tree]
+
+
+def coerce_literals(tree, type_of):
+    """ Returns the tree with every literal compared with a column of a
+    declared type converted to that type, so that the comparison is made
+    between values of the same type. type_of maps a column name to its
+    declared type, or None"""
+    if tree is None or tree[0] in ('col', 'lit', 'param'):
+        return tree
+    if tree[0] != 'cmp':
+        return (tree[0], coerce_literals(tree[1], type_of),
+                coerce_literals(tree[2], type_of))
+    left, right = tree[2], tree[3]
+    if left[0] == 'col' and right[0] == 'lit':
+        right = ('lit', _coerce(right[1], type_of(left[1]), left[1]))
+    elif left[0] == 'lit' and right[0] == 'col':
+        left = ('lit', _coerce(left[1], type_of(right[1]), right[1]))
+    return ('cmp', tree[1], left, right)
+
+
+def _coerce(value, kind, column):
+    """ Converts the literal value to the type of the column"""
+    try:
+        if kind == 'int' and isinstance(value, str):
+            return int(value)
+        if kind == 'float':
+            return float(value)
+        if kind == 'string':
+            return str(value)
+        if kind == 'date':
+            return datetime.date.fromisoformat(str(value))
+    except ValueError:
+        error_exit('ERR: \'' + str(value) + '\' is not a value of type ' +
+                   kind + ' for column \'' + column + '\'')
+    return value
+
+
+def compile_predicate(tree, resolve, typed=()):
+    """ Compiles the condition tree into a function taking a row and
+    returning whether the row satisfies the condition.
+    resolve maps a column name to its position in the row and raises
+    NameError for unknown columns. The values at the typed positions are
+    compared as they are, empty ones being nulls, the others are converted
+    from their text
+    """
+    source = 'lambda row: ' + _source(tree, resolve, typed)
+    return eval(compile(source, '<where>', 'eval'),
+                {'_v': to_value, 'datetime': datetime})
+
+
+def _source(tree, resolve, typed=()):
+    """ Generates the python expression for the condition tree"""
+    kind = tree[0]
+    if kind == 'col':
+        position = resolve(tree[1])
+        if position in typed:
+            return 'row[%d]' % position
+        return '_v(row[%d])' % position
+    if kind == 'lit':
+        return repr(tree[1])
+    if kind == 'cmp':
+        comparison = _source(tree[2], resolve, typed) + ' ' + \
+            COMPARISONS[tree[1]] + ' ' + _source(tree[3], resolve, typed)
+        # empty values of typed columns are nulls, which satisfy no
+        # comparison and cannot be compared with the values of the type
+        nullable = ['row[%d] != \'\'' % resolve(operand[1])
+                    for operand in tree[2:4]
+                    if operand[0] == 'col' and resolve(operand[1]) in typed]
+        return '(' + ' and '.join(nullable + [comparison]) + ')'
+    return '(' + _source(tree[1], resolve, typed) + ' ' + kind + ' ' + \
+        _source(tree[2], resolve, typed) + ')'
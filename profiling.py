@@ -0,0 +1,146 @@
+"""
+Profiling of queries. A QueryProfile records the wall time spent in every
+stage of a query, the rows flowing through the stages, the bytes of rows
+read, the number of condition evaluations and the peak memory, and
+reports them as a dictionary ready to be written as JSON
+"""
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class ProfileStage:
+    """Wall time and rows produced by one stage of a query"""
+
+    def __init__(self, name, source=None):
+        """
+        Default constructor
+        :param name: name of the stage
+        :param source: name of the stage whose rows this stage reads
+        """
+        self.name = name
+        self.source = source
+        self.seconds = 0.0
+        self.rows_out = None
+
+
+class QueryProfile:
+    """Profile of one query. Time is charged to the innermost running
+    stage only, so the times of the stages add up to the time of the
+    query even though the stages run interleaved as generators"""
+
+    def __init__(self, query):
+        """
+        Default constructor
+        :param query: text of the profiled query
+        """
+        self.query = query
+        self.stages = []
+        self.stage_names = {}
+        self.running = []
+        self.bytes_read = 0
+        self.evaluations = 0
+        self.plan = None
+        self.last_rows_stage = None
+        self.started = time.perf_counter()
+        self.switched = self.started
+
+    def stage(self, name, source=None):
+        """ Returns the stage called name, adding it if it is new"""
+        if name not in self.stage_names:
+            self.stage_names[name] = ProfileStage(name, source)
+            self.stages.append(self.stage_names[name])
+        return self.stage_names[name]
+
+    def enter(self, stage):
+        """ Charges the time until now to the running stage and starts
+        charging the stage"""
+        self.switch()
+        self.running.append(stage)
+
+    def leave(self):
+        """ Charges the time until now to the running stage and goes back
+        to charging the stage it interrupted"""
+        self.switch()
+        self.running.pop()
+
+    def switch(self):
+        """ Charges the time since the last switch to the running stage"""
+        now = time.perf_counter()
+        if self.running:
+            self.running[-1].seconds += now - self.switched
+        self.switched = now
+
+    @contextmanager
+    def timed(self, name):
+        """ Charges the time spent in the with block to the stage"""
+        self.enter(self.stage(name))
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def rows(self, name, rows, source=None, measure=False):
+        """ Returns an iterator over the rows, charging the time spent
+        producing them to the stage and counting them. The stage reads the
+        rows of source, by default the stage whose rows were last wrapped
+        before. measure adds the bytes of every row to the bytes read"""
+        if source is None and name not in self.stage_names:
+            source = self.last_rows_stage
+        stage = self.stage(name, source)
+        self.last_rows_stage = name
+        if stage.rows_out is None:
+            stage.rows_out = 0
+        return self.counted_rows(stage, iter(rows), measure)
+
+    def counted_rows(self, stage, iterator, measure):
+        """ Yields the rows of the iterator for rows"""
+        while True:
+            self.enter(stage)
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            stage.rows_out += 1
+            if measure:
+                # typed values are counted by the length of their text
+                self.bytes_read += sum(len(str(value)) for value in row) + \
+                    len(row)
+            yield row
+
+    def counted(self, predicate):
+        """ Returns the predicate counting its evaluations"""
+        def evaluate(row):
+            self.evaluations += 1
+            return predicate(row)
+        return evaluate
+
+    def report(self, failed=False):
+        """ Returns the profile as a dictionary of plain values"""
+        self.switch()
+        stages = []
+        for stage in self.stages:
+            entry = {'stage': stage.name, 'seconds': round(stage.seconds, 6)}
+            if stage.source in self.stage_names:
+                entry['rows_in'] = self.stage_names[stage.source].rows_out
+            if stage.rows_out is not None:
+                entry['rows_out'] = stage.rows_out
+            stages.append(entry)
+        peak_memory = None
+        if resource is not None:
+            # kilobytes on linux, the peak of the whole process
+            peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report = {'query': self.query,
+                  'seconds': round(time.perf_counter() - self.started, 6),
+                  'stages': stages, 'bytes_read': self.bytes_read,
+                  'evaluations': self.evaluations,
+                  'peak_memory_kb': peak_memory, 'failed': failed}
+        if self.plan is not None:
+            report['plan'] = self.plan
+        return report
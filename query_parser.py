@@ -0,0 +1,176 @@
+"""
+Parsing of select queries into a syntax tree. The query is split into
+tokens once and read by a recursive descent parser, the where condition
+being parsed by the condition grammar of predicates
+"""
+from com.nb.dbms.predicates import parse_condition_tokens, tokenize
+from com.nb.dbms.utility_functions import error_exit
+
+
+AGGREGATES = ['max', 'min', 'sum', 'avg', 'count']
+KEYWORDS = ['select', 'distinct', 'from', 'where', 'group', 'order', 'by',
+            'limit', 'asc', 'desc', 'and', 'or']
+
+
+class SelectStatement:
+    """Syntax tree of a select query"""
+
+    def __init__(self, items, tables, condition, group_by, order_by, limit):
+        """
+        Default constructor
+        :param items: selected items, each ('column', name),
+        ('aggregate', function, column) or ('distinct', column)
+        :param tables: tables of the from clause
+        :param condition: where condition tree or None
+        :param group_by: grouping columns or None
+        :param order_by: list of (column, descending) pairs or None
+        :param limit: number of rows to output or None
+        """
+        self.items = items
+        self.tables = tables
+        self.condition = condition
+        self.group_by = group_by
+        self.order_by = order_by
+        self.limit = limit
+
+
+def parse_select(query):
+    """ Parses the select query
+    query := 'select' items 'from' names ['where' condition]
+             ['group' 'by' names] ['order' 'by' orderings] ['limit' number]
+    """
+    tokens = tokenize(query, 'query')
+    if not tokens or tokens[0].lower() != 'select':
+        error_exit('Syntax Error: No Select statement given')
+    items, position = _parse_items(tokens, 1)
+    if not _is_keyword(tokens, position, 'from'):
+        error_exit('Syntax Error: No Table Selected')
+    tables, position = _parse_names(tokens, position + 1, 'from clause')
+    condition = group_by = order_by = limit = None
+    if _is_keyword(tokens, position, 'where'):
+        condition, position = parse_condition_tokens(tokens, position + 1)
+    if _is_keyword(tokens, position, 'group'):
+        position = _expect(tokens, position + 1, 'by')
+        group_by, position = _parse_names(tokens, position, 'group by clause')
+    if _is_keyword(tokens, position, 'order'):
+        position = _expect(tokens, position + 1, 'by')
+        order_by, position = _parse_order_by(tokens, position)
+    if _is_keyword(tokens, position, 'limit'):
+        if position + 1 >= len(tokens) or not tokens[position + 1].isdigit():
+            error_exit('Syntax Error: limit expects a number of rows')
+        limit, position = int(tokens[position + 1]), position + 2
+    if position != len(tokens):
+        if tokens[position].lower() == 'select':
+            error_exit('More than one select statement given')
+        if tokens[position].lower() == 'from':
+            error_exit('Syntax Error: More than one "from" statement given')
+        error_exit('Syntax error near \'' + ' '.join(tokens[position:]) +
+                   '\'')
+    return SelectStatement(items, tables, condition, group_by, order_by,
+                           limit)
+
+
+def _is_keyword(tokens, position, keyword):
+    """ Whether the token at position is the keyword"""
+    return position < len(tokens) and tokens[position].lower() == keyword
+
+
+def _expect(tokens, position, keyword):
+    """ Returns the position after the keyword expected at position"""
+    if not _is_keyword(tokens, position, keyword):
+        error_exit('Syntax Error: \'' + keyword + '\' expected')
+    return position + 1
+
+
+def _is_name(tokens, position):
+    """ Whether the token at position is a column or table name"""
+    return position < len(tokens) and \
+        (tokens[position][0].isalpha() or tokens[position][0] == '_') and \
+        tokens[position].lower() not in KEYWORDS
+
+
+def _parse_items(tokens, position):
+    """ items := item (',' item)*"""
+    items = []
+    while True:
+        item, position = _parse_item(tokens, position)
+        items.append(item)
+        if position >= len(tokens) or tokens[position] != ',':
+            return items, position
+        position += 1
+
+
+def _parse_item(tokens, position):
+    """ item := '*' | name | function '(' (name | '*') ')'
+              | 'distinct' ( '(' name ')' | name )"""
+    if position >= len(tokens) or _is_keyword(tokens, position, 'from'):
+        error_exit('ERR: Nothing given to select')
+    token = tokens[position]
+    if token == '*':
+        return ('column', '*'), position + 1
+    if token.lower() == 'distinct':
+        if position + 1 < len(tokens) and tokens[position + 1] == '(':
+            column, position = _parse_call_argument(tokens, position + 1)
+        elif _is_name(tokens, position + 1):
+            column, position = tokens[position + 1], position + 2
+        else:
+            error_exit('Syntax Error: column expected after distinct')
+        return ('distinct', column), position
+    if token.lower() in AGGREGATES and position + 1 < len(tokens) and \
+            tokens[position + 1] == '(':
+        column, position = _parse_call_argument(tokens, position + 1)
+        return ('aggregate', token.lower(), column), position
+    if not _is_name(tokens, position):
+        error_exit('Syntax error in select clause near \'' + token + '\'')
+    return ('column', token), position + 1
+
+
+def _parse_call_argument(tokens, position):
+    """ argument := '(' (name | '*') ')'"""
+    position += 1
+    if position < len(tokens) and (tokens[position] == '*' or
+                                   _is_name(tokens, position)):
+        argument = tokens[position]
+    else:
+        error_exit('Syntax Error: column expected inside \'(\' \')\'')
+    if position + 1 >= len(tokens) or tokens[position + 1] != ')':
+        error_exit('Syntax Error: \')\' expected ')
+    return argument, position + 2
+
+
+def _parse_names(tokens, position, clause):
+    """ names := name (',' name)*"""
+    names = []
+    while True:
+        if not _is_name(tokens, position):
+            error_exit('Syntax Error: name expected in ' + clause)
+        names.append(tokens[position])
+        position += 1
+        if position >= len(tokens) or tokens[position] != ',':
+            return names, position
+        position += 1
+
+
+def _parse_order_by(tokens, position):
+    """ orderings := ordering (',' ordering)*
+    ordering := (name | function '(' (name | '*') ')') ['asc' | 'desc']"""
+    order_by = []
+    while True:
+        if position + 1 < len(tokens) and tokens[position + 1] == '(' and \
+                tokens[position].lower() in AGGREGATES:
+            function = tokens[position].lower()
+            argument, position = _parse_call_argument(tokens, position + 1)
+            column = function + '(' + argument + ')'
+        elif _is_name(tokens, position):
+            column, position = tokens[position], position + 1
+        else:
+            error_exit('Syntax Error: column expected in order by clause')
+        descending = False
+        if _is_keyword(tokens, position, 'asc') or \
+                _is_keyword(tokens, position, 'desc'):
+            descending = tokens[position].lower() == 'desc'
+            position += 1
+        order_by.append((column, descending))
+        if position >= len(tokens) or tokens[position] != ',':
+            return order_by, position
+        position += 1
@@ -0,0 +1,347 @@
+"""
+Asyncio query service answering queries sent by several clients at once
+over a TCP or Unix socket. A client sends one query per line and gets
+back the lines of its result, each prefixed with '+', then the error of
+the query, if any, prefixed with '-', then a line holding '.'
+"""
+import argparse
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from com.nb.dbms.QueryProcessor import QueryProcessor
+from com.nb.dbms.utility_functions import QueryError, format_string, \
+raised_errors, read_meta
+
+
+METAFILE = 'metadata.txt'
+THREADS = 4  # queries admitted to execution at the same time
+MAX_PENDING = 64  # queries executing or waiting for a thread
+MAX_CONNECTIONS = 256
+CHUNK_LINES = 256  # result lines handed to the connection at once
+QUEUE_CHUNKS = 4  # chunks buffered per connection before the query waits
+ROW, ERROR, END = '+', '-', '.'
+
+
+class QueryCancelled(Exception):
+    """Raised in the thread executing a query whose client went away"""
+
+
+class ServiceError(Exception):
+    """Error of a query sent to the service, raised by QueryClient"""
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+
+
+class ResultStream:
+    """Writer of the result lines of a query, with the methods of
+    OutputWriter, handing them in chunks from the executing thread to the
+    coroutine sending them to the client. The thread waits while the
+    connection's queue is full, so a slow client slows its query down
+    instead of filling the memory"""
+
+    def __init__(self, loop, queue, chunk_lines=CHUNK_LINES):
+        """
+        Default constructor
+        :param loop: event loop of the connection
+        :param queue: bounded asyncio.Queue the chunks are put in, None
+        marks the end of the result
+        :param chunk_lines: lines put in the queue at once
+        """
+        self.loop = loop
+        self.queue = queue
+        self.chunk_lines = chunk_lines
+        self.lines = []
+        self.cancelled = False
+
+    def put(self, chunk):
+        """ Puts the chunk in the queue, waiting for room"""
+        asyncio.run_coroutine_threadsafe(self.queue.put(chunk),
+                                         self.loop).result()
+
+    def write_line(self, line):
+        """ Writes one line of the result"""
+        self.lines.append(line)
+        if len(self.lines) >= self.chunk_lines:
+            self.flush()
+
+    def write_lines(self, lines):
+        """ Writes every line of an iterable of lines"""
+        for line in lines:
+            self.write_line(line)
+
+    def flush(self):
+        """ Hands the buffered lines to the connection. Raises
+        QueryCancelled if the client went away"""
+        if self.cancelled:
+            raise QueryCancelled()
+        if self.lines:
+            chunk, self.lines = self.lines, []
+            self.put(chunk)
+
+    def close(self):
+        """ Same as flush"""
+        self.flush()
+
+
+class QueryService:
+    """Serves queries to concurrent connections. Queries are executed in
+    a bounded pool of threads, each with its own QueryProcessor, while the
+    event loop only moves lines between the threads and the sockets.
+    The threads keep the event loop responsive while queries execute, but
+    under the GIL they take turns rather than running in parallel, so a
+    busy service gains nothing from more of them. Scans of large tables
+    use processes through the workers option instead. Every connection
+    runs one query at a time, and queries arriving while MAX_PENDING are
+    already admitted are turned away"""
+
+    def __init__(self, tables_info, threads=THREADS, max_pending=MAX_PENDING,
+                 max_connections=MAX_CONNECTIONS, **options):
+        """
+        Default constructor
+        :param tables_info: metadata about the tables present
+        :param threads: queries admitted to execution at the same time,
+        interleaved by the GIL
+        :param max_pending: queries executing or waiting for a thread
+        beyond which new queries are rejected
+        :param max_connections: connections served at the same time
+        :param options: keyword arguments of every QueryProcessor
+        """
+        self.tables_info = tables_info
+        self.options = options
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.local = threading.local()
+        self.max_pending = max_pending
+        self.max_connections = max_connections
+        self.result_cache = None  # shared by the threads' processors
+        self.pending = 0
+        self.connections = 0
+        self.served = 0
+        self.rejected = 0
+
+    async def start(self, host=None, port=None, path=None):
+        """ Starts listening on the Unix socket at path, or on host and
+        port, and returns the asyncio server"""
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve(self, host=None, port=None, path=None):
+        """ Serves queries until cancelled"""
+        server = await self.start(host, port, path)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """ Waits for the executing queries and stops the threads"""
+        self.executor.shutdown()
+
+    async def handle(self, reader, writer):
+        """ Answers the queries sent on a connection, one at a time, until
+        the client closes it or sends quit"""
+        if self.connections >= self.max_connections:
+            writer.write(response_end('ERR: Too many connections'))
+            writer.close()
+            return
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                query = format_string(line.decode('utf-8'))
+                if query.lower() in ('quit', 'exit'):
+                    break
+                if query != '':
+                    await self.respond(query, writer)
+        except (ConnectionError, asyncio.CancelledError):
+            # the client went away, or the service is closing, while a
+            # result was being sent
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def respond(self, query, writer):
+        """ Executes the query in the thread pool and sends its result
+        lines as they are produced"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            writer.write(response_end('ERR: Server busy, try again later'))
+            await writer.drain()
+            return
+        self.pending += 1
+        queue = asyncio.Queue(QUEUE_CHUNKS)
+        stream = ResultStream(asyncio.get_running_loop(), queue)
+        result = asyncio.get_running_loop().run_in_executor(
+            self.executor, self.execute, query, stream)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                writer.write(''.join(ROW + line + '\n'
+                                     for line in chunk).encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # let the query stop at its next flush, and wait for its thread
+            # even if cancelled again so that it is not left blocked
+            stream.cancelled = True
+            await asyncio.shield(self.finish(queue, result))
+            raise
+        else:
+            error = await result
+        finally:
+            self.pending -= 1
+        self.served += 1
+        writer.write(response_end(error))
+        await writer.drain()
+
+    async def finish(self, queue, result):
+        """ Takes and drops the chunks the query still puts in the queue
+        until its thread is done"""
+        while await queue.get() is not None:
+            pass
+        await result
+
+    def processor(self):
+        """ Returns the QueryProcessor of the current thread"""
+        processor = getattr(self.local, 'processor', None)
+        if processor is None:
+            processor = QueryProcessor(self.tables_info,
+                                       output_file=os.devnull, **self.options)
+            if self.result_cache is None:
+                self.result_cache = processor.result_cache
+            processor.result_cache = self.result_cache
+            self.local.processor = processor
+        return processor
+
+    def execute(self, query, stream):
+        """ Runs in a thread of the pool. Executes the query, writing its
+        result to the stream, and returns its error or None"""
+        processor = self.processor()
+        output = processor.output
+        processor.output = stream
+        try:
+            if stream.cancelled:
+                return None
+            with raised_errors():
+                processor.process_query(query)
+            return None
+        except QueryCancelled:
+            return None
+        except QueryError as error:
+            return error.message
+        except Exception as error:
+            return 'ERR: ' + type(error).__name__ + ': ' + str(error)
+        finally:
+            processor.output = output
+            stream.put(None)
+
+    def stats(self):
+        """ Returns the connections and queries being served, the
+        number of queries served and rejected so far and the statistics of
+        the result cache"""
+        return {'connections': self.connections, 'pending': self.pending,
+                'served': self.served, 'rejected': self.rejected,
+                'result_cache': self.result_cache.stats()
+                if self.result_cache is not None else None}
+
+
+def response_end(error):
+    """ Returns the bytes ending a response, with the error if any"""
+    if error is None:
+        return (END + '\n').encode('utf-8')
+    return (ERROR + error + '\n' + END + '\n').encode('utf-8')
+
+
+class QueryClient:
+    """Connection to a QueryService"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host=None, port=None, path=None):
+        """ Connects to the service on the Unix socket at path, or on host
+        and port"""
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def rows(self, query):
+        """ Sends the query and yields the lines of its result as they
+        arrive. Raises ServiceError with the error of the query, after
+        yielding the lines written before it"""
+        self.writer.write((' '.join(query.split()) + '\n').encode('utf-8'))
+        await self.writer.drain()
+        error = None
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError('Connection closed by the service')
+            line = line.decode('utf-8').rstrip('\n')
+            if line.startswith(ROW):
+                yield line[len(ROW):]
+            elif line.startswith(ERROR):
+                error = line[len(ERROR):]
+            elif line == END:
+                break
+        if error is not None:
+            raise ServiceError(error)
+
+    async def query(self, query):
+        """ Returns the lines of the result of the query"""
+        return [line async for line in self.rows(query)]
+
+    async def close(self):
+        """ Closes the connection"""
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+def parse_arguments():
+    """ Parses the command line arguments"""
+    parser = argparse.ArgumentParser(description='Mini sql query service')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=5433,
+                        help='port to listen on')
+    parser.add_argument('--socket',
+                        help='Unix socket to listen on instead of a port')
+    parser.add_argument('--threads', type=int, default=THREADS,
+                        help='queries admitted to execution at the same '
+                             'time, taking turns under the GIL')
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING,
+                        help='queries admitted before new ones are rejected')
+    parser.add_argument('--max-connections', type=int,
+                        default=MAX_CONNECTIONS,
+                        help='connections served at the same time')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='processes scanning a large table in parallel')
+    return parser.parse_args()
+
+
+def main():
+    """ Serves the tables of the metadata file in the current directory"""
+    arguments = parse_arguments()
+    service = QueryService(read_meta(METAFILE), arguments.threads,
+                           arguments.max_pending, arguments.max_connections,
+                           workers=arguments.workers)
+    try:
+        asyncio.run(service.serve(arguments.host, arguments.port,
+                                  arguments.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
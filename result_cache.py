@@ -0,0 +1,202 @@
+"""
+Cache of query results, so that a query run again over unchanged files
+writes its result without reading the tables
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from com.nb.dbms.table_storage import temporary_name
+
+
+RESULT_CACHE_BYTES = 64 * 1024 * 1024  # bytes of result lines kept in memory
+DISK_CACHE_BYTES = 1024 * 1024 * 1024  # bytes of result files kept on disk
+POINTER_BYTES = 8  # bytes of the list slot referring to a line
+
+
+def line_size(line):
+    """ Returns the bytes of memory taken by a line kept in a list,
+    several times its length for short lines"""
+    return sys.getsizeof(line) + POINTER_BYTES
+
+
+def lines_size(lines):
+    """ Returns the bytes of memory taken by the lines kept in a list"""
+    return sys.getsizeof([]) + sum(line_size(line) for line in lines)
+
+
+class ResultCache:
+    """Least recently used cache of the result lines of queries, keyed by
+    the query and the version of every file it reads, counting its hits,
+    misses and evictions. Memory is bounded by the memory taken by the
+    lines kept, as measured by sys.getsizeof.
+    Results may also be kept as files in a directory, which outlive the
+    process and are evicted the same way. The cache may be shared by the
+    QueryProcessors of several threads"""
+
+    def __init__(self, size=RESULT_CACHE_BYTES, directory=None,
+                 disk_size=DISK_CACHE_BYTES):
+        """
+        Default constructor
+        :param size: bytes of memory taken by the result lines kept, 0
+        disables the cache
+        :param directory: directory keeping the results on disk, None to
+        keep them in memory only
+        :param disk_size: bytes of result files kept in the directory
+        """
+        self.size = size
+        self.directory = directory
+        self.disk_size = disk_size
+        self.results = OrderedDict()
+        self.used = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get(self, key):
+        """ Returns the result lines of the key, or None if they are not
+        cached"""
+        with self.lock:
+            lines = self.results.get(key)
+            if lines is not None:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return lines
+        lines = self.read(key)
+        with self.lock:
+            if lines is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.keep(key, lines)
+        return lines
+
+    def put(self, key, lines):
+        """ Caches the result lines of the key, evicting the least recently
+        used results while more than size bytes are kept"""
+        if lines_size(lines) > self.size:
+            return
+        with self.lock:
+            self.keep(key, lines)
+        self.write(key, lines)
+
+    def keep(self, key, lines):
+        """ Keeps the lines in memory. Called holding the lock"""
+        if key in self.results:
+            self.used -= lines_size(self.results.pop(key))
+        self.results[key] = lines
+        self.used += lines_size(lines)
+        while self.used > self.size:
+            _, evicted = self.results.popitem(last=False)
+            self.used -= lines_size(evicted)
+            self.evictions += 1
+
+    def file_name(self, key):
+        """ Returns the file keeping the result of the key on disk"""
+        return os.path.join(self.directory, hashlib.sha256(
+            repr(key).encode('utf-8')).hexdigest() + '.json')
+
+    def read(self, key):
+        """ Returns the result lines of the key kept on disk, or None"""
+        if self.directory is None:
+            return None
+        file_name = self.file_name(key)
+        try:
+            with open(file_name) as result_file:
+                result = json.load(result_file)
+            # the modification time orders the files by their last use
+            os.utime(file_name)
+        except (IOError, OSError, ValueError):
+            return None
+        if result['key'] != repr(key):
+            return None
+        return result['lines']
+
+    def write(self, key, lines):
+        """ Keeps the result lines of the key on disk, removing the least
+        recently used files while more than disk_size bytes are kept"""
+        if self.directory is None:
+            return
+        file_name = self.file_name(key)
+        temp = temporary_name(file_name)
+        try:
+            with open(temp, 'w') as result_file:
+                json.dump({'key': repr(key), 'lines': lines}, result_file)
+            os.replace(temp, file_name)
+            files = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    files.append((stat.st_mtime_ns, stat.st_size, name))
+            used = sum(size for _, size, _ in files)
+            for _, size, name in sorted(files):
+                if used <= self.disk_size:
+                    break
+                os.remove(os.path.join(self.directory, name))
+                used -= size
+        except (IOError, OSError):
+            pass
+
+    def clear(self):
+        """ Forgets every result kept in memory"""
+        with self.lock:
+            self.results.clear()
+            self.used = 0
+
+    def stats(self):
+        """ Returns the hits, misses and evictions of the cache and the
+        results and bytes kept in memory"""
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'results': len(self.results), 'bytes': self.used}
+
+
+class RecordingWriter:
+    """Writer passing the result lines on to another writer and keeping
+    them, up to a number of bytes of memory, to be cached"""
+
+    def __init__(self, output, limit):
+        """
+        Default constructor
+        :param output: writer the lines are passed to
+        :param limit: bytes of memory taken by the lines kept, lines is
+        None once the result is larger
+        """
+        self.output = output
+        self.limit = limit
+        self.lines = []
+        self.size = sys.getsizeof(self.lines)
+
+    def recorded(self, lines):
+        """ Yields the lines, keeping them"""
+        for line in lines:
+            if self.lines is not None:
+                self.size += line_size(line)
+                if self.size > self.limit:
+                    self.lines = None
+                else:
+                    self.lines.append(line)
+            yield line
+
+    def write_line(self, line):
+        """ Writes one line of the result"""
+        self.output.write_lines(self.recorded([line]))
+
+    def write_lines(self, lines):
+        """ Writes every line of an iterable of lines"""
+        self.output.write_lines(self.recorded(lines))
+
+    def flush(self):
+        """ Writes out the buffered lines"""
+        self.output.flush()
+
+    def close(self):
+        """ Flushes the writer the lines are passed to"""
+        self.output.flush()
@@ -0,0 +1,134 @@
+"""
+Sorting of rows for order by and sort based joins. Sorts larger than the
+memory budget are written to disk as sorted runs and merged back
+"""
+import heapq
+import pickle
+import tempfile
+from bisect import bisect_left, bisect_right
+
+from com.nb.dbms.predicates import to_value
+
+
+class Descending:
+    """Wraps a sort key so that it sorts in reverse order"""
+    __slots__ = ['key']
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def value_key(value):
+    """ Sort key of a column value. Numbers sort numerically and before
+    strings"""
+    value = to_value(value)
+    if isinstance(value, str):
+        return (1, 0, value)
+    return (0, value, '')
+
+
+def row_key(positions, descending):
+    """ Returns the sort key function for rows ordered by the values at
+    positions, every one ascending or descending"""
+    def key(row):
+        return tuple(Descending(value_key(row[position])) if desc
+                     else value_key(row[position])
+                     for position, desc in zip(positions, descending))
+    return key
+
+
+def external_sort(rows, key, memory_budget):
+    """ Yields the rows sorted by key. Runs of memory_budget rows are
+    sorted in memory and, if there is more than one, written to temporary
+    files and merged. The sort is stable"""
+    runs = []
+    run = []
+    for row in rows:
+        run.append(row)
+        if len(run) >= memory_budget:
+            runs.append(write_run(sorted(run, key=key)))
+            run = []
+    run.sort(key=key)
+    if not runs:
+        for row in run:
+            yield row
+        return
+    runs.append(write_run(run))
+    for row in heapq.merge(*[read_run(run_file) for run_file in runs],
+                           key=key):
+        yield row
+
+
+def write_run(rows):
+    """ Writes a sorted run to a temporary file"""
+    run_file = tempfile.TemporaryFile()
+    for row in rows:
+        pickle.dump(row, run_file, pickle.HIGHEST_PROTOCOL)
+    run_file.seek(0)
+    return run_file
+
+
+def read_run(run_file):
+    """ Yields the rows of a run written by write_run and closes it"""
+    with run_file:
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                return
+
+
+def top_n(rows, limit, key):
+    """ Returns the first limit rows in key order, keeping only limit rows
+    in a heap instead of sorting them all"""
+    return heapq.nsmallest(limit, rows, key=key)
+
+
+def sorted_keys(rows, position):
+    """ Returns the rows sorted by the number at position together with
+    the sorted list of those numbers, or None if a value is not a number"""
+    keyed = []
+    for row in rows:
+        value = to_value(row[1][position])
+        if isinstance(value, str):
+            return None
+        keyed.append((value, row))
+    keyed.sort(key=lambda item: item[0])
+    return [row for _, row in keyed], [value for value, _ in keyed]
+
+
+def merge_join(left_rows, left, oper, right_rows, right):
+    """ Joins (ids, values) rows on `left oper right` for the comparisons
+    =, <, >, <= and >=. Both inputs are sorted once on their join column
+    and swept together, every left row is matched with a contiguous range
+    of the sorted right rows. Returns a list of (left row, right rows)
+    pairs, or None if a join value is not a number"""
+    left_sorted = sorted_keys(left_rows, left)
+    right_sorted = sorted_keys(right_rows, right)
+    if left_sorted is None or right_sorted is None:
+        return None
+    right_rows, keys = right_sorted
+    low, high = 0, 0
+    matches = []
+    for value, row in zip(left_sorted[1], left_sorted[0]):
+        # keys[low:] >= value and keys[high:] > value
+        low = bisect_left(keys, value, low)
+        high = bisect_right(keys, value, max(low, high))
+        if oper == '=':
+            matched = right_rows[low:high]
+        elif oper == '<':
+            matched = right_rows[high:]
+        elif oper == '<=':
+            matched = right_rows[low:]
+        elif oper == '>':
+            matched = right_rows[:low]
+        else:
+            matched = right_rows[:high]
+        matches.append((row, matched))
+    return matches
@@ -0,0 +1,417 @@
+"""
+Access to the data stored for each table
+"""
+import json
+import mmap
+import os
+import shutil
+import threading
+from array import array
+from datetime import date
+
+from com.nb.dbms.compressed import scan_compressed
+from com.nb.dbms.utility_functions import column_types, error_exit, \
+scan_table, storage_format, table_file
+
+
+CACHE_ROWS = 65536  # values buffered per column before writing them out
+CACHE_FORMAT = 2  # caches written in another format are built again
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class TableScan:
+    """Lazily readable table. Every iteration reads the table again
+    from the start, so rows are never all held in memory at once"""
+
+    def __init__(self, table_name, columns=None, use_cache=False):
+        """
+        Default constructor
+        :param table_name: name of the table to scan
+        :param columns: column names of the table from the metadata
+        :param use_cache: answer column stats and arrays from the table's
+        columnar cache, building the cache the first time one is asked for
+        if it is missing or out of date
+        """
+        self.storage = storage_format(columns)
+        if not os.path.isfile(table_file(table_name, self.storage)):
+            error_exit('ERR: No file for given table: \'' + table_name +
+                       '\' found')
+        self.table_name = table_name
+        self.columns = columns
+        self.types = column_types(columns) if columns is not None else None
+        self.use_cache = use_cache and columns is not None
+        self.cache = None
+
+    def __iter__(self):
+        # rows are always parsed from the file, rebuilding them from the
+        # cached columns is slower than parsing the csv
+        return typed_rows(scan_file(self.table_name, self.storage),
+                          self.table_name, self.types)
+
+    def column_cache(self):
+        """ Returns the columnar cache of the table, loaded on first use,
+        or None if it is not used or the table could not be cached"""
+        if self.use_cache:
+            self.use_cache = False
+            cache = ColumnarCache(self.table_name, self.columns)
+            if cache.load():
+                self.cache = cache
+        return self.cache
+
+    def int_column(self, index):
+        """ Returns the column at index as a sequence of ints if the cache
+        stores it as one and it is not declared as another type, otherwise
+        None"""
+        cache = self.column_cache()
+        if cache is not None and cache.types[index] == 'q' and \
+                self.declared(index) in (None, 'int'):
+            return cache.data[index]
+        return None
+
+    def numeric_column(self, index):
+        """ Returns the column at index as a sequence of ints or floats if
+        the cache stores it as one and it is not declared as another type,
+        otherwise None"""
+        cache = self.column_cache()
+        if cache is not None and cache.types[index] != 's' and \
+                self.declared(index) in (None, {'q': 'int', 'd': 'float'}[
+                    cache.types[index]]):
+            return cache.data[index]
+        return None
+
+    def row_count(self):
+        """ Returns the number of rows if the cache stores the table,
+        otherwise None"""
+        cache = self.column_cache()
+        if cache is not None:
+            return cache.row_count
+        return None
+
+    def declared(self, index):
+        """ Returns the declared type of the column at index, or None"""
+        return self.types[index] if self.types is not None else None
+
+
+def scan_file(table_name, storage='csv'):
+    """ Returns the rows of strings of the table's file in the storage
+    format, read one at a time"""
+    if storage == 'gzip':
+        return scan_compressed(table_name)
+    return scan_table(table_name)
+
+
+def cache_directory(table_name):
+    """ Returns the directory holding the columnar cache of the table"""
+    return '.' + table_name + '.cache'
+
+
+def file_version(file_name):
+    """ Returns the modification time and size identifying the current
+    contents of the file"""
+    stat = os.stat(file_name)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def file_identity(file_name):
+    """ Returns the inode, modification time and size of the file, which
+    change when it is replaced or written to"""
+    stat = os.stat(file_name)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def temporary_name(file_name):
+    """ Returns the name under which the file is written before being
+    moved in place, unique to the current process and thread"""
+    return file_name + '.' + str(os.getpid()) + '.' + \
+        str(threading.get_ident())
+
+
+def narrow_type(kind, value):
+    """ Returns the storage type able to hold value and all values stored
+    as kind so far: 'q' for int64, 'd' for double and 's' for string, kind
+    being None before the first value. Numbers are only stored as such if
+    they print back to the same text, so a column mixing ints and floats is
+    stored as strings"""
+    if kind in (None, 'q'):
+        try:
+            number = int(value)
+            if INT64_MIN <= number <= INT64_MAX and str(number) == value:
+                return 'q'
+        except ValueError:
+            pass
+        if kind == 'q':
+            return 's'
+    try:
+        if repr(float(value)) == value:
+            return 'd'
+    except ValueError:
+        pass
+    return 's'
+
+
+CONVERTERS = {'int': int, 'float': float, 'date': date.fromisoformat}
+
+
+def typed_rows(rows, table_name, types):
+    """ Yields the rows of strings read from the csv of the table as
+    tuples holding the value of every typed column converted to its type.
+    Rows are passed on as they are if no column has a type to convert to.
+    Empty values stay empty strings"""
+    if types is None or not any(kind in CONVERTERS for kind in types):
+        for row in rows:
+            yield row
+        return
+    convert = row_converter(types)
+    for row in rows:
+        try:
+            yield convert(row)
+        except (ValueError, IndexError):
+            yield convert_values(row, table_name, types)
+
+
+def row_converter(types):
+    """ Returns a function converting a row of strings holding a value
+    for every column to a typed tuple, raising ValueError when some value
+    is empty or not of its column's type"""
+    values = []
+    for position, kind in enumerate(types):
+        if kind in CONVERTERS:
+            values.append('%s(row[%d])' % (kind, position))
+        else:
+            values.append('row[%d]' % position)
+    source = 'lambda row: (' + ', '.join(values) + ',)'
+    return eval(compile(source, '<row>', 'eval'), dict(CONVERTERS))
+
+
+def convert_values(row, table_name, types):
+    """ Converts the row one value at a time, keeping empty values and
+    the values past the typed columns as they are"""
+    values = []
+    for value, kind in zip(row, types):
+        if value == '' or kind not in CONVERTERS:
+            values.append(value)
+            continue
+        try:
+            values.append(CONVERTERS[kind](value))
+        except ValueError:
+            error_exit('ERR: Value \'' + value + '\' in table \'' +
+                       table_name + '\' is not of type ' + kind)
+    return tuple(values) + tuple(row[len(types):])
+
+
+def map_file(file_name):
+    """ Memory maps the file for reading and returns a memoryview of it"""
+    with open(file_name, 'rb') as data_file:
+        if os.fstat(data_file.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(data_file.fileno(), 0,
+                                    access=mmap.ACCESS_READ))
+
+
+class StringColumn:
+    """Column of strings stored as utf-8 bytes with an array of offsets"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return bytes(self.blob[self.offsets[index]:
+                               self.offsets[index + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        return self.values(0, len(self))
+
+    def values(self, start, end):
+        """ Yields the strings from index start up to end"""
+        for index in range(start, end):
+            yield self[index]
+
+
+class ColumnarCache:
+    """Binary copy of a table's csv file with one file per column, which
+    is memory mapped to answer column stats and arrays without parsing the
+    csv. Rows are still read from the csv. The cache lives in its own
+    directory next to the csv and is rebuilt whenever the csv's
+    modification time or size changes"""
+
+    def __init__(self, table_name, columns):
+        """
+        Default constructor
+        :param table_name: name of the cached table
+        :param columns: column names of the table from the metadata
+        """
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.storage = storage_format(columns)
+        self.directory = cache_directory(table_name)
+        self.row_count = 0
+        self.types = []
+        self.data = []
+
+    def read_meta(self, directory=None):
+        """ Returns the description of the cache, or None if there is none"""
+        try:
+            with open(os.path.join(directory or self.directory,
+                                   'meta.json')) as meta_file:
+                return json.load(meta_file)
+        except (IOError, ValueError):
+            return None
+
+    def is_valid(self):
+        """ Checks that the cache was built from the current csv file"""
+        meta = self.read_meta()
+        return meta is not None and meta.get('format') == CACHE_FORMAT and \
+            meta['columns'] == self.columns and \
+            meta['version'] == file_version(table_file(self.table_name,
+                                                       self.storage))
+
+    def load(self):
+        """ Maps the cached columns into memory, building the cache first
+        if needed. Returns False when the table could not be cached"""
+        try:
+            if not self.is_valid() and not self.build():
+                return False
+            meta = self.read_meta()
+            self.row_count = meta['rows']
+            self.types = meta['types']
+            self.data = []
+            for index, kind in enumerate(self.types):
+                if kind == 's':
+                    self.data.append(StringColumn(
+                        map_file(self.column_file(index, '.off')).cast('q'),
+                        map_file(self.column_file(index, '.str'))))
+                else:
+                    self.data.append(
+                        map_file(self.column_file(index, '.col')).cast(kind))
+        except (IOError, OSError, TypeError):
+            return False
+        return True
+
+    def column_file(self, index, suffix, directory=None):
+        """ Returns the file holding the data of the column at index"""
+        return os.path.join(directory or self.directory, str(index) + suffix)
+
+    def build(self):
+        """ Writes the cache from the csv file into a temporary directory
+        and moves it in place. Returns False if the csv has rows whose
+        length does not match the metadata"""
+        version = file_version(table_file(self.table_name, self.storage))
+        temp = temporary_name(self.directory)
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+        try:
+            width = len(self.columns)
+            blobs = [open(self.column_file(i, '.str', temp), 'wb')
+                     for i in range(width)]
+            offset_files = [open(self.column_file(i, '.off', temp), 'wb')
+                            for i in range(width)]
+            offsets = [array('q', [0]) for _ in range(width)]
+            positions = [0] * width
+            types = [None] * width
+            rows = 0
+            try:
+                for row in scan_file(self.table_name, self.storage):
+                    if len(row) != width:
+                        return False
+                    for i, value in enumerate(row):
+                        encoded = value.encode('utf-8')
+                        blobs[i].write(encoded)
+                        positions[i] += len(encoded)
+                        offsets[i].append(positions[i])
+                        if types[i] != 's':
+                            types[i] = narrow_type(types[i], value)
+                    rows += 1
+                    if rows % CACHE_ROWS == 0:
+                        for i in range(width):
+                            offsets[i].tofile(offset_files[i])
+                            offsets[i] = array('q')
+                for i in range(width):
+                    offsets[i].tofile(offset_files[i])
+            finally:
+                for data_file in blobs + offset_files:
+                    data_file.close()
+            # columns without values are stored as empty int columns
+            types = [kind or 'q' for kind in types]
+            for i, kind in enumerate(types):
+                if kind != 's':
+                    self.convert_column(temp, i, kind)
+            with open(os.path.join(temp, 'meta.json'), 'w') as meta_file:
+                json.dump({'format': CACHE_FORMAT, 'columns': self.columns,
+                           'version': version, 'rows': rows, 'types': types},
+                          meta_file)
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.rename(temp, self.directory)
+            return True
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+
+    def convert_column(self, directory, index, kind):
+        """ Rewrites a string column file as a typed array file"""
+        strings = StringColumn(
+            map_file(self.column_file(index, '.off', directory)).cast('q'),
+            map_file(self.column_file(index, '.str', directory)))
+        convert = int if kind == 'q' else float
+        with open(self.column_file(index, '.col', directory), 'wb') as out:
+            chunk = array(kind)
+            for value in strings:
+                chunk.append(convert(value))
+                if len(chunk) == CACHE_ROWS:
+                    chunk.tofile(out)
+                    chunk = array(kind)
+            chunk.tofile(out)
+        del strings
+        os.remove(self.column_file(index, '.off', directory))
+        os.remove(self.column_file(index, '.str', directory))
+
+
+class LoadedTable(list):
+    """Rows of a table held in memory between queries, together with the
+    version of the csv file they were read from"""
+
+    def __init__(self, scan, columns, rows=None):
+        """
+        Default constructor
+        :param scan: TableScan of the table to load
+        :param columns: column names of the table from the metadata
+        :param rows: rows already read by the scan, None to read them
+        """
+        self.version = file_version(table_file(scan.table_name, scan.storage))
+        list.__init__(self, scan if rows is None else rows)
+        self.scan = scan
+        self.columns = list(columns)
+        self.types = column_types(columns)
+
+    def is_current(self, columns):
+        """ Checks that the csv file and the columns in the metadata have
+        not changed since the table was loaded"""
+        try:
+            return self.columns == list(columns) and \
+                self.types == column_types(columns) and \
+                self.scan.storage == storage_format(columns) and \
+                self.version == file_version(table_file(self.scan.table_name,
+                                                        self.scan.storage))
+        except OSError:
+            return False
+
+    def row_count(self):
+        """ Returns the number of rows held"""
+        return len(self)
+
+    def int_column(self, index):
+        """ Same as TableScan.int_column"""
+        return self.scan.int_column(index)
+
+    def numeric_column(self, index):
+        """ Same as TableScan.numeric_column"""
+        return self.scan.numeric_column(index)
+
+
+def materialize(tables_data):
+    """ Reads every table of tables_data into a list, for operations
+    that need to go over a table more than once"""
+    return dict((table, rows if isinstance(rows, list) else list(rows))
+                for table, rows in tables_data.items())
@@ -0,0 +1,66 @@
+"""
+Makes the engine importable as com.nb.dbms from the source tree and
+provides the tables the tests query
+"""
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for name, path in (('com', []), ('com.nb', []), ('com.nb.dbms', [ROOT])):
+    if name not in sys.modules:
+        sys.modules[name] = types.ModuleType(name)
+        sys.modules[name].__path__ = path
+
+from com.nb.dbms.QueryProcessor import QueryProcessor  # noqa: E402
+from com.nb.dbms.utility_functions import read_meta  # noqa: E402
+
+
+class Database:
+    """Tables written as csv files into a directory, queried through a
+    QueryProcessor writing to a file"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+
+    def table(self, name, columns, rows, storage=None):
+        """ Writes the table's csv file and adds it to the metadata.
+        columns are names, optionally followed by a type"""
+        self.tables[name] = (columns, storage)
+        with open(os.path.join(self.directory, name + '.csv'), 'w') as data:
+            for row in rows:
+                data.write(','.join(str(value) for value in row) + '\n')
+        with open(os.path.join(self.directory, 'metadata.txt'), 'w') as meta:
+            for table, (table_columns, table_storage) in self.tables.items():
+                meta.write('<begin_table>\n' + table +
+                           (' ' + table_storage if table_storage else '') +
+                           '\n')
+                for column in table_columns:
+                    meta.write(column + '\n')
+                meta.write('<end_table>\n')
+
+    def processor(self, **options):
+        """ Returns a QueryProcessor of the tables writing to result.txt"""
+        options.setdefault('output_file',
+                           os.path.join(self.directory, 'result.txt'))
+        return QueryProcessor(read_meta('metadata.txt'), **options)
+
+    def query(self, query, processor=None, **options):
+        """ Runs the query and returns the lines of its result"""
+        processor = processor or self.processor(**options)
+        start = os.path.getsize(processor.output.file.name)
+        processor.process_query(query)
+        with open(processor.output.file.name) as result:
+            result.seek(start)
+            return result.read().splitlines()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """ Database in a temporary directory, which is the current one"""
+    monkeypatch.chdir(tmp_path)
+    return Database(str(tmp_path))
@@ -0,0 +1,73 @@
+import pytest
+
+from com.nb.dbms.batch import QueryBatch
+from com.nb.dbms.utility_functions import QueryError
+
+QUERIES = ['select count(*) from facts', 'select count(B) from facts',
+           'select count(A) from facts', 'select max(B) from facts']
+ANSWERS = [['facts.*,', '3,'], ['facts.B,', '3,'], ['facts.A,', '2,'],
+           ['facts.B,', 'z,']]
+
+
+@pytest.mark.parametrize('options', [
+    {'materialized': False}, {'materialized': False, 'use_cache': True},
+    {'materialized': True}, {'materialized': False, 'vectorized': True},
+    {'materialized': False, 'vectorized': True, 'use_cache': True}])
+@pytest.mark.parametrize('columns', [['A', 'B'], ['A int', 'B string']])
+def test_count_reads_no_values(database, columns, options):
+    database.table('facts', columns, [('', 'x'), (2, 'z'), (3, 'y')])
+    for query, answer in zip(QUERIES, ANSWERS):
+        assert database.query(query, **options) == answer
+
+
+def test_count_in_batch(database):
+    database.table('facts', ['A int', 'B'], [('', 'x'), (2, 'z'), (3, 'y')])
+    processor = database.processor(materialized=False)
+    QueryBatch(processor, QUERIES).run()
+    with open(processor.output.file.name) as result:
+        assert result.read().splitlines() == sum(ANSWERS, [])
+
+
+def test_count_from_cache(database):
+    database.table('facts', ['A', 'B'], [(1, 'x'), (2, 'z'), (3, 'y')])
+    processor = database.processor(materialized=False, use_cache=True)
+    assert database.query('select count(*) from facts', processor) == \
+        ['facts.*,', '3,']
+    assert database.query('select count(*), sum(A) from facts',
+                          processor) == ['facts.*,facts.A,', '3,6,']
+
+
+def test_batch_reports_query_errors_in_turn(database, capsys):
+    database.table('facts', ['A', 'B'], [(1, 2), (3, 4)])
+    processor = database.processor(materialized=False)
+    with pytest.raises(QueryError):
+        QueryBatch(processor, ['select sum(A) from facts',
+                               'select A from facts where C > 1']).run()
+    with open(processor.output.file.name) as result:
+        assert result.read().splitlines() == ['facts.A,', '4,']
+    assert capsys.readouterr().err.startswith('No Such column \'C\'')
+
+
+def test_batch_raises_unexpected_errors(database, monkeypatch):
+    database.table('facts', ['A', 'B'], [(1, 2), (3, 4)])
+    processor = database.processor(materialized=False)
+
+    def broken(*args):
+        raise RuntimeError('broken')
+    monkeypatch.setattr(QueryBatch, 'scan', broken)
+    with pytest.raises(RuntimeError):
+        QueryBatch(processor, ['select sum(A) from facts']).run()
+
+
+@pytest.mark.parametrize('options', [
+    {'materialized': False}, {'materialized': True},
+    {'materialized': False, 'workers': 2}])
+@pytest.mark.parametrize('query', ['select max(A) from facts',
+                                   'select min(A) from facts',
+                                   'select B, max(A) from facts group by B'])
+def test_mixed_column_reports_error(database, capsys, query, options):
+    database.table('facts', ['A', 'B'], [(5, 1), ('abc', 1), (7, 1)])
+    with pytest.raises(QueryError):
+        database.query(query, **options)
+    assert capsys.readouterr().err.startswith(
+        'ERR: Column holds both numbers and text')
@@ -0,0 +1,26 @@
+import os
+
+from com.nb.dbms.indexes import index_directory
+
+
+def test_index_leaves_out_nulls(database):
+    database.table('facts', ['A int', 'B'], [(1, 'x'), ('', 'y'), (3, 'z')])
+    processor = database.processor(result_cache_size=0)
+    assert database.query('create index on facts (A)', processor) == \
+        ['Index created on facts.A']
+    with open('facts.csv', 'a') as data:
+        data.write(',w\n5,v\n')
+    assert database.query('select B from facts where A > 1', processor) == \
+        ['facts.B', 'z', 'v']
+    assert os.path.isdir(index_directory('facts', 'A'))
+
+
+def test_index_dropped_when_column_stops_being_numeric(database):
+    database.table('facts', ['A', 'B'], [(1, 'x'), (2, 'y')])
+    processor = database.processor(result_cache_size=0)
+    database.query('create index on facts (A)', processor)
+    with open('facts.csv', 'a') as data:
+        data.write('abc,z\n2,w\n')
+    assert database.query('select B from facts where A = 2', processor) == \
+        ['facts.B', 'y', 'w']
+    assert not os.path.isdir(index_directory('facts', 'A'))
@@ -0,0 +1,50 @@
+import os
+import tracemalloc
+
+from com.nb.dbms.materialized import AggregateView
+
+
+def test_refresh_streams_rows(database):
+    rows = [(i, i % 7) for i in range(200000)]
+    database.table('facts', ['A', 'B'], rows)
+    view = AggregateView('facts', ['A', 'B'])
+    tracemalloc.start()
+    try:
+        assert view.refresh()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # the csv is about 2 MB, reading it whole takes several times that
+    assert peak < 512 * 1024
+    assert view.stat(0) == [200000, sum(range(200000)), 0, 199999]
+    assert view.stat(1)[0] == 200000
+
+
+def test_refresh_reads_appended_rows(database):
+    database.table('facts', ['A'], [(1,), (2,)])
+    view = AggregateView('facts', ['A'])
+    assert view.refresh()
+    with open('facts.csv', 'a') as data:
+        data.write('5\n7')
+    view = AggregateView('facts', ['A'])
+    assert view.refresh()
+    # the unterminated last line is counted but not consumed
+    assert view.stat(0) == [4, 15, 1, 7]
+    assert view.offset == len('1\n2\n5\n')
+    assert database.query('select max(A) from facts') == ['facts.A,', '7,']
+
+
+def test_refresh_recomputes_rewrite_of_same_size(database):
+    database.table('facts', ['A'], [(i,) for i in range(10000, 20000)])
+    view = AggregateView('facts', ['A'])
+    assert view.refresh()
+    stat = os.stat('facts.csv')
+    with open('facts.csv', 'r+b') as data:
+        # a middle row edited in place, keeping the first and last bytes
+        data.seek(len('10000\n') * 5000)
+        data.write(b'99999')
+    os.utime('facts.csv', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    view = AggregateView('facts', ['A'])
+    assert view.refresh()
+    assert view.stat(0) == [10000, sum(range(10000, 20000)) - 15000 + 99999,
+                            10000, 99999]
@@ -0,0 +1,24 @@
+import pytest
+
+from com.nb.dbms.parallel_scan import chunk_ranges
+
+
+@pytest.mark.parametrize('content', ['', '1\n', '1,2\n', '1\n2\n3\n4\n5\n'])
+def test_chunk_ranges_of_small_files(tmp_path, content):
+    file_name = str(tmp_path / 'small.csv')
+    with open(file_name, 'w') as data_file:
+        data_file.write(content)
+    ranges = chunk_ranges(file_name, 4)
+    # consecutive ranges covering the file, each starting at a line
+    boundaries = [0] + [end for _, end in ranges]
+    assert ranges == list(zip(boundaries, boundaries[1:]))
+    assert boundaries[-1] == len(content)
+    assert all(start == 0 or content[start - 1] == '\n'
+               for start, _ in ranges)
+
+
+def test_parallel_scan_of_small_table(database):
+    database.table('e', ['X', 'Y'], [(1, 2)])
+    assert database.query('select X from e', workers=2) == ['e.X', '1']
+    assert database.query('select sum(Y) from e', workers=2,
+                          materialized=False) == ['e.Y,', '2,']
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from com.nb.dbms.planner import TableStatistics, execute_plan, plan_joins
+from com.nb.dbms.predicates import parse_condition
+
+
+def join(rows1, rows2, hashed):
+    """ Executes `t1.a = t2.b` as a hash join or as a nested loop join"""
+    locate = lambda name: (name.split('.')[0], 0 if name == 't1.a' else 1)
+    statistics = {'t1': TableStatistics(rows1), 't2': TableStatistics(rows2)}
+    tree = parse_condition('t1.a = t2.b')
+    plan = plan_joins(['t1', 't2'], tree, locate, statistics)
+    assert plan.steps[1].equality is not None
+    if not hashed:
+        plan.steps[1].equality = None
+        plan.steps[1].conditions = [tree]
+    return execute_plan(plan, {'t1': rows1, 't2': rows2}, locate,
+                        {'t1': 2, 't2': 2})
+
+
+@pytest.mark.parametrize('sizes', [(10, 300), (300, 10), (50, 50)])
+def test_hash_join_on_either_side(sizes):
+    random.seed(sizes[0])
+    rows1, rows2 = [[[str(random.randrange(20)), str(i)] for i in range(size)]
+                    for size in sizes]
+    joined = join(rows1, rows2, True)
+    assert joined == join(rows1, rows2, False)
+    assert len(joined) > 0
+
+
+def test_join_query_keeps_row_order(database):
+    database.table('small', ['A', 'B'], [(3, 'x'), (1, 'y')])
+    database.table('large', ['C', 'D'], [(i % 4, i) for i in range(12)])
+    lines = database.query('select B, D from small, large where A = C')
+    assert lines == ['small.B,large.D', 'x,3', 'x,7', 'x,11', 'y,1', 'y,5',
+                     'y,9']
@@ -0,0 +1,40 @@
+from com.nb.dbms.predicates import compile_predicate, parse_condition
+
+
+def test_typed_null_satisfies_no_comparison():
+    predicate = compile_predicate(parse_condition('A > 3'),
+                                  {'A': 0}.__getitem__, typed=[0])
+    assert predicate((5,))
+    assert not predicate((2,))
+    assert not predicate(('',))
+
+
+def test_where_skips_empty_typed_cells(database):
+    database.table('facts', ['A int', 'B int'], [(1, 10), ('', 20), (5, 30)])
+    assert database.query('select B from facts where A > 3') == \
+        ['facts.B', '30']
+    assert database.query('select B from facts where A < 3 or B = 20') == \
+        ['facts.B', '10', '20']
+
+
+def joined_tables(database):
+    database.table('t', ['A int', 'S string'], [(1, 5), ('', 'x'), (3, 'y')])
+    database.table('u', ['A int', 'B int'], [(1, 0), ('', 0), (3, 0)])
+
+
+def test_join_skips_empty_typed_cells(database):
+    joined_tables(database)
+    assert database.query('select t.A, u.A from t, u where t.A < u.A') == \
+        ['t.A,u.A', '1,3']
+    assert database.query('select t.A, u.A from t, u where t.A = u.A') == \
+        ['t.A,u.A', '1,1', '3,3']
+    assert database.query('select t.A, u.A from t, u '
+                          'where t.A = u.A or t.A > 2') == \
+        ['t.A,u.A', '1,1', '3,1', '3', '3,3']
+
+
+def test_join_compares_string_columns_as_text(database):
+    joined_tables(database)
+    assert database.query('select S from t where S = 5') == ['t.S', '5']
+    assert database.query('select S, u.A from t, u '
+                          'where S = 5 and t.A = u.A') == ['t.S,u.A', '5,1']
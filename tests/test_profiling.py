@@ -0,0 +1,36 @@
+import json
+
+
+def test_explain_analyze_counts_typed_bytes(database):
+    database.table('facts', ['A int', 'B float'], [(1, 2.5), (30, ''), (4, 1)])
+    profile = json.loads(
+        database.query('explain analyze select A from facts')[0])
+    # the text of every value and a separator after it
+    assert profile['bytes_read'] == len('1,2.5,30,,4,1.0,')
+
+
+def test_profiled_queries_bypass_result_cache(database):
+    database.table('facts', ['A', 'B'], [(1, 2), (3, 4)])
+    processor = database.processor()
+    assert database.query('select A from facts', processor) == \
+        ['facts.A', '1', '3']
+    profile = json.loads(
+        database.query('explain analyze select A from facts', processor)[0])
+    assert profile['bytes_read'] > 0
+    assert 'result cache' not in [stage['stage']
+                                  for stage in profile['stages']]
+    database.query('explain analyze select B from facts', processor)
+    assert processor.result_cache.stats()['hits'] == 0
+    assert processor.result_cache.stats()['results'] == 1
+
+
+def test_explain_analyze_counts_join(database):
+    database.table('left', ['A', 'B'], [(1, 2), (3, 4), (5, 6)])
+    database.table('right', ['C', 'D'], [(1, 7), (3, 8)])
+    profile = json.loads(database.query(
+        'explain analyze select A, D from left, right '
+        'where A = C and D > 7 and B > 0')[0])
+    assert profile['evaluations'] > 0
+    stages = dict((stage['stage'], stage) for stage in profile['stages'])
+    assert stages['join']['rows_in'] == 5
+    assert stages['join']['rows_out'] == 1
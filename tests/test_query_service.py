@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from com.nb.dbms.query_service import QueryClient, QueryService, ServiceError
+from com.nb.dbms.utility_functions import QueryError, error_exit, \
+raised_errors, read_meta
+
+
+def serve(database, test, **options):
+    """ Runs the coroutine function test with a service of the database's
+    tables listening on a Unix socket and the path of the socket"""
+    service = QueryService(read_meta('metadata.txt'), **options)
+    path = database.directory + '/service.sock'
+
+    async def run():
+        server = await service.start(path=path)
+        async with server:
+            return await test(service, path)
+    try:
+        return asyncio.run(run())
+    finally:
+        service.close()
+
+
+def test_query_error_message():
+    with raised_errors(), pytest.raises(QueryError) as error:
+        error_exit('ERR: broken')
+    assert str(error.value) == 'ERR: broken'
+
+
+def test_client_raises_query_errors(database):
+    database.table('facts', ['A'], [(1,), (2,)])
+
+    async def test(service, path):
+        client = await QueryClient.connect(path=path)
+        try:
+            errors = await asyncio.gather(client.query('select B from facts'),
+                                          return_exceptions=True)
+            return errors[0], await client.query('select A from facts')
+        finally:
+            await client.close()
+    error, rows = serve(database, test)
+    assert isinstance(error, ServiceError)
+    assert str(error).startswith('No Such column \'B\'')
+    assert rows == ['facts.A', '1', '2']
+
+
+@pytest.mark.parametrize('cancel', [False, True])
+def test_client_disconnecting_mid_stream(database, cancel):
+    database.table('facts', ['A', 'B'], [(i, i % 3) for i in range(50000)])
+
+    async def test(service, path):
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context))
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b'select * from facts\n')
+        await writer.drain()
+        assert await reader.readline() == b'+facts.A,facts.B\n'
+        if cancel:
+            for task in asyncio.all_tasks():
+                if task.get_coro().__qualname__ == 'QueryService.handle':
+                    task.cancel()
+        writer.transport.abort()
+        # the only thread of the service is free for the next query
+        client = await QueryClient.connect(path=path)
+        try:
+            rows = await asyncio.wait_for(
+                client.query('select count(*) from facts'), 10)
+        finally:
+            await client.close()
+        return rows, service.stats(), errors
+    rows, stats, errors = serve(database, test, threads=1)
+    assert rows == ['facts.*,', '50000,']
+    assert stats['pending'] == 0 and stats['served'] == 1
+    assert errors == []
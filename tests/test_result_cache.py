@@ -0,0 +1,32 @@
+import tracemalloc
+
+from com.nb.dbms.result_cache import RecordingWriter, ResultCache, lines_size
+from com.nb.dbms.utility_functions import OutputWriter
+
+
+def test_size_counts_memory_of_lines():
+    tracemalloc.start()
+    try:
+        lines = [str(i) + ',' + str(i % 7) for i in range(100000)]
+        taken, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert lines_size(lines) >= taken * 0.9
+    assert lines_size(lines) > 4 * sum(len(line) + 1 for line in lines)
+
+
+def test_large_result_is_not_kept(tmp_path):
+    lines = [str(i) for i in range(1000)]
+    cache = ResultCache(size=lines_size(lines) - 1)
+    cache.put('key', lines)
+    assert cache.stats()['results'] == 0
+    recorder = RecordingWriter(OutputWriter(str(tmp_path / 'out')),
+                               lines_size(lines) - 1)
+    recorder.write_lines(lines)
+    recorder.close()
+    assert recorder.lines is None
+    recorder = RecordingWriter(OutputWriter(str(tmp_path / 'out')),
+                               lines_size(lines))
+    recorder.write_lines(lines)
+    recorder.close()
+    assert recorder.lines == lines
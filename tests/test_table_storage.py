@@ -0,0 +1,41 @@
+import os
+
+from com.nb.dbms.table_storage import ColumnarCache, narrow_type
+
+
+def narrowed(values):
+    kind = None
+    for value in values:
+        kind = narrow_type(kind, value)
+    return kind
+
+
+def test_narrow_type():
+    assert narrowed(['1', '-2']) == 'q'
+    assert narrowed(['1.5', '2.25']) == 'd'
+    assert narrowed(['1', '2.5']) == 's'
+    assert narrowed(['2.5', '1']) == 's'
+    assert narrowed(['1', 'x']) == 's'
+    assert narrowed(['01']) == 's'
+
+
+def test_mixed_int_float_column(database):
+    database.table('facts', ['A', 'B'], [(1, 1.5), (2, 3), (3, 2.5)])
+    cache = ColumnarCache('facts', ['A', 'B'])
+    assert cache.load()
+    assert cache.types == ['q', 's']
+    for use_cache in (False, True, True):
+        assert database.query('select B from facts', use_cache=use_cache) == \
+            ['facts.B', '1.5', '3', '2.5']
+
+
+def test_cache_is_built_for_column_stats_only(database):
+    database.table('facts', ['A', 'B'], [(1, 'x'), (2, 'y')])
+    processor = database.processor(materialized=False, use_cache=True,
+                                   result_cache_size=0)
+    assert database.query('select A from facts', processor) == \
+        ['facts.A', '1', '2']
+    assert not os.path.exists('.facts.cache')
+    assert database.query('select sum(A) from facts', processor) == \
+        ['facts.A,', '3,']
+    assert os.path.exists('.facts.cache')
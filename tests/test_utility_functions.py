@@ -0,0 +1,43 @@
+import io
+import sys
+
+from com.nb.dbms.utility_functions import OutputWriter
+
+
+def test_output_follows_stdout(monkeypatch):
+    writer = OutputWriter()
+    first, second = io.StringIO(), io.StringIO()
+    monkeypatch.setattr(sys, 'stdout', first)
+    writer.write_line('a')
+    monkeypatch.setattr(sys, 'stdout', second)
+    writer.write_lines(['b', 'c'])
+    writer.close()
+    assert first.getvalue() == 'a\n'
+    assert second.getvalue() == 'b\nc\n'
+
+
+def test_results_written_to_stdout(database, capsys):
+    database.table('facts', ['A'], [(1,), (2,)])
+    processor = database.processor(output_file=None)
+    processor.process_query('select A from facts')
+    print('END_OF_RESULT')
+    assert capsys.readouterr().out == 'facts.A\n1\n2\nEND_OF_RESULT\n'
+
+
+def test_lines_written_to_stdout_at_once(monkeypatch):
+    writes = []
+
+    class Recorded(io.StringIO):
+        def write(self, text):
+            writes.append(text)
+            return io.StringIO.write(self, text)
+    output = Recorded()
+    monkeypatch.setattr(sys, 'stdout', output)
+    writer = OutputWriter()
+    writer.write_line('header')
+    writer.write_lines(str(i) for i in range(10000))
+    assert writes == []
+    writer.flush()
+    assert len(writes) == 1
+    assert output.getvalue().splitlines() == \
+        ['header'] + [str(i) for i in range(10000)]
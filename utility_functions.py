@@ -4,10 +4,138 @@ Contains various utility functions required for the mini sql Shell
 import re
 import sys
 import csv
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from operator import itemgetter
+
+OUTPUT_BUFFER = 1024 * 1024  # bytes of result lines written at once
+OUTPUT_CHUNK_LINES = 4096  # lines taken from an iterable at once
+COLUMN_TYPES = ['int', 'float', 'string', 'date']
+STORAGE_FORMATS = {'csv': '.csv', 'gzip': '.csv.gz'}  # file suffix of each
+ERRORS = threading.local()  # quiet is set while errors are only raised
+
+
+class OutputWriter:
+    """Buffered writer for the lines of query results. Lines for stdout
+    are gathered up to OUTPUT_BUFFER bytes and written to it at once"""
+
+    def __init__(self, file_name=None):
+        """
+        Default constructor
+        :param file_name: file to write the results to, stdout if None
+        """
+        self.file = None
+        if file_name is not None:
+            self.file = open(file_name, 'w', buffering=OUTPUT_BUFFER)
+        self.pending = []
+        self.pending_size = 0
+        self.stdout = None
+
+    def write_line(self, line):
+        """ Writes one line of the result"""
+        if self.file is not None:
+            self.file.write(line + '\n')
+            return
+        self.gather([line])
+
+    def write_lines(self, lines):
+        """ Writes every line of an iterable of lines"""
+        if self.file is not None:
+            self.file.writelines(line + '\n' for line in lines)
+            return
+        lines = iter(lines)
+        while True:
+            chunk = list(islice(lines, OUTPUT_CHUNK_LINES))
+            if not chunk:
+                return
+            self.gather(chunk)
+
+    def gather(self, lines):
+        """ Adds the lines to the ones waiting for stdout. stdout is looked
+        up on every write, so that it may be redirected or replaced
+        meanwhile, the lines gathered before going to the stdout they
+        were written for"""
+        if sys.stdout is not self.stdout:
+            self.write_pending()
+            self.stdout = sys.stdout
+        self.pending.extend(lines)
+        self.pending_size += sum(map(len, lines)) + len(lines)
+        if self.pending_size >= OUTPUT_BUFFER:
+            self.write_pending()
+
+    def write_pending(self):
+        """ Writes the gathered lines to the stdout they were written for"""
+        if self.pending:
+            self.pending.append('')
+            self.stdout.write('\n'.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+    def flush(self):
+        """ Writes out the buffered lines"""
+        if self.file is not None:
+            self.file.flush()
+            return
+        self.write_pending()
+        sys.stdout.flush()
+
+    def close(self):
+        """ Flushes and closes the writer, stdout is only flushed"""
+        if self.file is not None:
+            self.file.close()
+        else:
+            self.flush()
+
+class TableColumns(list):
+    """Column names of a table from the metadata, together with the type
+    declared for every column, None for columns without one, and the
+    storage format of the table's file"""
+
+    def __init__(self, columns=(), types=None, storage='csv'):
+        """
+        Default constructor
+        :param columns: column names of the table
+        :param types: type of every column, one of COLUMN_TYPES or None
+        :param storage: format of the table's file, one of STORAGE_FORMATS
+        """
+        list.__init__(self, columns)
+        self.types = list(types) if types is not None else [None] * len(self)
+        self.storage = storage
+
+    def append(self, column, kind=None):
+        """ Adds a column with its type"""
+        list.append(self, column)
+        self.types.append(kind)
+
+    def type_of(self, column):
+        """ Returns the declared type of the column, None if it has none"""
+        return self.types[self.index(column)]
+
+
+def column_types(columns):
+    """ Returns the declared type of every column of a table, None for
+    untyped columns. columns may be a plain list of names"""
+    return getattr(columns, 'types', None) or [None] * len(columns)
+
+
+def storage_format(columns):
+    """ Returns the storage format of a table's file declared in the
+    metadata. columns may be a plain list of names"""
+    return getattr(columns, 'storage', 'csv')
+
+
+def is_typed(columns):
+    """ Whether some column of the table has a declared type whose values
+    are not kept as strings"""
+    return any(kind not in (None, 'string') for kind in column_types(columns))
+
 
 def read_meta(file_name):
     """ Reads the Metadata of the file
-    returns a dictionary containing the info about table
+    returns a dictionary containing the info about table.
+    The table name may be followed by the storage format of its file.
+    A column line holds the column name, optionally followed by its type
     """
     try:
         meta_file = open(file_name, 'r')
@@ -19,34 +147,50 @@ def read_meta(file_name):
             if line == '<begin_table>':
                 start = True
             elif start:
-                table_name = line
-                table_info[table_name] = []
+                parts = line.split()
+                table_name = parts[0] if parts else line
+                storage = parts[1].lower() if len(parts) == 2 else 'csv'
+                if len(parts) > 2 or storage not in STORAGE_FORMATS:
+                    error_exit('ERR: Unknown storage format \'' +
+                               ' '.join(parts[1:]) + '\' of table \'' +
+                               table_name + '\'')
+                table_info[table_name] = TableColumns(storage=storage)
                 start = False
             elif line != '<end_table>':
-                table_info[table_name].append(line)
+                parts = line.split()
+                if len(parts) == 2 and parts[1].lower() in COLUMN_TYPES:
+                    table_info[table_name].append(parts[0], parts[1].lower())
+                elif len(parts) == 2:
+                    error_exit('ERR: Unknown type \'' + parts[1] + '\' of '
+                               'column \'' + parts[0] + '\' in table \'' +
+                               table_name + '\'')
+                else:
+                    table_info[table_name].append(line)
         return table_info
     except IOError:
         error_exit('No metadata file \'' + file_name + '\' found')
 
 
-def read_table_data(table_name):
-    """ Reads the csv file data and returns it as a list"""
-    data = []
-    file_name = table_name + '.csv'
+def table_file(table_name, storage='csv'):
+    """ Returns the name of the file holding the table data in the given
+    storage format"""
+    return table_name + STORAGE_FORMATS[storage]
+
+
+def scan_table(table_name):
+    """ Yields the rows of the table one at a time as they are read"""
     try:
-        data_file = open(file_name, 'rb')
-        reader = csv.reader(data_file)
-        for row in reader:
-            data.append(row)
-        data_file.close()
+        data_file = open(table_file(table_name), 'r', newline='')
     except IOError:
         error_exit('ERR: No file for given table: \'' + table_name + '\' found')
-    return data
+    with data_file:
+        for row in csv.reader(data_file):
+            yield row
 
 
-def check_for_string(string, lis):
-    """Checks whether string is in the list"""
-    return string in lis
+def read_table_data(table_name):
+    """ Reads the csv file data and returns it as a list"""
+    return list(scan_table(table_name))
 
 
 def format_string(string):
@@ -65,113 +209,61 @@ def generate_header(table_name, columns):
     return string
 
 
-def display_output(tables_needed, columns_in_table, table_info, tables_data, join):
-    """ Displays the output for a join operation without `where` clause"""
-    if join:
-        table1 = tables_needed[0]
-        table2 = tables_needed[1]
-        header1 = generate_header(table1, columns_in_table[table1])
-        header2 = generate_header(table2, columns_in_table[table2])
-        print(header1 + ',' + header2)
-        for item in tables_data:
-            ans = ''
-            for column in columns_in_table[table1]:
-                ans += item[table_info[table1].index(column)] + ','
-            for column in columns_in_table[table2]:
-                ans += item[table_info[table2].index(column) +
-                            len(table_info[table1])] + ','
-            print(ans.strip(','))
-
-    else:
-        for table in tables_needed:
-            print(generate_header(table, columns_in_table[table]))
-            for data in tables_data[table]:
-                ans = ''
-                for column in columns_in_table[table]:
-                    ans += data[table_info[table].index(column)] + ','
-                print(ans.strip(','))
-            print
+def row_formatter(positions, typed=False):
+    """ Returns a function building the output line of a row from the
+    values at the given positions. typed rows may hold values which are
+    not strings"""
+    if len(positions) == 1:
+        position = positions[0]
+        if typed:
+            return lambda row: str(row[position]).strip(',')
+        return lambda row: row[position].strip(',')
+    getter = itemgetter(*positions)
+    if typed:
+        return lambda row: ','.join(map(str, getter(row))).strip(',')
+    return lambda row: ','.join(getter(row)).strip(',')
+
+
+class QueryError(SystemExit):
+    """Error in a query or the data it reads. Exits the program with
+    status -1 unless it is caught"""
+
+    def __init__(self, message):
+        SystemExit.__init__(self, -1)
+        self.message = message
+
+    def __str__(self):
+        return self.message
 
 
 def error_exit(error):
-    """Prints the error to Stderr and exits the program"""
-    sys.stderr.write(error + '\n')
-    quit(-1)
-
-
-
-def join_needed_data(oper, tables, needed_data, tables_data):
-    """ Joins the data needed for where clause"""
-    if oper == 'and':
-        return join_data_and(tables, needed_data)
-    elif oper == 'or':
-        return join_data_or(tables, needed_data, tables_data)
-    else:
-        return join_data_single(tables, needed_data, tables_data)
-
-
-def join_data_and(tables, needed_data):
-    """ Joins the data if AND operator in condition"""
-    final_data = []
-    table1 = format_string(tables[0])
-    table2 = format_string(tables[1])
-    for item1 in needed_data[table1]:
-        for item2 in needed_data[table2]:
-            final_data.append(item1 + item2)
-    return final_data
-
-
-def join_data_or(tables, needed_data, tables_data):
-    """ Joins the data if OR operator in condition"""
-    final_data = []
-    table1 = format_string(tables[0])
-    table2 = format_string(tables[1])
-    for item1 in needed_data[table1]:
-        for item2 in tables_data[table2]:
-            if item2 not in needed_data[table2]:
-                final_data.append(item1 + item2)
-    for item1 in needed_data[table2]:
-        for item2 in tables_data[table1]:
-            if item2 not in needed_data[table1]:
-                final_data.append(item2 + item1)
-    return final_data
-
-
-def join_data_single(tables, needed_data, tables_data):
-    """ Joins the data with no AND/OR Operator"""
-    final_data = []
-    table1 = needed_data.keys()[0]
-    flag = False
-    table2 = tables[1]
-    if table1 == tables[1]:
-        table2 = tables[0]
-        flag = True
-    for item1 in needed_data[table1]:
-        for item2 in tables_data[table2]:
-            if not flag:
-                final_data.append(item2 + item1)
-                continue
-            final_data.append(item1 + item2)
-    return final_data
-
-def check_errors_in_select(query):
-    """ Check for errors in `select` part of the query """
-    lis = query.split('from')
-    if len(lis) > 2:
-        error_exit('Syntax Error: More than one \"from\" statement given')
-    if not check_for_string('select',
-                            format_string(str(lis[0])).lower().split()):
-        error_exit('Syntax Error: No Select statement given')
-    elif query.lower().count('select') > 1:
-        error_exit('More than one select statement given')
-
-
-def check_errors_in_clauses(clauses, columns, function_process,
-                            distinct_process):
+    """Prints the error to Stderr and exits the program. Inside
+    raised_errors the error is only raised, as a QueryError"""
+    if not getattr(ERRORS, 'quiet', False):
+        sys.stderr.write(error + '\n')
+    raise QueryError(error)
+
+
+@contextmanager
+def raised_errors():
+    """ Context manager in which error_exit raises its error without
+    printing it, for the current thread"""
+    quiet = getattr(ERRORS, 'quiet', False)
+    ERRORS.quiet = True
+    try:
+        yield
+    finally:
+        ERRORS.quiet = quiet
+
+
+
+def check_errors_in_clauses(condition, columns, function_process,
+                            distinct_process, group_by=None):
     """ Check for errors in where clauses"""
     if len(columns) + len(function_process) + len(distinct_process) < 1:
         error_exit('ERR: Nothing given to select')
-    if len(clauses) > 1 and (len(function_process) != 0 or len(distinct_process) != 0):
+    if condition is not None and group_by is None and \
+            (len(function_process) != 0 or len(distinct_process) != 0):
         error_exit('ERR: Where Condition can '
                    'only be given to project columns')
     elif len(distinct_process) != 0 and len(function_process) != 0:
@@ -188,12 +280,6 @@ def check_errors_in_condition(column, table_here, table, column_list):
                    table_here + '\' given')
 
 
-def check_error_in_where_clause(needed):
-    """ Check for errors in where clause"""
-    if len(needed) != 2:
-        error_exit('Syntax error in where clause')
-
-
 def check_errors_for_column(column, column_list, table_name):
     """ Check for columns in the table_name """
     if column not in column_list:
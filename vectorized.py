@@ -0,0 +1,90 @@
+"""
+Vectorized evaluation of where conditions and aggregates using NumPy.
+NumPy is optional, every function here is only used when it is installed
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from com.nb.dbms.predicates import to_value
+
+
+COMPARISONS = {'=': '__eq__', '<': '__lt__', '>': '__gt__', '<=': '__le__',
+               '>=': '__ge__', '!=': '__ne__', '<>': '__ne__'}
+
+
+def numpy_available():
+    """ Checks whether NumPy is installed"""
+    return numpy is not None
+
+
+def column_arrays(scan, indices):
+    """ Returns a dictionary mapping every index to a NumPy array of the
+    numbers in that column of the table, or None if some column holds
+    values that are not numbers"""
+    arrays = {}
+    remaining = []
+    for index in indices:
+        column = scan.numeric_column(index)
+        if column is not None:
+            arrays[index] = numpy.frombuffer(column, dtype=column.format)
+        else:
+            remaining.append(index)
+    if remaining:
+        values = dict((index, []) for index in remaining)
+        for row in scan:
+            for index in remaining:
+                values[index].append(to_value(row[index]))
+        for index in remaining:
+            array = numpy.array(values[index])
+            if array.dtype.kind not in 'iuf':
+                return None
+            arrays[index] = array
+    return arrays
+
+
+def condition_mask(tree, resolve, arrays):
+    """ Evaluates the condition tree from predicates.parse_condition over
+    whole columns and returns a boolean array with one entry per row, or
+    None if the condition compares strings"""
+    kind = tree[0]
+    if kind == 'col':
+        return arrays[resolve(tree[1])]
+    if kind == 'lit':
+        return None if isinstance(tree[1], str) else tree[1]
+    if kind == 'cmp':
+        left = condition_mask(tree[2], resolve, arrays)
+        right = condition_mask(tree[3], resolve, arrays)
+        if left is None or right is None:
+            return None
+        if not isinstance(left, numpy.ndarray):
+            left, right = right, left
+            oper = {'<': '>', '>': '<', '<=': '>=', '>=': '<='}.get(tree[1],
+                                                                   tree[1])
+        else:
+            oper = tree[1]
+        mask = getattr(left, COMPARISONS[oper])(right)
+        if not isinstance(mask, numpy.ndarray):
+            # comparison between two literals
+            return None
+        return mask
+    left = condition_mask(tree[1], resolve, arrays)
+    right = condition_mask(tree[2], resolve, arrays)
+    if left is None or right is None:
+        return None
+    return left & right if kind == 'and' else left | right
+
+
+def column_stats(array):
+    """ Returns the count, sum, minimum and maximum of an array of ints
+    as python numbers, or None if the array does not hold ints"""
+    if array.dtype.kind not in 'iu' or len(array) == 0:
+        return None
+    minimum, maximum = int(array.min()), int(array.max())
+    if max(abs(minimum), abs(maximum)) * len(array) < 2 ** 63:
+        total = int(array.sum(dtype=numpy.int64))
+    else:
+        # the sum could overflow int64
+        total = sum(int(value) for value in array)
+    return [len(array), total, minimum, maximum]
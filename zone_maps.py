@@ -0,0 +1,221 @@
+"""
+Zone maps of a table: statistics of every column over fixed size blocks
+of rows, used to skip the blocks that cannot hold rows satisfying a where
+condition
+"""
+import csv
+import io
+import json
+import math
+import os
+
+from com.nb.dbms.predicates import to_value
+from com.nb.dbms.table_storage import file_version, temporary_name, \
+typed_rows
+from com.nb.dbms.utility_functions import column_types, storage_format, \
+table_file
+
+
+ZONE_ROWS = 4096  # rows in a block
+HLL_PRECISION = 12  # log2 of the number of HyperLogLog registers
+FLIPPED = {'=': '=', '<': '>', '>': '<', '<=': '>=', '>=': '<=', '!=': '!=',
+           '<>': '<>'}
+
+
+def zone_map_file(table_name):
+    """ Returns the file holding the zone map of the table"""
+    return '.' + table_name + '.zones'
+
+
+class HyperLogLog:
+    """Approximate count of distinct values in a fixed amount of memory"""
+
+    def __init__(self, precision=HLL_PRECISION):
+        """
+        Default constructor
+        :param precision: log2 of the number of registers
+        """
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """ Counts a string value"""
+        hashed = hash(value) & 0xFFFFFFFFFFFFFFFF
+        rest_bits = 64 - self.precision
+        rest = hashed & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        index = hashed >> rest_bits
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        """ Returns the estimated number of distinct values counted"""
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / sum(2.0 ** -rank
+                                        for rank in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            # linear counting is more accurate for small counts
+            return int(round(size * math.log(float(size) / zeros)))
+        return int(round(raw))
+
+
+def column_zone(values):
+    """ Returns [min, max, null count, distinct count] of a block of a
+    column. Empty values are nulls. min and max are None when the block
+    mixes numbers and strings or holds only nulls"""
+    present = [to_value(value) for value in values if value != '']
+    zone = [None, None, len(values) - len(present), len(set(values))]
+    if present:
+        strings = sum(1 for value in present if isinstance(value, str))
+        if strings == 0 or strings == len(present):
+            zone[0], zone[1] = min(present), max(present)
+    return zone
+
+
+class ZoneMap:
+    """Statistics of the blocks of ZONE_ROWS rows of a table together with
+    the byte range of every block in the csv file. The zone map is stored
+    next to the csv and rebuilt when the csv changes"""
+
+    def __init__(self, table_name, columns):
+        """
+        Default constructor
+        :param table_name: name of the table
+        :param columns: column names of the table from the metadata
+        """
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.types = column_types(columns)
+        self.storage = storage_format(columns)
+        self.file_name = zone_map_file(table_name)
+        self.blocks = []
+        self.distinct = []
+
+    def build(self):
+        """ Reads the csv and writes the zone map for it. Returns False if
+        the csv has empty lines or rows whose length does not match the
+        metadata"""
+        version = file_version(table_file(self.table_name))
+        width = len(self.columns)
+        sketches = [HyperLogLog() for _ in range(width)]
+        blocks = []
+        with open(table_file(self.table_name), 'rb') as data_file:
+            offset = 0
+            while True:
+                lines = []
+                start = offset
+                for line in data_file:
+                    offset += len(line)
+                    if not line.strip():
+                        # rows would not line up with the rows of the scan
+                        return False
+                    lines.append(line.decode('utf-8'))
+                    if len(lines) == ZONE_ROWS:
+                        break
+                if not lines:
+                    break
+                rows = list(csv.reader(lines))
+                if any(len(row) != width for row in rows):
+                    return False
+                columns = list(zip(*rows))
+                for sketch, values in zip(sketches, columns):
+                    for value in set(values):
+                        sketch.add(value)
+                blocks.append({'offset': start, 'end': offset,
+                               'rows': len(rows),
+                               'zones': [column_zone(values)
+                                         for values in columns]})
+        temp = temporary_name(self.file_name)
+        with open(temp, 'w') as zone_file:
+            json.dump({'version': version, 'columns': self.columns,
+                       'block_rows': ZONE_ROWS, 'blocks': blocks,
+                       'distinct': [sketch.estimate()
+                                    for sketch in sketches]}, zone_file)
+        os.replace(temp, self.file_name)
+        return True
+
+    def load(self):
+        """ Reads the zone map, building it first if the csv has changed
+        since it was built. Returns False when it could not be built or
+        the table is not stored as csv"""
+        if self.storage != 'csv':
+            return False
+        try:
+            with open(self.file_name) as zone_file:
+                meta = json.load(zone_file)
+        except (IOError, ValueError):
+            meta = None
+        if meta is None or meta['columns'] != self.columns or \
+                meta['block_rows'] != ZONE_ROWS or \
+                meta['version'] != file_version(table_file(self.table_name)):
+            if not self.build():
+                return False
+            return self.load()
+        self.blocks = meta['blocks']
+        self.distinct = meta['distinct']
+        return True
+
+    def candidate_blocks(self, tree, resolve):
+        """ Returns the numbers of the blocks which may hold rows
+        satisfying the condition tree"""
+        return [number for number, block in enumerate(self.blocks)
+                if may_match(tree, block['zones'], resolve)]
+
+    def read_blocks(self, numbers, table_data):
+        """ Yields the rows of the given blocks, from the rows of the table
+        when they are in memory, otherwise from the byte ranges of the
+        blocks in the csv. Rows are typed like the rows of a scan of the
+        table"""
+        for number in numbers:
+            block = self.blocks[number]
+            start = number * ZONE_ROWS
+            if isinstance(table_data, list):
+                rows = table_data[start:start + block['rows']]
+            else:
+                rows = typed_rows(self.read_csv_block(block), self.table_name,
+                                  self.types)
+            for row in rows:
+                yield row
+
+    def read_csv_block(self, block):
+        """ Returns the rows in the byte range of the block in the csv"""
+        with open(table_file(self.table_name), 'rb') as data_file:
+            data_file.seek(block['offset'])
+            text = data_file.read(block['end'] - block['offset'])
+        return [row for row in csv.reader(io.StringIO(text.decode('utf-8'),
+                                                       newline='')) if row]
+
+
+def may_match(tree, zones, resolve):
+    """ Whether a block with the given column zones may hold a row
+    satisfying the condition tree. Only comparisons of a column with a
+    literal of the same kind as the column's values can rule a block out"""
+    kind = tree[0]
+    if kind == 'and':
+        return may_match(tree[1], zones, resolve) and \
+            may_match(tree[2], zones, resolve)
+    if kind == 'or':
+        return may_match(tree[1], zones, resolve) or \
+            may_match(tree[2], zones, resolve)
+    oper, left, right = tree[1], tree[2], tree[3]
+    if left[0] == 'lit' and right[0] == 'col':
+        oper, left, right = FLIPPED[oper], right, left
+    if left[0] != 'col' or right[0] != 'lit':
+        return True
+    minimum, maximum = zones[resolve(left[1])][:2]
+    value = right[1]
+    if minimum is None or isinstance(value, str) != isinstance(minimum, str):
+        return True
+    if oper == '=':
+        return minimum <= value <= maximum
+    if oper == '<':
+        return minimum < value
+    if oper == '<=':
+        return minimum <= value
+    if oper == '>':
+        return maximum > value
+    if oper == '>=':
+        return maximum >= value
+    return not minimum == maximum == value